@@ -21,6 +21,15 @@ def get_sanitized_list( ckstr ):
     return cklist
 
 
+# Retrieve names of workflow steps from template string, either
+# all steps or only steps with (or without) shards (e.g., "fetch*8").
+def get_workflow_steps( ckstr, sharded = None ):
+    return [
+        s.partition( '*' )[0] for s in get_sanitized_list( ckstr )
+        if sharded is None or sharded == ( '*' in s )
+    ]
+
+
 # Helper function for copying default files.
 def copy_files( items, path, default_file, file_extension ):
     src = Path( path, default_file )
@@ -35,7 +44,7 @@ def copy_all_files():
     try:
         # Create dummy environment files for all workflow steps.
         copy_files(
-            items = get_sanitized_list(
+            items = get_workflow_steps(
                 '{{ cookiecutter.workflow_steps }}'
             ),
             path = Path( '.', 'workflow', 'envs' ),
@@ -43,15 +52,27 @@ def copy_all_files():
             file_extension = '.yml'
         )
 
-        # Create dummy scripts for all workflow steps.
+        # Create dummy scripts for all workflow steps without shards.
         copy_files(
-            items = get_sanitized_list(
-                '{{ cookiecutter.workflow_steps }}'
+            items = get_workflow_steps(
+                '{{ cookiecutter.workflow_steps }}',
+                sharded = False
             ),
             path = Path( '.', 'workflow', 'scripts' ),
             default_file = 'default.py',
             file_extension = '.py'
         )
+
+        # Create dummy scripts for all sharded workflow steps.
+        copy_files(
+            items = get_workflow_steps(
+                '{{ cookiecutter.workflow_steps }}',
+                sharded = True
+            ),
+            path = Path( '.', 'workflow', 'scripts' ),
+            default_file = 'default_shard.py',
+            file_extension = '.py'
+        )
     except:
         return False
 
@@ -27,9 +27,10 @@ MAIL_ADDRESS_REGEX = re.compile(
 )
 
 
-# Regex object for Snakemake rule names sanity check.
-RULE_REGEX =  re.compile(
-    r'^[^\d\W]\w*\Z',
+# Regex object for workflow steps sanity check (Snakemake rule name, optionally
+# followed by the number of shards of a sharded step, e.g., "fetch*8").
+STEP_REGEX =  re.compile(
+    r'^[^\d\W]\w*(?:\*[1-9]\d*)?\Z',
     re.UNICODE
 )
 
@@ -70,11 +71,22 @@ def check_template_variables():
             '{{ cookiecutter.workflow_steps }}'
         ),
         validators = [
-            partial( validate_expression, RULE_REGEX ),
+            partial( validate_expression, STEP_REGEX ),
         ],
         err = 'Invalid name for workflow step: {}'
     )
 
+    # The output of the last workflow step is the target of the workflow, hence it cannot be sharded.
+    check_last_workflow_step = check(
+        items = get_sanitized_list(
+            '{{ cookiecutter.workflow_steps }}'
+        )[-1:],
+        validators = [
+            lambda step: '*' not in step,
+        ],
+        err = 'Last workflow step cannot be sharded (add a step that gathers all shards): {}'
+    )
+
 
     # Sanity check of mail addresses / sitenames.
     check_credentials = check(
@@ -88,7 +100,7 @@ def check_template_variables():
         err = 'Invalid sitename / mail address: {}'
     )
 
-    return all( [ check_workflow_steps, check_credentials ] )
+    return all( [ check_workflow_steps, check_last_workflow_step, check_credentials ] )
 
 
 if __name__ == '__main__':
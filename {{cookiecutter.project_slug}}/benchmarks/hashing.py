@@ -0,0 +1,110 @@
+# Hashing Throughput Benchmark
+#
+# This script compares the throughput of the variants for computing
+# file digests (digest algorithm, buffered reading vs. mmap, number of
+# workers) on a set of temporary files.
+#
+# Usage (from the project root folder):
+#   python benchmarks/hashing.py [-n NUM_FILES] [-s SIZE_MB] [-j NUM_WORKERS]
+
+from argparse import ArgumentParser
+from os import cpu_count, urandom
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from {{ cookiecutter.project_slug }}.utils.file_hasher import DIGEST_ALGORITHMS, FileHasher
+
+
+def create_files( dir, num_files, size_mb ):
+
+    # Write files with random content (1 MB chunks).
+    chunk = urandom( 1024*1024 )
+    files = []
+    for i in range( num_files ):
+        file_name = Path( dir, 'file{}.bin'.format( i ) )
+        with open( file_name, 'wb' ) as f:
+            for _ in range( size_mb ):
+                f.write( chunk )
+        files.append( str( file_name ) )
+    return files
+
+
+def benchmark( files, total_mb, repeat, **kwargs ):
+
+    hasher = FileHasher( **kwargs )
+
+    # Best of several runs (the first run also warms up the page cache).
+    best = None
+    for _ in range( repeat ):
+        start = perf_counter()
+        hasher.digests( files )
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min( best, elapsed )
+
+    return total_mb / best
+
+
+def main():
+
+    # Command line parser.
+    parser = ArgumentParser(
+        description = 'Compare the throughput of file hashing variants.'
+    )
+
+    parser.add_argument(
+        '-n', '--num-files',
+        default = 8,
+        type = int,
+        help = 'number of files (default: 8)'
+    )
+
+    parser.add_argument(
+        '-s', '--size-mb',
+        default = 64,
+        type = int,
+        help = 'size of each file in MB (default: 64)'
+    )
+
+    parser.add_argument(
+        '-j', '--num-workers',
+        default = cpu_count() or 1,
+        type = int,
+        help = 'number of concurrent workers (default: number of CPUs)'
+    )
+
+    parser.add_argument(
+        '-r', '--repeat',
+        default = 3,
+        type = int,
+        help = 'number of runs per variant, the best run is reported (default: 3)'
+    )
+
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as dir:
+
+        files = create_files( dir, args.num_files, args.size_mb )
+        total_mb = args.num_files * args.size_mb
+
+        print( '{:<10} {:<8} {:>8} {:>12}'.format( 'algorithm', 'read', 'workers', 'MB/s' ) )
+
+        for algorithm in DIGEST_ALGORITHMS:
+            for read, mmap_threshold in [ ( 'buffer', None ), ( 'mmap', 0 ) ]:
+                for num_workers in sorted( { 1, args.num_workers } ):
+
+                    throughput = benchmark(
+                        files,
+                        total_mb,
+                        args.repeat,
+                        num_workers = num_workers,
+                        algorithm = algorithm,
+                        mmap_threshold = mmap_threshold
+                    )
+
+                    print( '{:<10} {:<8} {:>8} {:>12.1f}'.format( algorithm, read, num_workers, throughput ) )
+
+
+if __name__ == '__main__':
+
+    main()
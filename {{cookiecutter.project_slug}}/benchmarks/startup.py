@@ -0,0 +1,118 @@
+# Startup Time Benchmark
+#
+# This script measures the import time of every command line script (as
+# reported by "python -X importtime", each in a fresh interpreter) and
+# checks that no heavy module (e.g., Snakemake or pycryptodome) is imported
+# on startup. It exits with a non-zero status if an entry point exceeds the
+# threshold or imports a heavy module, such that it can be used in CI.
+#
+# Usage (from the project root folder):
+#   python benchmarks/startup.py [-t THRESHOLD_MS] [-r REPEAT]
+
+from argparse import ArgumentParser
+from subprocess import run
+from sys import executable, exit
+
+
+# Command line scripts (modules of the entry points).
+ENTRY_POINTS = [
+    '{{ cookiecutter.project_slug }}.cli.create_envs',
+    '{{ cookiecutter.project_slug }}.cli.freeze',
+    '{{ cookiecutter.project_slug }}.cli.pwd',
+    '{{ cookiecutter.project_slug }}.cli.runonce',
+    '{{ cookiecutter.project_slug }}.cli.loop',
+    '{{ cookiecutter.project_slug }}.cli.backfill',
+    '{{ cookiecutter.project_slug }}.cli.compact',
+]
+
+# Modules that must only be imported by the code paths that use them.
+HEAVY_MODULES = [
+    'snakemake',
+    'Crypto',
+    'cProfile',
+    'pstats',
+    'concurrent.futures.process',
+]
+
+
+def import_time( module ):
+
+    # Import the module in a fresh interpreter (the import times are written to stderr).
+    result = run(
+        [ executable, '-X', 'importtime', '-c', 'import {}'.format( module ) ],
+        capture_output = True,
+        text = True
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError( 'Importing module "{}" failed:\n{}'.format( module, result.stderr ) )
+
+    # Each line has the format "import time: <self us> | <cumulative us> | <indented module name>".
+    cumulative = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith( 'import time:' ):
+            continue
+        fields = line[len( 'import time:' ):].split( '|' )
+        if len( fields ) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        imported.add( name )
+        if name == module:
+            cumulative = int( fields[1] ) / 1000.
+
+    return cumulative, imported
+
+
+def main():
+
+    # Command line parser.
+    parser = ArgumentParser(
+        description = 'Measure the import time of the command line scripts and check for regressions.'
+    )
+
+    parser.add_argument(
+        '-t', '--threshold-ms',
+        default = 200.,
+        type = float,
+        help = 'maximum import time per command line script in milliseconds (default: 200)'
+    )
+
+    parser.add_argument(
+        '-r', '--repeat',
+        default = 5,
+        type = int,
+        help = 'number of imports per command line script, the best run is reported (default: 5)'
+    )
+
+    args = parser.parse_args()
+
+    failed = False
+
+    print( '{:<40} {:>10}  {}'.format( 'module', 'ms', 'heavy modules' ) )
+
+    for module in ENTRY_POINTS:
+
+        # Best of several runs (the first run also warms up the file system cache).
+        best = None
+        heavy = set()
+        for _ in range( args.repeat ):
+            ms, imported = import_time( module )
+            best = ms if best is None else min( best, ms )
+            heavy |= { h for h in HEAVY_MODULES if h in imported }
+
+        regression = best > args.threshold_ms or heavy
+        failed = failed or regression
+
+        print( '{:<40} {:>10.1f}  {}{}'.format(
+            module, best, ', '.join( sorted( heavy ) ) or '-', '  FAILED' if regression else ''
+        ) )
+
+    if failed:
+        print( '\nStartup time regression (threshold: {} ms)!'.format( args.threshold_ms ) )
+        exit( 1 )
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,92 @@
+# Workflow Session Benchmark
+#
+# This script measures the per-iteration overhead of executing the workflow
+# with function run_workflow (parsing the Snakefile for every execution) and
+# with a workflow session (parsing the Snakefile only once). The workflow is
+# only dry-run, i.e., the measured time is the overhead of each execution.
+#
+# Usage (from the project root folder):
+#   python benchmarks/workflow_session.py [-n NUM_RUNS]
+
+from argparse import ArgumentParser
+from contextlib import redirect_stderr, redirect_stdout
+from os import devnull
+from time import perf_counter
+
+from {{ cookiecutter.project_slug }}.utils.run_workflow import run_workflow
+from {{ cookiecutter.project_slug }}.utils.workflow_config import WorkflowConfig
+from {{ cookiecutter.project_slug }}.utils.workflow_session import WorkflowSession
+
+
+def benchmark( run, num_runs ):
+
+    # Time of each run (Snakemake output is discarded).
+    times = []
+    with open( devnull, 'w' ) as f, redirect_stdout( f ), redirect_stderr( f ):
+        for i in range( num_runs ):
+            start = perf_counter()
+            if not run( 'benchmark{}'.format( i ) ):
+                raise RuntimeError( 'Workflow execution failed' )
+            times.append( perf_counter() - start )
+
+    return times
+
+
+def main():
+
+    # Command line parser.
+    parser = ArgumentParser(
+        description = 'Compare the per-iteration overhead of run_workflow and a workflow session.'
+    )
+
+    parser.add_argument(
+        '-n', '--num-runs',
+        default = 20,
+        type = int,
+        help = 'number of workflow executions per variant (default: 20)'
+    )
+
+    args = parser.parse_args()
+
+    workflow_config = WorkflowConfig( root_dir = '.' )
+
+    def target( run_id ):
+        # Synthetic run IDs, the outputs of all runs are placed in the same partition.
+        return workflow_config.target().format( run_id = run_id, partition = 'benchmark' )
+
+    def run_once( run_id ):
+        return run_workflow(
+            config_file = workflow_config.file_path(),
+            target = target( run_id ),
+            root_dir = '.',
+            forceall = False,
+            dryrun = True,
+            conda_create_envs_only = False,
+            num_cores = workflow_config.num_cores()
+        )
+
+    session = WorkflowSession(
+        config_file = workflow_config.file_path(),
+        root_dir = '.',
+        num_cores = workflow_config.num_cores()
+    )
+
+    def run_session( run_id ):
+        return session.run( target = target( run_id ), forceall = False, dryrun = True )
+
+    times_once = benchmark( run_once, args.num_runs )
+    times_session = benchmark( run_session, args.num_runs )
+
+    # The first session run includes parsing the workflow, report it separately.
+    mean_once = sum( times_once ) / len( times_once )
+    mean_session = sum( times_session[1:] ) / max( 1, len( times_session ) - 1 )
+
+    print( 'run_workflow:           {:8.1f} ms per iteration'.format( 1e3 * mean_once ) )
+    print( 'session (first run):    {:8.1f} ms'.format( 1e3 * times_session[0] ) )
+    print( 'session (further runs): {:8.1f} ms per iteration'.format( 1e3 * mean_session ) )
+    print( 'overhead saved:         {:8.1f} ms per iteration'.format( 1e3 * ( mean_once - mean_session ) ) )
+
+
+if __name__ == '__main__':
+
+    main()
@@ -29,6 +29,8 @@ setup(
             '{{ cookiecutter.project_slug }}_pwd = {{ cookiecutter.project_slug }}.cli.pwd:main',
             '{{ cookiecutter.project_slug }}_runonce = {{ cookiecutter.project_slug }}.cli.runonce:main',
             '{{ cookiecutter.project_slug }}_loop = {{ cookiecutter.project_slug }}.cli.loop:main',
+            '{{ cookiecutter.project_slug }}_backfill = {{ cookiecutter.project_slug }}.cli.backfill:main',
+            '{{ cookiecutter.project_slug }}_compact = {{ cookiecutter.project_slug }}.cli.compact:main',
         ]
     },
 )
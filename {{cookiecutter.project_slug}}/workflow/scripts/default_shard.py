@@ -0,0 +1,16 @@
+from pathlib import Path
+
+
+def main( output_file_name, shard, num_shards ):
+
+    # Write dummy output file (shard number "shard" out of "num_shards" shards).
+    Path( output_file_name ).touch()
+
+
+if __name__ == '__main__':
+
+    main(
+        output_file_name = snakemake.output[0],
+        shard = int( snakemake.wildcards.shard ),
+        num_shards = snakemake.config[snakemake.rule]['shards']
+    )
\ No newline at end of file
@@ -4,3 +4,12 @@ SNAKE_FILE_NAME = Path( 'workflow', 'Snakefile' )
 CONFIG_FILE_NAME = Path( 'workflow', 'config.json' )
 CREDENTIALS_CACHE_FILE_NAME = Path( '.cache' )
 FREEZE_FILE_NAME = Path( '.freeze' )
+FREEZE_INDEX_FILE_NAME = Path( '.freeze_index' )
+RESULT_CACHE_DIR_NAME = Path( '.result_cache' )
+METRICS_LEDGER_FILE_NAME = Path( '.metrics.jsonl' )
+PROFILE_DIR_NAME = Path( '.profile' )
+CONDA_STORE_DIR_NAME = Path( '.conda_store' )
+DATA_DIR_NAME = Path( 'data' )
+ARCHIVE_DIR_NAME = Path( 'archive' )
+
+CREDENTIALS_AGENT_SOCKET_VAR = '{{ cookiecutter.project_slug | upper }}_AGENT_SOCK'
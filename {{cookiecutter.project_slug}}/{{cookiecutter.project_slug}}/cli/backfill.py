@@ -0,0 +1,321 @@
+from argparse import ArgumentParser, ArgumentTypeError
+from datetime import datetime, timedelta
+from sys import exit
+
+from ..utils.credentials_agent import CredentialsAgent
+from ..utils.credentials_cache import CredentialsCache
+from ..utils.freeze_workflow import FreezeWorkflow
+from ..utils.metrics import Metrics
+from ..utils.scheduler import CronSchedule, IntervalSchedule, schedule_slots
+from ..utils.workflow_config import WorkflowConfig
+from ..utils.run_workflow import run_workflow
+
+
+def parse_datetime( value ):
+    '''
+    Parse a date and time in ISO format (e.g., "2021-03-01" or "2021-03-01T12:00").
+    '''
+    try:
+        return datetime.fromisoformat( value )
+    except ValueError:
+        raise ArgumentTypeError( 'invalid date and time (ISO format expected): "{}"'.format( value ) )
+
+
+def main():
+
+    # Command line parser.
+    parser = ArgumentParser(
+        description = 'Run workflow for all run IDs of a past time range (e.g., after an outage). The default period is one day.'
+    )
+
+    parser.add_argument(
+        'root_dir',
+        nargs = '?',
+        default = '.',
+        metavar = '{{ cookiecutter.project_slug | upper }}_DIR',
+        help = 'workflow root directory'
+    )
+
+    parser.add_argument(
+        '-s', '--start',
+        required = True,
+        type = parse_datetime,
+        help = 'start of the time range (ISO format, e.g., 2021-03-01T12:00)'
+    )
+
+    parser.add_argument(
+        '-e', '--end',
+        default = None,
+        type = parse_datetime,
+        help = 'end of the time range (ISO format, default: now)'
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action = 'store_true',
+        help = 'output additional information'
+    )
+
+    parser.add_argument(
+        '-f', '--forceall',
+        action = 'store_true',
+        help = 'force all output files to be re-created'
+    )
+
+    parser.add_argument(
+        '-d', '--dryrun',
+        action = 'store_true',
+        help = 'only dry-run the workflow'
+    )
+
+    parser.add_argument(
+        '-k', '--keep-going',
+        action = 'store_true',
+        help = 'keep executing the runs if a job fails'
+    )
+
+    parser.add_argument(
+        '-D', '--days',
+        default = 0,
+        type = int,
+        help = 'period days'
+    )
+
+    parser.add_argument(
+        '-H', '--hours',
+        default = 0,
+        type = int,
+        help = 'period hours'
+    )
+
+    parser.add_argument(
+        '-M', '--minutes',
+        default = 0,
+        type = int,
+        help = 'period minutes'
+    )
+
+    parser.add_argument(
+        '-S', '--seconds',
+        default = 0,
+        type = int,
+        help = 'period seconds'
+    )
+
+    parser.add_argument(
+        '-C', '--cron',
+        default = None,
+        metavar = 'EXPR',
+        help = 'define the run times by a cron expression (e.g., "30 2 * * mon-fri") instead of a period'
+    )
+
+    parser.add_argument(
+        '-A', '--align',
+        action = 'store_true',
+        help = 'align the period to midnight instead of the start of the time range'
+    )
+
+    parser.add_argument(
+        '-b', '--batch-size',
+        default = None,
+        type = int,
+        metavar = 'N',
+        help = 'maximum number of runs per workflow execution (default: all runs in a single execution)'
+    )
+
+    parser.add_argument(
+        '-i', '--incremental',
+        action = 'store_true',
+        help = 'only re-hash files whose status changed since the last freeze check'
+    )
+
+    parser.add_argument(
+        '-j', '--hash-jobs',
+        default = None,
+        type = int,
+        metavar = 'N',
+        help = 'number of concurrent workers for hashing files (default: number of cores from workflow configuration)'
+    )
+
+    parser.add_argument(
+        '--hash-executor',
+        default = 'thread',
+        choices = [ 'thread', 'process' ],
+        help = 'use threads or processes for hashing files (default: thread)'
+    )
+
+    parser.add_argument(
+        '--fail-fast',
+        action = 'store_true',
+        help = 'stop the freeze check at the first modified directory'
+    )
+
+    parser.add_argument(
+        '--no-metrics',
+        action = 'store_true',
+        help = 'do not record metrics of the workflow executions'
+    )
+
+    parser.add_argument(
+        '--no-freeze',
+        action = 'store_true',
+        help = 'do not check if workflow has been frozen'
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action = 'store_true',
+        help = 'do not load credentials cache'
+    )
+
+    parser.add_argument(
+        '--no-agent',
+        action = 'store_true',
+        help = 'do not provide the credentials to the workflow jobs via a local agent'
+    )
+
+    # Retrieve command line arguments.
+    args = parser.parse_args()
+
+    no_period = ( args.days == 0 and
+                  args.hours == 0 and
+                  args.minutes == 0 and
+                  args.seconds == 0 )
+
+    if args.cron is not None and not no_period:
+        parser.error( 'a cron expression cannot be combined with a period' )
+
+    if args.cron is not None and args.align:
+        parser.error( 'a cron expression cannot be combined with option --align' )
+
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error( 'the batch size has to be positive' )
+
+    if no_period:
+        # If nothing else is specified, set default period to 1 day.
+        args.days = 1
+
+    if args.end is None:
+        args.end = datetime.now()
+
+    # Credentials agent (started after loading the credentials cache).
+    agent = None
+
+    # Timing metrics of the workflow executions (recorded once the workflow configuration has been loaded).
+    metrics = Metrics()
+
+    try:
+        # Check if workflow definition has remained unchanged.
+        if not args.no_freeze:
+            freeze = FreezeWorkflow(
+                dir = args.root_dir,
+                verbose = args.verbose,
+                incremental = args.incremental,
+                num_workers = args.hash_jobs,
+                executor = args.hash_executor
+            )
+
+            with metrics.phase( 'freeze_check' ):
+                frozen = freeze.check( fail_fast = args.fail_fast )
+
+            if not frozen:
+                print( '\nFreeze the workflow before executing it!' )
+                exit( 1 )
+
+        # Load config file.
+        workflow_config = WorkflowConfig(
+            root_dir = args.root_dir
+        )
+
+        # Record metrics of the workflow executions (except for dry runs).
+        if not args.no_metrics and not args.dryrun:
+            metrics.configure( workflow_config.metrics(), args.root_dir )
+
+        # Define schedule (cron expression or period).
+        if args.cron is not None:
+            schedule = CronSchedule( args.cron )
+        else:
+            period = timedelta(
+                days = args.days,
+                hours = args.hours,
+                minutes = args.minutes,
+                seconds = args.seconds
+            )
+            schedule = IntervalSchedule( period, align = args.align )
+
+        # Define run IDs for all slots in the time range (slots with the same run ID are only run once).
+        run_id_format = workflow_config.run_id_format()
+        run_ids = list( dict.fromkeys(
+            run_id_format.format( slot ) for slot in schedule_slots( schedule, args.start, args.end )
+        ) )
+
+        if not run_ids:
+            print( 'No runs between {} and {}.'.format( args.start, args.end ) )
+            return
+
+        print( 'Backfilling {} runs ({} to {}).'.format( len( run_ids ), run_ids[0], run_ids[-1] ) )
+        if args.verbose:
+            for run_id in run_ids:
+                print( ' - {}'.format( run_id ) )
+
+        # Initialise credentials cache (for further use during the snakemake workflow).
+        if not args.no_cache:
+            with metrics.phase( 'credentials_unlock' ):
+                credentials_cache = CredentialsCache(
+                    new_cache = False
+                )
+
+            # Provide the unlocked credentials cache to the workflow jobs via a local agent.
+            if not args.no_agent and CredentialsAgent.supported():
+                agent = CredentialsAgent( credentials_cache )
+                agent.start()
+
+        # Execute the runs in batches. All runs of a batch are targets of a single snakemake call,
+        # such that building the DAG is done once and the jobs of all runs share the cores.
+        batch_size = args.batch_size or len( run_ids )
+        success = True
+        for i in range( 0, len( run_ids ), batch_size ):
+            batch = run_ids[i:i + batch_size]
+
+            # Metrics of the batch (identified by its first and last run ID).
+            run_metrics = metrics.run( batch[0] if len( batch ) == 1 else '{}..{}'.format( batch[0], batch[-1] ) )
+            run_metrics.start()
+
+            batch_success = run_workflow(
+                config_file = workflow_config.file_path(),
+                target = [ workflow_config.run_target( run_id ) for run_id in batch ],
+                root_dir = args.root_dir,
+                forceall = args.forceall,
+                dryrun = args.dryrun,
+                conda_create_envs_only = False,
+                num_cores = workflow_config.num_cores(),
+                resources = workflow_config.resources(),
+                keepgoing = args.keep_going,
+                log_handler = [ run_metrics.log_handler ]
+            )
+
+            run_metrics.finish( batch_success )
+
+            if not batch_success:
+                print( 'Workflow execution failed for runs {} to {}.'.format( batch[0], batch[-1] ) )
+                success = False
+
+                if not args.keep_going:
+                    break
+
+        if not success:
+            exit( 2 )
+
+    except Exception as err:
+
+        print( err )
+        exit( 100 )
+
+    finally:
+
+        if agent is not None:
+            agent.stop()
+
+
+if __name__ == '__main__':
+    main()
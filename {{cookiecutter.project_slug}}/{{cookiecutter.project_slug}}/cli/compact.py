@@ -0,0 +1,116 @@
+from argparse import ArgumentParser
+from sys import exit
+
+from ..utils.data_archive import DataArchive
+from ..utils.workflow_config import WorkflowConfig
+
+
+def main():
+
+    # Command line parser.
+    parser = ArgumentParser(
+        description = 'Compact the output files of old workflow runs into archives (see entry "retention" of the workflow configuration) or extract them again.'
+    )
+
+    parser.add_argument(
+        'root_dir',
+        nargs = '?',
+        default = '.',
+        metavar = '{{ cookiecutter.project_slug | upper }}_DIR',
+        help = 'workflow root directory'
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action = 'store_true',
+        help = 'output additional information'
+    )
+
+    parser.add_argument(
+        '-d', '--dryrun',
+        action = 'store_true',
+        help = 'only show which runs would be compacted and which archives would be deleted'
+    )
+
+    parser.add_argument(
+        '-l', '--list',
+        action = 'store_true',
+        help = 'list all archived runs'
+    )
+
+    parser.add_argument(
+        '-x', '--extract',
+        default = None,
+        metavar = 'RUN_ID',
+        help = 'extract the output files of an archived run instead of compacting'
+    )
+
+    parser.add_argument(
+        '-s', '--step',
+        action = 'append',
+        default = None,
+        help = 'only extract the output files of this workflow step (can be repeated)'
+    )
+
+    parser.add_argument(
+        '-o', '--output-dir',
+        default = None,
+        metavar = 'DIR',
+        help = 'extract the output files below this directory (default: workflow root directory)'
+    )
+
+    parser.add_argument(
+        '--overwrite',
+        action = 'store_true',
+        help = 'overwrite existing files when extracting'
+    )
+
+    args = parser.parse_args()
+
+    if args.extract is None and ( args.step is not None or args.output_dir is not None or args.overwrite ):
+        parser.error( 'options --step, --output-dir and --overwrite require option --extract' )
+
+    try:
+        # Load config file.
+        workflow_config = WorkflowConfig(
+            root_dir = args.root_dir
+        )
+
+        data_archive = DataArchive( workflow_config, root_dir = args.root_dir )
+
+        if args.list:
+            # List archived runs.
+            for run_id, archive in sorted( data_archive.archived_runs().items() ):
+                print( '{}  {}'.format( run_id, archive.relative_to( data_archive.root_dir ) ) )
+
+        elif args.extract is not None:
+            # Extract the output files of a run.
+            extracted = data_archive.extract(
+                args.extract,
+                steps = args.step,
+                output_dir = args.output_dir,
+                overwrite = args.overwrite
+            )
+
+            if args.verbose:
+                for f in extracted:
+                    print( ' - {}'.format( f ) )
+
+            print( 'Extracted {} files of run {}.'.format( len( extracted ), args.extract ) )
+
+        else:
+            # Compact the output files of all runs that are not retained.
+            compacted = data_archive.compact( dryrun = args.dryrun, verbose = args.verbose )
+
+            if not args.dryrun:
+                print( 'Compacted {} runs.'.format( compacted ) )
+
+    except Exception as err:
+
+        print( err )
+        exit( 100 )
+
+
+if __name__ == '__main__':
+
+    main()
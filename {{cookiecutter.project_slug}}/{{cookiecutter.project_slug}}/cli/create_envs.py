@@ -1,11 +1,17 @@
+import platform
 from argparse import ArgumentParser
 from datetime import datetime
+from pathlib import Path
 from sys import exit
 
+from ..utils.conda_envs import CondaEnvs
 from ..utils.credentials_cache import CredentialsCache
 from ..utils.freeze_workflow import FreezeWorkflow
+from ..utils.profiler import Profiler
 from ..utils.workflow_config import WorkflowConfig
 from ..utils.run_workflow import run_workflow
+from ..utils.workflow_session import WorkflowSession
+from .._config import CONDA_STORE_DIR_NAME, PROFILE_DIR_NAME
 
 
 def main():
@@ -23,30 +29,138 @@ def main():
         help = 'workflow root directory'
     )
 
+    parser.add_argument(
+        '-j', '--jobs',
+        default = None,
+        type = int,
+        metavar = 'N',
+        help = 'maximum number of conda environments created concurrently (default: number of cores from workflow configuration)'
+    )
+
+    parser.add_argument(
+        '--store',
+        default = str( CONDA_STORE_DIR_NAME ),
+        metavar = 'DIR',
+        help = 'store of solved conda environments, relative to the workflow root directory (default: {})'.format( CONDA_STORE_DIR_NAME )
+    )
+
+    parser.add_argument(
+        '--no-store',
+        action = 'store_true',
+        help = 'do not use the store of solved conda environments'
+    )
+
+    parser.add_argument(
+        '--import',
+        dest = 'import_dir',
+        default = None,
+        metavar = 'DIR',
+        help = 'import the tarballs of solved conda environments from DIR into the store before creating the environments'
+    )
+
+    parser.add_argument(
+        '--export',
+        dest = 'export_dir',
+        default = None,
+        metavar = 'DIR',
+        help = 'export the solved conda environments from the store as tarballs to DIR after creating the environments'
+    )
+
+    parser.add_argument(
+        '--profile',
+        action = 'store_true',
+        help = 'profile the phases of the command, write cProfile statistics and speedscope traces to a new subdirectory of the profile directory'
+    )
+
+    parser.add_argument(
+        '--profile-dir',
+        default = None,
+        metavar = 'DIR',
+        help = 'profile directory (implies --profile, default: {})'.format( PROFILE_DIR_NAME )
+    )
+
+    parser.add_argument(
+        '--profile-sampling',
+        default = None,
+        type = float,
+        metavar = 'SECONDS',
+        help = 'profile by sampling the stacks with this interval (e.g., 0.01) instead of using cProfile, e.g., for long runs (implies --profile)'
+    )
+
     # Retrieve command line arguments.
     args = parser.parse_args()
 
+    if args.no_store and ( args.import_dir is not None or args.export_dir is not None ):
+        parser.error( 'options --import and --export require the store' )
+
+    # Profile the phases of the command (only if requested).
+    if args.profile or args.profile_dir is not None or args.profile_sampling is not None:
+        profile_dir = args.profile_dir or str( PROFILE_DIR_NAME )
+    else:
+        profile_dir = None
+
+    profiler = Profiler( profile_dir, name = 'create_envs', sampling_interval = args.profile_sampling )
+
     try:
         # Initialise credentials cache (for further use during the snakemake workflow).
-        credentials_cache = CredentialsCache(
-            new_cache = False
-        )
+        with profiler.span( 'credentials_unlock' ):
+            credentials_cache = CredentialsCache(
+                new_cache = False
+            )
     
         # Load config file.
         workflow_config = WorkflowConfig( 
             root_dir = args.root_dir 
         )
 
-        # Execute the snakemake workflow once.
-        if not run_workflow( 
-            config_file = workflow_config.file_path(),
-            target = workflow_config.target().format( run_id = 'TMP' ),
-            root_dir = args.root_dir,
-            forceall = True,
-            dryrun = False,
-            conda_create_envs_only = True,
-            num_cores = workflow_config.num_cores()
-        ):
+        # Using individual conda environments for each snakemake rule is
+        # currently not working on Windows (see function run_workflow).
+        use_conda = False if platform.system() == 'Windows' else True
+
+        provisioned = True
+        if use_conda:
+            # Retrieve the conda environments of all workflow steps.
+            with profiler.span( 'snakemake_parse' ):
+                session = WorkflowSession(
+                    config_file = workflow_config.file_path(),
+                    root_dir = args.root_dir,
+                    num_cores = workflow_config.num_cores()
+                )
+                env_files = session.conda_env_files()
+
+            conda_envs = CondaEnvs(
+                env_files,
+                store_dir = None if args.no_store else Path( args.root_dir, args.store ),
+                num_workers = args.jobs or workflow_config.num_cores()
+            )
+
+            if args.import_dir is not None:
+                imported = conda_envs.import_envs( args.import_dir )
+                print( 'Imported {} conda environments from: {}'.format( imported, args.import_dir ) )
+
+            # Create the conda environments concurrently (from the store, if available).
+            with profiler.span( 'conda_envs' ):
+                provisioned = conda_envs.create()
+
+        # Execute the snakemake workflow once (Snakemake uses the environments created above
+        # and only creates environments that are not known before building the DAG of jobs).
+        with profiler.span( 'conda_envs' ):
+            success = provisioned and run_workflow( 
+                config_file = workflow_config.file_path(),
+                target = workflow_config.target().format( run_id = 'TMP', partition = 'TMP' ),
+                root_dir = args.root_dir,
+                forceall = True,
+                dryrun = False,
+                conda_create_envs_only = True,
+                num_cores = workflow_config.num_cores()
+            )
+
+        # Export the solved environments (e.g., for provisioning an offline host).
+        if success and use_conda and args.export_dir is not None:
+            exported = conda_envs.export_envs( args.export_dir )
+            print( 'Exported {} conda environments to: {}'.format( exported, args.export_dir ) )
+
+        if not success:
             exit( 2 )
 
     except Exception as err:
@@ -54,6 +168,10 @@ def main():
         print( err )
         exit( 100 )
 
+    finally:
+
+        profiler.close()
+
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,9 @@
 from argparse import ArgumentParser
+from sys import exit
 
 from ..utils.freeze_workflow import FreezeWorkflow
+from ..utils.profiler import Profiler
+from .._config import PROFILE_DIR_NAME
 
 
 def main():
@@ -24,15 +27,112 @@ def main():
         help = 'output additional information'
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        '-j', '--hash-jobs',
+        default = None,
+        type = int,
+        metavar = 'N',
+        help = 'number of concurrent workers for hashing files (default: number of cores from workflow configuration)'
+    )
+
+    parser.add_argument(
+        '--hash-executor',
+        default = 'thread',
+        choices = [ 'thread', 'process' ],
+        help = 'use threads or processes for hashing files (default: thread)'
+    )
+
+    parser.add_argument(
+        '--manifest-format',
+        default = 'merkle',
+        choices = FreezeWorkflow.manifest_formats,
+        help = 'format for storing the file digest (default: merkle)'
+    )
+
+    parser.add_argument(
+        '--algorithm',
+        default = 'sha256',
+        choices = FreezeWorkflow.digest_algorithms,
+        help = 'digest algorithm for freezing (default: sha256)'
+    )
+
+    parser.add_argument(
+        '-c', '--check',
+        action = 'store_true',
+        help = 'only check if the workflow has been modified since it has been frozen'
+    )
 
-    # Create digest of all files relevant for the workflow.
-    freeze = FreezeWorkflow(
-        dir = args.root_dir,
-        verbose = args.verbose
+    parser.add_argument(
+        '--fail-fast',
+        action = 'store_true',
+        help = 'stop the check at the first modified directory'
     )
 
-    freeze.freeze()
+    parser.add_argument(
+        '--subtree',
+        default = None,
+        metavar = 'DIR',
+        help = 'only check the files in this directory (relative to workflow root directory)'
+    )
+
+    parser.add_argument(
+        '--profile',
+        action = 'store_true',
+        help = 'profile the phases of the command, write cProfile statistics and speedscope traces to a new subdirectory of the profile directory'
+    )
+
+    parser.add_argument(
+        '--profile-dir',
+        default = None,
+        metavar = 'DIR',
+        help = 'profile directory (implies --profile, default: {})'.format( PROFILE_DIR_NAME )
+    )
+
+    parser.add_argument(
+        '--profile-sampling',
+        default = None,
+        type = float,
+        metavar = 'SECONDS',
+        help = 'profile by sampling the stacks with this interval (e.g., 0.01) instead of using cProfile, e.g., for long runs (implies --profile)'
+    )
+
+    args = parser.parse_args()
+
+    # Profile the phases of the command (only if requested).
+    if args.profile or args.profile_dir is not None or args.profile_sampling is not None:
+        profile_dir = args.profile_dir or str( PROFILE_DIR_NAME )
+    else:
+        profile_dir = None
+
+    profiler = Profiler( profile_dir, name = 'freeze', sampling_interval = args.profile_sampling )
+
+    try:
+        # The freeze derives the key from the passphrase (see class Crypto).
+        with profiler.span( 'key_derivation' ):
+            freeze = FreezeWorkflow(
+                dir = args.root_dir,
+                verbose = args.verbose,
+                num_workers = args.hash_jobs,
+                executor = args.hash_executor,
+                manifest_format = args.manifest_format,
+                algorithm = args.algorithm
+            )
+
+        if args.check:
+            # Check digest of all files relevant for the workflow.
+            with profiler.span( 'freeze_check' ):
+                frozen = freeze.check( fail_fast = args.fail_fast, subtree = args.subtree )
+
+            if not frozen:
+                exit( 1 )
+        else:
+            # Create digest of all files relevant for the workflow.
+            with profiler.span( 'freeze' ):
+                freeze.freeze()
+
+    finally:
+
+        profiler.close()
 
 
 if __name__ == '__main__':
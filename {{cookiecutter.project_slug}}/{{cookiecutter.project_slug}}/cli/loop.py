@@ -1,18 +1,30 @@
 from argparse import ArgumentParser
-from datetime import timedelta, datetime
-from time import sleep
+from _thread import interrupt_main
+from datetime import timedelta
+from functools import partial
+from threading import Event
+from time import monotonic, sleep
 
+from ..utils.credentials_agent import CredentialsAgent
 from ..utils.credentials_cache import CredentialsCache
+from ..utils.freeze_guard import FreezeGuard
 from ..utils.freeze_workflow import FreezeWorkflow
+from ..utils.metrics import Metrics
+from ..utils.profiler import Profiler
+from ..utils.retry_policy import FailureMonitor, RetryPolicy
+from ..utils.run_pool import RunPool
 from ..utils.workflow_config import WorkflowConfig
 from ..utils.run_workflow import run_workflow
+from ..utils.scheduler import CronSchedule, IntervalSchedule, Scheduler
+from ..utils.workflow_session import WorkflowSession
+from .._config import PROFILE_DIR_NAME
 
 
 def main():
 
     # Command line parser.
     parser = ArgumentParser(
-        description = 'Run workflow periodically. The default period is one day.'
+        description = 'Run workflow periodically or according to a cron expression. The default period is one day.'
     )
 
     parser.add_argument(
@@ -76,11 +88,150 @@ def main():
         help = 'loop period seconds'
     )
 
+    parser.add_argument(
+        '-C', '--cron',
+        default = None,
+        metavar = 'EXPR',
+        help = 'run workflow according to a cron expression (e.g., "30 2 * * mon-fri") instead of a loop period'
+    )
+
+    parser.add_argument(
+        '-A', '--align',
+        action = 'store_true',
+        help = 'align the loop period to midnight (e.g., every 15 minutes at :00, :15, :30 and :45)'
+    )
+
+    parser.add_argument(
+        '--catch-up',
+        default = 'once',
+        choices = Scheduler.policies,
+        help = 'policy for executions missed while waiting, e.g., while the host was suspended (default: once)'
+    )
+
+    parser.add_argument(
+        '--overrun',
+        default = 'once',
+        choices = Scheduler.policies,
+        help = 'policy for executions missed while the workflow was running (default: once)'
+    )
+
     parser.add_argument(
         '-r', '--retry-delay',
-        default = 60,
+        default = None,
+        type = int,
+        help = 'delay in seconds before the first retry of a failed workflow execution (default: from workflow configuration)'
+    )
+
+    parser.add_argument(
+        '-P', '--max-runs',
+        default = 1,
+        type = int,
+        metavar = 'N',
+        help = 'maximum number of concurrent workflow executions, each in its own process (default: 1)'
+    )
+
+    parser.add_argument(
+        '--queue-policy',
+        default = 'queue',
+        choices = RunPool.policies,
+        help = 'policy for workflow executions that are due while all processes are busy (default: queue)'
+    )
+
+    parser.add_argument(
+        '--max-queued',
+        default = None,
         type = int,
-        help = 'delay in seconds for retrying to run a failed workflow execution'
+        metavar = 'N',
+        help = 'maximum number of queued workflow executions with queue policy "queue" (default: no limit)'
+    )
+
+    parser.add_argument(
+        '-i', '--incremental',
+        action = 'store_true',
+        help = 'only re-hash files whose status changed since the last freeze check'
+    )
+
+    parser.add_argument(
+        '--full-verify-every',
+        default = 0,
+        type = int,
+        metavar = 'N',
+        help = 'in incremental mode, re-hash all files every N-th loop (default: never)'
+    )
+
+    parser.add_argument(
+        '-j', '--hash-jobs',
+        default = None,
+        type = int,
+        metavar = 'N',
+        help = 'number of concurrent workers for hashing files (default: number of cores from workflow configuration)'
+    )
+
+    parser.add_argument(
+        '--hash-executor',
+        default = 'thread',
+        choices = [ 'thread', 'process' ],
+        help = 'use threads or processes for hashing files (default: thread)'
+    )
+
+    parser.add_argument(
+        '--fail-fast',
+        action = 'store_true',
+        help = 'stop the freeze check at the first modified directory'
+    )
+
+    parser.add_argument(
+        '-w', '--watch',
+        action = 'store_true',
+        help = 'watch files in the background and stop immediately if any file changes'
+    )
+
+    parser.add_argument(
+        '--watch-backend',
+        default = 'auto',
+        choices = FreezeGuard.backends,
+        help = 'backend for watching files (default: auto)'
+    )
+
+    parser.add_argument(
+        '--poll-interval',
+        default = 5.,
+        type = float,
+        metavar = 'SECONDS',
+        help = 'polling interval for watching files with backend "poll" (default: 5)'
+    )
+
+    parser.add_argument(
+        '--no-session',
+        action = 'store_true',
+        help = 'parse the workflow definition again for every workflow execution'
+    )
+
+    parser.add_argument(
+        '--profile',
+        action = 'store_true',
+        help = 'profile the phases of the command, write cProfile statistics and speedscope traces to a new subdirectory of the profile directory'
+    )
+
+    parser.add_argument(
+        '--profile-dir',
+        default = None,
+        metavar = 'DIR',
+        help = 'profile directory (implies --profile, default: {})'.format( PROFILE_DIR_NAME )
+    )
+
+    parser.add_argument(
+        '--profile-sampling',
+        default = None,
+        type = float,
+        metavar = 'SECONDS',
+        help = 'profile by sampling the stacks with this interval (e.g., 0.01) instead of using cProfile, e.g., for long runs (implies --profile)'
+    )
+
+    parser.add_argument(
+        '--no-metrics',
+        action = 'store_true',
+        help = 'do not record metrics of the workflow executions'
     )
 
     parser.add_argument(
@@ -95,103 +246,310 @@ def main():
         help = 'do not load credentials cache'
     )
 
+    parser.add_argument(
+        '--no-agent',
+        action = 'store_true',
+        help = 'do not provide the credentials to the workflow jobs via a local agent'
+    )
+
     # Retrieve command line arguments.
     args = parser.parse_args()
 
-    if ( args.days == 0 and
-         args.hours == 0 and
-         args.minutes == 0 and
-         args.seconds == 0 ):
+    no_period = ( args.days == 0 and
+                  args.hours == 0 and
+                  args.minutes == 0 and
+                  args.seconds == 0 )
+
+    if args.cron is not None and not no_period:
+        parser.error( 'a cron expression cannot be combined with a loop period' )
+
+    if args.cron is not None and args.align:
+        parser.error( 'a cron expression cannot be combined with option --align' )
+
+    if no_period:
         # If nothing else is specified, set default period to 1 day.
         args.days = 1
 
+    # Profile the phases of the command (only if requested).
+    if args.profile or args.profile_dir is not None or args.profile_sampling is not None:
+        profile_dir = args.profile_dir or str( PROFILE_DIR_NAME )
+    else:
+        profile_dir = None
+
+    profiler = Profiler( profile_dir, name = 'loop', sampling_interval = args.profile_sampling )
+
+    # Flag indicating that the main thread has been interrupted because a file has changed.
+    file_changed = Event()
+
+    def stop_on_change( path ):
+        # Stop a running workflow execution (or waiting for the next one) right away.
+        print( '\nFile has changed: {}'.format( path ) )
+        file_changed.set()
+        interrupt_main()
+
+    # Credentials agent (started after loading the credentials cache).
+    agent = None
+
+    # Worker processes for concurrent workflow executions.
+    pool = None
+
+    # Timing metrics of the workflow executions (recorded once the workflow configuration has been loaded).
+    metrics = Metrics()
+
     try:
 
         # Check if workflow definition has remained unchanged.
         if not args.no_freeze:
-            freeze = FreezeWorkflow(
-                dir = args.root_dir,
-                verbose = args.verbose
-            )
-
-            if not freeze.check():
+            # The freeze derives the key from the passphrase (see class Crypto).
+            with profiler.span( 'key_derivation' ):
+                freeze = FreezeWorkflow(
+                    dir = args.root_dir,
+                    verbose = args.verbose,
+                    incremental = args.incremental,
+                    full_verify_interval = args.full_verify_every,
+                    num_workers = args.hash_jobs,
+                    executor = args.hash_executor
+                )
+
+            # Start watching files before the first check, to catch all changes after it.
+            if args.watch:
+                freeze.watch(
+                    backend = args.watch_backend,
+                    poll_interval = args.poll_interval,
+                    on_change = stop_on_change
+                )
+
+            # Always verify all files before the first loop.
+            with metrics.phase( 'freeze_check' ), profiler.span( 'freeze_check' ):
+                frozen = freeze.check( full_verify = True, fail_fast = args.fail_fast )
+
+            if not frozen:
                 print( '\nFreeze the workflow before executing it!' )
                 exit( 1 )
 
         # Initialise credentials cache (for further use during the snakemake workflow).
         if not args.no_cache:
-            credentials_cache = CredentialsCache(
-                new_cache = False
-            )
+            with metrics.phase( 'credentials_unlock' ), profiler.span( 'credentials_unlock' ):
+                credentials_cache = CredentialsCache(
+                    new_cache = False
+                )
+
+            # Provide the unlocked credentials cache to the workflow jobs via a local agent.
+            if not args.no_agent and CredentialsAgent.supported():
+                agent = CredentialsAgent( credentials_cache )
+                agent.start()
 
         # Load config file.
         workflow_config = WorkflowConfig( 
             root_dir = args.root_dir 
         )
 
-        # Define loop period.
-        period = timedelta(
-            days = args.days,
-            hours = args.hours,
-            minutes = args.minutes,
-            seconds = args. seconds
+        # Record metrics of the workflow executions (except for dry runs).
+        if not args.no_metrics and not args.dryrun:
+            metrics.configure( workflow_config.metrics(), args.root_dir )
+
+        # Define the policy for retrying failed workflow executions.
+        retry_policy = RetryPolicy(
+            workflow_config.retry(),
+            initial_delay = args.retry_delay
+        )
+
+        # Parse the workflow definition only once for all workflow executions (as long as the freeze digest does not change).
+        session = None
+        if not args.no_session:
+            session = WorkflowSession(
+                config_file = workflow_config.file_path(),
+                root_dir = args.root_dir,
+                num_cores = workflow_config.num_cores(),
+                freeze = None if args.no_freeze else freeze,
+                resources = workflow_config.resources()
+            )
+
+        def execute_run( run_id, num_cores, resources, run_metrics ):
+            # Run the workflow. Retry according to the retry policy if necessary.
+            attempt = 1
+            run_start = monotonic()
+            while True:
+                # Collect failures (for deciding whether to retry).
+                failure = FailureMonitor()
+
+                # Record metrics of every attempt.
+                run_metrics.start()
+
+                # Retries only re-create the outputs of failed jobs (force all outputs only in the first attempt).
+                forceall = args.forceall and attempt == 1
+
+                log_handler = [ failure.log_handler, run_metrics.log_handler, profiler.log_handler ]
+
+                with profiler.span( 'snakemake_dag' ):
+                    if session is not None:
+                        success = session.run(
+                            target = workflow_config.run_target( run_id ),
+                            forceall = forceall,
+                            dryrun = args.dryrun,
+                            keepgoing = retry_policy.keep_going,
+                            log_handler = log_handler,
+                            num_cores = num_cores,
+                            resources = resources
+                        )
+                    else:
+                        success = run_workflow(
+                            config_file = workflow_config.file_path(),
+                            target = workflow_config.run_target( run_id ),
+                            root_dir = args.root_dir,
+                            forceall = forceall,
+                            dryrun = args.dryrun,
+                            conda_create_envs_only = False,
+                            num_cores = num_cores,
+                            resources = resources,
+                            keepgoing = retry_policy.keep_going,
+                            log_handler = log_handler
+                        )
+
+                run_metrics.finish( success )
+
+                if success:
+                    return True
+
+                # Do not retry if the execution has been stopped because a file has changed.
+                if file_changed.is_set():
+                    raise KeyboardInterrupt
+
+                # Do not retry if the worker process of a concurrent run is being terminated.
+                if RunPool.terminating():
+                    return False
+
+                delay, reason = retry_policy.retry_delay( attempt, monotonic() - run_start, failure )
+                failed_rules = ', '.join( sorted( set( failure.failed_rules ) ) ) or 'none'
+
+                if delay is None:
+                    print( 'Workflow execution failed (failed rules: {}). Giving up on run {} ({}).'.format(
+                        failed_rules, run_id, reason ) )
+                    return False
+
+                print( 'Workflow execution failed (failed rules: {}, {}). Will retry in {:.0f} seconds (attempt {} of {}).'.format(
+                    failed_rules, reason, delay, attempt + 1, retry_policy.max_attempts ) )
+                sleep( delay )
+                attempt += 1
+
+        # Execute workflow runs concurrently in worker processes (the cores and resources are divided between the runs).
+        if args.max_runs > 1:
+            pool = RunPool(
+                max_runs = args.max_runs,
+                num_cores = workflow_config.num_cores(),
+                policy = args.queue_policy,
+                max_queued = args.max_queued,
+                resources = workflow_config.resources()
+            )
+
+        # Define schedule (cron expression or loop period).
+        if args.cron is not None:
+            schedule = CronSchedule( args.cron )
+        else:
+            period = timedelta(
+                days = args.days,
+                hours = args.hours,
+                minutes = args.minutes,
+                seconds = args. seconds
+            )
+            schedule = IntervalSchedule( period, align = args.align )
+
+        scheduler = Scheduler(
+            schedule,
+            catch_up = args.catch_up,
+            overrun = args.overrun
         )
 
         # Loop counter.
         i_loop = 1
 
-        # Use a simple while loop and the time.sleep method for the periodic execution of
-        # the workflow. More complex solutions (and especially solutions using threads) will
-        # most likely break the functionality of snakemake and of the credentials cache.
-        while( args.num_loops < 0 or i_loop <= args.num_loops ):
+        # Run executed by the main process (None while waiting for the next run).
+        current_run = None
 
-            # Save time of loop start.
-            start = datetime.now()
+        # Runs stopped because a file has changed, they are executed again if the freeze check passes.
+        stopped_runs = []
 
-            if not args.no_freeze and not freeze.check():
-                print( '\nSomething has changed while running the workflow!' )
-                exit( 1 )
-
-            # Define run ID.
-            run_id = workflow_config.run_id_format().format( datetime.now() )
-
-            # Run the workflow. Retry if necessary.
-            retry = True
-            while( retry ):
-                if not run_workflow(
-                    config_file = workflow_config.file_path(),
-                    target = workflow_config.target().format( run_id = run_id ),
-                    root_dir = args.root_dir,
-                    forceall = args.forceall,
-                    dryrun = args.dryrun,
-                    conda_create_envs_only = False,
-                    num_cores = workflow_config.num_cores()
-                ):
-                    print( 'Workflow execution failed. Will retry in {} seconds.' )
-                    sleep( args.retry_delay )
+        # Use a simple while loop and the time.sleep method (see class Scheduler) for the periodic
+        # execution of the workflow. More complex solutions (and especially solutions using threads) will
+        # most likely break the functionality of snakemake and of the credentials cache.
+        while True:
+
+            try:
+
+                if stopped_runs:
+                    # Execute stopped runs again right away.
+                    run_id = stopped_runs.pop( 0 )
+                elif args.num_loops >= 0 and i_loop > args.num_loops:
+                    # Wait for concurrent runs to finish.
+                    if pool is not None:
+                        pool.join()
+                    break
                 else:
-                    retry = False
+                    # Wait until the next workflow execution is due (meanwhile, collect finished concurrent runs).
+                    slot = scheduler.next_run( poll = pool.poll if pool is not None else None )
 
-            # Calculate remeining loop period.
-            remaining_period = period - ( datetime.now() - start )
+                    # Define run ID (from the scheduled time, such that it does not depend on delays).
+                    run_id = workflow_config.run_id_format().format( slot )
 
-            # Check if workflow execution time exceeded the loop period.
-            sleep_period = max( timedelta( 0 ), remaining_period )
-            if ( 0 == sleep_period.total_seconds() ):
-                print( 'Previous workflow execution time exceeded the loop period.' )
+                    # Increment loop counter.
+                    i_loop += 1
 
-            # Increment loop counter.
-            i_loop += 1
+                current_run = run_id
 
-            if args.num_loops < 0 or i_loop <= args.num_loops:
-                # Notify when the next loop iteration is scheduled.
-                str_next = 'Next workflow execution scheduled at: {:%H:%M:%S, %b %d, %Y}'
-                print( str_next.format( datetime.now() + sleep_period ) )
+                if not args.no_freeze:
+                    with metrics.phase( 'freeze_check' ), profiler.span( 'freeze_check' ):
+                        frozen = freeze.check( fail_fast = args.fail_fast )
 
-                # Sleep until beginning of next loop iteration.
-                # See comment at the beginning of this while loop for the reason why time.sleep
-                # is being used here (and not a more elegant approach).
-                sleep( sleep_period.total_seconds() )
+                    if not frozen:
+                        print( '\nSomething has changed while running the workflow!' )
+                        exit( 1 )
+
+                # Metrics of the run (including the time spent in phases since the previous run).
+                run_metrics = metrics.run( run_id )
+
+                if pool is None:
+                    execute_run( run_id, workflow_config.num_cores(), workflow_config.resources(), run_metrics )
+                else:
+                    # Parse the workflow before forking, such that the worker processes inherit the parsed workflow.
+                    if session is not None:
+                        with profiler.span( 'snakemake_parse' ):
+                            session.prepare()
+                    pool.submit( run_id, partial( execute_run, run_metrics = run_metrics ) )
+
+                current_run = None
+
+                if not stopped_runs and ( args.num_loops < 0 or i_loop <= args.num_loops ):
+                    # Notify when the next loop iteration is scheduled (missed executions are
+                    # handled according to the overrun policy).
+                    str_next = 'Next workflow execution scheduled at: {:%H:%M:%S, %b %d, %Y}'
+                    print( str_next.format( scheduler.next_slot() ) )
+
+                # Write the profiles after every loop iteration (the loop may run for a long time).
+                profiler.dump()
+
+            except KeyboardInterrupt:
+
+                # Interrupted by user.
+                if not file_changed.is_set():
+                    raise
+
+                # Interrupted because a file has changed, stop concurrent runs and check the files right away.
+                file_changed.clear()
+                if current_run is not None:
+                    print( 'Run {} has been stopped.'.format( current_run ) )
+                    stopped_runs.append( current_run )
+                    current_run = None
+                if pool is not None:
+                    stopped_runs.extend( r for r in pool.terminate() if r not in stopped_runs )
+                with metrics.phase( 'freeze_check' ), profiler.span( 'freeze_check' ):
+                    frozen = freeze.check( fail_fast = args.fail_fast )
+                if not frozen:
+                    print( '\nSomething has changed while running the workflow!' )
+                    exit( 1 )
+
+                # The files are unchanged (e.g., a file has only been touched), execute the stopped runs again.
+                if stopped_runs:
+                    print( 'Workflow is still frozen, restarting stopped runs: {}'.format( ', '.join( stopped_runs ) ) )
 
 
     except Exception as err:
@@ -199,6 +557,17 @@ def main():
         print( err )
         exit( 100 )
 
+    finally:
+
+        # Stop concurrent runs before the credentials agent.
+        if pool is not None:
+            pool.terminate()
+
+        if agent is not None:
+            agent.stop()
+
+        profiler.close()
+
 
 
 if __name__ == '__main__':
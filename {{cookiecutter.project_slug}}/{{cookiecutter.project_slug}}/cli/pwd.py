@@ -1,11 +1,73 @@
 from argparse import ArgumentParser
-from sys import exit
+from getpass import getpass
+from json import loads as json_loads, dumps as json_dumps
+from os import replace
+from pathlib import Path
+from sys import exit, stdin
 
 from ..utils.credentials_cache import CredentialsCache
+from ..utils.credentials_store import CredentialsStore
+from ..utils.crypto import Crypto, CryptoImpl, CryptoStreamWriter
+from ..utils.file_permissions import FilePermissions
+from ..utils.file_transaction import FileTransaction
 from ..utils.freeze_workflow import FreezeWorkflow
 from ..utils.workflow_config import WorkflowConfig
 
 
+def read_credentials( file_name ):
+    '''
+    Read credentials for a bulk import. The input is a JSON object with sitenames as keys and
+    objects with attributes "user" and "pwd" as values. It is read either from a file encrypted
+    with the passphrase of the credentials cache (see option "--export"), from a plaintext file
+    accessible for the current user only or from stdin (file name "-").
+
+    :return: dict with sitenames as keys and tuples with user name and password as values
+    '''
+    if file_name == '-':
+        data = stdin.buffer.read()
+    else:
+        with open( file_name, 'rb' ) as f:
+            data = f.read()
+
+    if data.startswith( CryptoStreamWriter.magic ):
+        data = Crypto().unseal( data )
+    elif not file_name == '-':
+        # Refuse plaintext files that are accessible for other users.
+        FilePermissions().check_access( Path( file_name ) )
+
+    content = json_loads( data )
+    if not isinstance( content, dict ):
+        raise RuntimeError( 'Credentials have to be provided as JSON object' )
+
+    credentials = {}
+    for sitename, entry in content.items():
+        if not ( isinstance( entry, dict ) and
+                 isinstance( entry.get( 'user' ), str ) and
+                 isinstance( entry.get( 'pwd' ), str ) ):
+            raise RuntimeError( 'Credentials for "{}" require attributes "user" and "pwd"'.format( sitename ) )
+        credentials[sitename] = ( entry['user'], entry['pwd'] )
+
+    return credentials
+
+
+def new_passphrase( file_name ):
+    '''
+    Read a new passphrase from a file (accessible for the current user only) or ask the user for it.
+
+    :return: new passphrase
+    '''
+    if file_name is not None:
+        FilePermissions().check_access( Path( file_name ) )
+        with open( file_name, 'r' ) as f:
+            return f.read()
+
+    passphrase = getpass( 'Enter your new secret passphrase:' )
+    if not passphrase == getpass( 'Repeat your new secret passphrase:' ):
+        raise RuntimeError( 'Passphrases do not match' )
+
+    return passphrase
+
+
 def main():
 
     # Command line parser.
@@ -33,6 +95,44 @@ def main():
         help = 'create a new credentials cache'
     )
 
+    group = parser.add_mutually_exclusive_group()
+
+    group.add_argument(
+        '--import',
+        dest = 'import_file',
+        default = None,
+        metavar = 'FILE',
+        help = 'import credentials for several sites at once from a file ("-" for stdin)'
+    )
+
+    group.add_argument(
+        '--export',
+        dest = 'export_file',
+        default = None,
+        metavar = 'FILE',
+        help = 'export all credentials to a file, encrypted with a new passphrase'
+    )
+
+    group.add_argument(
+        '--rotate',
+        action = 'store_true',
+        help = 're-encrypt credentials cache and freeze digest with a new passphrase'
+    )
+
+    parser.add_argument(
+        '--new-passphrase-file',
+        default = None,
+        metavar = 'FILE',
+        help = 'read new passphrase for options "--export" and "--rotate" from a file (default: ask user)'
+    )
+
+    parser.add_argument(
+        '--cache-backend',
+        default = 'log',
+        choices = CredentialsStore.backends,
+        help = 'backend for storing the credentials cache (default: log)'
+    )
+
     parser.add_argument(
         '--no-freeze',
         action = 'store_true',
@@ -61,12 +161,61 @@ def main():
 
         # Create new cache for credentials.
         credentials_cache = CredentialsCache(
-            new_cache = args.new_cache
+            new_cache = args.new_cache,
+            backend = args.cache_backend
         )
 
-        # Save username and password for every entry provided in the config list 'credentials'.
-        for entry in workflow_config.credentials():
-            credentials_cache.store( entry )
+        if args.import_file is not None:
+            # Read all credentials at once and check them against the config list 'credentials'.
+            credentials = read_credentials( args.import_file )
+
+            for sitename in credentials:
+                if sitename not in workflow_config.credentials():
+                    raise RuntimeError( 'Unknown sitename: "{}"'.format( sitename ) )
+
+            # Store all credentials with a single commit.
+            credentials_cache.import_credentials( credentials )
+
+            for sitename in workflow_config.credentials():
+                if sitename not in credentials_cache.sitenames():
+                    print( 'No credentials stored for "{}"'.format( sitename ) )
+
+        elif args.export_file is not None:
+            # Encrypt all credentials with the new passphrase and write them to file.
+            crypto = CryptoImpl( new_passphrase( args.new_passphrase_file ) )
+            credentials = {
+                sitename : { 'user' : user, 'pwd' : pwd }
+                for sitename, ( user, pwd ) in credentials_cache.export_credentials().items()
+            }
+
+            # Replace the export file atomically (write to temporary file, then rename).
+            export_file = Path( args.export_file )
+            tmp_file_name = export_file.with_name( export_file.name + '.tmp' )
+            with open( tmp_file_name, 'wb' ) as f:
+                FilePermissions().restrict_access( tmp_file_name )
+                with crypto.writer( f ) as w:
+                    w.write( json_dumps( credentials ).encode( 'utf-8' ) )
+
+            replace( tmp_file_name, export_file )
+
+        elif args.rotate:
+            # Re-encrypt credentials cache, freeze digest and file status index with the new passphrase.
+            # All files are written first and only replaced once all of them have been written.
+            crypto = CryptoImpl( new_passphrase( args.new_passphrase_file ) )
+            with FileTransaction() as transaction:
+                credentials_cache.rotate( crypto, transaction )
+                FreezeWorkflow( args.root_dir ).rotate( crypto, transaction )
+
+            print( 'Passphrase changed, update "{{ cookiecutter.project_slug | upper }}_PWD_FILE" if necessary.' )
+
+        else:
+            # Save username and password for every entry provided in the config list 'credentials'
+            # (commit all entries at once).
+            with credentials_cache.batch():
+                for entry in workflow_config.credentials():
+                    credentials_cache.store( entry )
+
+        credentials_cache.close()
 
     except Exception as err:
 
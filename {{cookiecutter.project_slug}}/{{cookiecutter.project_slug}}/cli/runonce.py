@@ -2,10 +2,14 @@ from argparse import ArgumentParser
 from datetime import datetime
 from sys import exit
 
+from ..utils.credentials_agent import CredentialsAgent
 from ..utils.credentials_cache import CredentialsCache
 from ..utils.freeze_workflow import FreezeWorkflow
+from ..utils.metrics import Metrics
+from ..utils.profiler import Profiler
 from ..utils.workflow_config import WorkflowConfig
 from ..utils.run_workflow import run_workflow
+from .._config import PROFILE_DIR_NAME
 
 
 def main():
@@ -41,6 +45,60 @@ def main():
         help = 'only dry-run the workflow'
     )
 
+    parser.add_argument(
+        '-i', '--incremental',
+        action = 'store_true',
+        help = 'only re-hash files whose status changed since the last freeze check'
+    )
+
+    parser.add_argument(
+        '-j', '--hash-jobs',
+        default = None,
+        type = int,
+        metavar = 'N',
+        help = 'number of concurrent workers for hashing files (default: number of cores from workflow configuration)'
+    )
+
+    parser.add_argument(
+        '--hash-executor',
+        default = 'thread',
+        choices = [ 'thread', 'process' ],
+        help = 'use threads or processes for hashing files (default: thread)'
+    )
+
+    parser.add_argument(
+        '--fail-fast',
+        action = 'store_true',
+        help = 'stop the freeze check at the first modified directory'
+    )
+
+    parser.add_argument(
+        '--profile',
+        action = 'store_true',
+        help = 'profile the phases of the command, write cProfile statistics and speedscope traces to a new subdirectory of the profile directory'
+    )
+
+    parser.add_argument(
+        '--profile-dir',
+        default = None,
+        metavar = 'DIR',
+        help = 'profile directory (implies --profile, default: {})'.format( PROFILE_DIR_NAME )
+    )
+
+    parser.add_argument(
+        '--profile-sampling',
+        default = None,
+        type = float,
+        metavar = 'SECONDS',
+        help = 'profile by sampling the stacks with this interval (e.g., 0.01) instead of using cProfile, e.g., for long runs (implies --profile)'
+    )
+
+    parser.add_argument(
+        '--no-metrics',
+        action = 'store_true',
+        help = 'do not record metrics of the workflow execution'
+    )
+
     parser.add_argument(
         '--no-freeze',
         action = 'store_true',
@@ -53,45 +111,94 @@ def main():
         help = 'do not load credentials cache'
     )
 
+    parser.add_argument(
+        '--no-agent',
+        action = 'store_true',
+        help = 'do not provide the credentials to the workflow jobs via a local agent'
+    )
+
     # Retrieve command line arguments.
     args = parser.parse_args()
 
+    # Profile the phases of the command (only if requested).
+    if args.profile or args.profile_dir is not None or args.profile_sampling is not None:
+        profile_dir = args.profile_dir or str( PROFILE_DIR_NAME )
+    else:
+        profile_dir = None
+
+    profiler = Profiler( profile_dir, name = 'runonce', sampling_interval = args.profile_sampling )
+
+    # Credentials agent (started after loading the credentials cache).
+    agent = None
+
+    # Timing metrics of the workflow execution (recorded once the workflow configuration has been loaded).
+    metrics = Metrics()
+
     try:
         # Check if workflow definition has remained unchanged.
         if not args.no_freeze:
-            freeze = FreezeWorkflow(
-                dir = args.root_dir,
-                verbose = args.verbose
-            )
-
-            if not freeze.check():
+            # The freeze derives the key from the passphrase (see class Crypto).
+            with profiler.span( 'key_derivation' ):
+                freeze = FreezeWorkflow(
+                    dir = args.root_dir,
+                    verbose = args.verbose,
+                    incremental = args.incremental,
+                    num_workers = args.hash_jobs,
+                    executor = args.hash_executor
+                )
+
+            with metrics.phase( 'freeze_check' ), profiler.span( 'freeze_check' ):
+                frozen = freeze.check( fail_fast = args.fail_fast )
+
+            if not frozen:
                 print( '\nFreeze the workflow before executing it!' )
                 exit( 1 )
 
         # Initialise credentials cache (for further use during the snakemake workflow).
         if not args.no_cache:
-            credentials_cache = CredentialsCache(
-                new_cache = False
-            )
+            with metrics.phase( 'credentials_unlock' ), profiler.span( 'credentials_unlock' ):
+                credentials_cache = CredentialsCache(
+                    new_cache = False
+                )
+
+            # Provide the unlocked credentials cache to the workflow jobs via a local agent.
+            if not args.no_agent and CredentialsAgent.supported():
+                agent = CredentialsAgent( credentials_cache )
+                agent.start()
 
         # Load config file.
         workflow_config = WorkflowConfig(
             root_dir = args.root_dir
         )
 
+        # Record metrics of the workflow execution (except for dry runs).
+        if not args.no_metrics and not args.dryrun:
+            metrics.configure( workflow_config.metrics(), args.root_dir )
+
         # Define run ID.
         run_id = workflow_config.run_id_format().format( datetime.now() )
 
+        # Metrics of the run (including the time spent in phases so far).
+        run_metrics = metrics.run( run_id )
+        run_metrics.start()
+
         # Execute the snakemake workflow once.
-        if not run_workflow(
-            config_file = workflow_config.file_path(),
-            target = workflow_config.target().format( run_id = run_id),
-            root_dir = args.root_dir,
-            forceall = args.forceall,
-            dryrun = args.dryrun,
-            conda_create_envs_only = False,
-            num_cores = workflow_config.num_cores()
-        ):
+        with profiler.span( 'snakemake_dag' ):
+            success = run_workflow(
+                config_file = workflow_config.file_path(),
+                target = workflow_config.run_target( run_id ),
+                root_dir = args.root_dir,
+                forceall = args.forceall,
+                dryrun = args.dryrun,
+                conda_create_envs_only = False,
+                num_cores = workflow_config.num_cores(),
+                resources = workflow_config.resources(),
+                log_handler = [ run_metrics.log_handler, profiler.log_handler ]
+            )
+
+        run_metrics.finish( success )
+
+        if not success:
             exit( 2 )
 
     except Exception as err:
@@ -99,6 +206,13 @@ def main():
         print( err )
         exit( 100 )
 
+    finally:
+
+        if agent is not None:
+            agent.stop()
+
+        profiler.close()
+
 
 if __name__ == '__main__':
     main()
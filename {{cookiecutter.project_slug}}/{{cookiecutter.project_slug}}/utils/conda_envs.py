@@ -0,0 +1,338 @@
+from hashlib import md5, sha256
+from json import dumps as json_dumps, loads as json_loads
+from os import environ, getpid, link, replace
+from os.path import realpath
+from pathlib import Path
+from shutil import copyfile, rmtree
+from subprocess import run
+from tempfile import TemporaryDirectory
+from threading import get_ident
+from time import monotonic, time
+
+from .._config import CONDA_STORE_DIR_NAME
+
+
+class CondaEnvs:
+    '''
+    Provision the conda environments of the workflow steps.
+
+    Snakemake creates the environments one after another. Here, they are created concurrently (at most
+    num_workers at a time) at the location where Snakemake expects them, i.e., in ".snakemake/conda"
+    relative to the working directory, named after the MD5 digest of this directory and the environment
+    file (see class Env of Snakemake). Hence, Snakemake uses these environments without creating them again.
+
+    Solved environments are kept in a local content-addressed store, keyed by the digest of the
+    environment file and the platform (e.g., "linux-64"). Each entry contains the explicit list of
+    packages of the environment (see "conda list --explicit") and the package files. An environment
+    with an entry in the store is created from these files, without solving it again and without
+    downloading any packages. Entries can be exported as tarballs to an artifact directory and
+    imported from there (e.g., on an offline host).
+    '''
+
+    # Directory of the conda environments (see above).
+    env_dir = Path( '.snakemake', 'conda' )
+
+    # Version of the store format (change whenever the key computation or the layout of the entries changes).
+    store_version = 1
+
+    def __init__( self, env_files, store_dir = CONDA_STORE_DIR_NAME, num_workers = 1, conda = 'conda' ):
+
+        # Environment files (e.g., see method WorkflowSession.conda_env_files).
+        self.env_files = [ Path( f ).resolve( strict = True ) for f in env_files ]
+
+        # Store of solved environments (None for no store).
+        self.store_dir = Path( store_dir ).resolve() if store_dir is not None else None
+
+        # Maximum number of environments created concurrently.
+        self.num_workers = max( 1, num_workers )
+
+        # Conda executable.
+        self.conda = conda
+
+        self.__info = None
+
+
+    def create( self ):
+        '''
+        Create all environments that do not exist yet (concurrently).
+
+        :return: True if all environments exist, False otherwise
+        '''
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        # Environment files with the same content share an environment.
+        envs = {}
+        for env_file in self.env_files:
+            envs.setdefault( self.env_path( env_file ), env_file )
+
+        # Retrieve the conda configuration before starting any workers.
+        self.info()
+
+        success = True
+        with ThreadPoolExecutor( max_workers = self.num_workers ) as executor:
+            futures = { executor.submit( self.__create_env, env_file, path ): env_file for path, env_file in envs.items() }
+
+            for future in as_completed( futures ):
+                env_file = futures[future]
+                try:
+                    result = future.result()
+                    if result is not None:
+                        print( 'Conda environment {} {}.'.format( env_file.name, result ) )
+                except Exception as err:
+                    print( 'Failed to create conda environment {}: {}'.format( env_file.name, err ) )
+                    success = False
+
+        return success
+
+
+    def export_envs( self, artifact_dir ):
+        '''
+        Export the store entries of all environments as tarballs to an artifact directory
+        (entries that have already been exported are skipped).
+
+        :return: number of exported entries
+        '''
+        import tarfile
+
+        if self.store_dir is None:
+            raise RuntimeError( 'No conda environment store available for exporting environments!' )
+
+        artifact_dir = Path( artifact_dir )
+        artifact_dir.mkdir( parents = True, exist_ok = True )
+
+        exported = 0
+        for env_file in self.env_files:
+            key = self.key( env_file )
+            entry = Path( self.store_dir, key )
+            tarball = Path( artifact_dir, '{}.tar.gz'.format( key ) )
+
+            if not entry.is_dir():
+                print( 'Conda environment {} not found in store, not exported.'.format( env_file.name ) )
+                continue
+
+            if tarball.is_file():
+                continue
+
+            # Write the tarball to a temporary file first, such that only complete tarballs become visible.
+            tmp = tarball.with_name( '{}.tmp-{}-{}'.format( tarball.name, getpid(), get_ident() ) )
+            with tarfile.open( tmp, 'w:gz' ) as tar:
+                # Only the package files themselves are exported (not the packages extracted by conda).
+                files = [ 'packages.txt', 'environment.yml', 'meta.json' ] + [
+                    str( Path( 'pkgs', p.partition( '#' )[0] ) ) for p in Path( entry, 'packages.txt' ).read_text().split()
+                ]
+                for f in files:
+                    tar.add( Path( entry, f ), arcname = str( Path( key, f ) ) )
+            replace( tmp, tarball )
+
+            exported += 1
+
+        return exported
+
+
+    def import_envs( self, artifact_dir ):
+        '''
+        Import tarballs of store entries from an artifact directory (see method export_envs).
+        Entries that already exist in the store are skipped.
+
+        :return: number of imported entries
+        '''
+        import tarfile
+
+        if self.store_dir is None:
+            raise RuntimeError( 'No conda environment store available for importing environments!' )
+
+        artifact_dir = Path( artifact_dir )
+        if not artifact_dir.is_dir():
+            raise RuntimeError( 'Artifact directory does not exist: {}'.format( artifact_dir ) )
+
+        self.store_dir.mkdir( parents = True, exist_ok = True )
+
+        imported = 0
+        for tarball in sorted( artifact_dir.glob( '*.tar.gz' ) ):
+            key = tarball.name[:-len( '.tar.gz' )]
+            entry = Path( self.store_dir, key )
+
+            if entry.is_dir():
+                continue
+
+            # Extract the tarball to a temporary directory first, such that only complete entries become visible.
+            tmp = Path( self.store_dir, '{}.tmp-{}-{}'.format( key, getpid(), get_ident() ) )
+            try:
+                with tarfile.open( tarball, 'r:gz' ) as tar:
+                    members = tar.getmembers()
+                    for m in members:
+                        parts = Path( m.name ).parts
+                        if Path( m.name ).is_absolute() or '..' in parts or parts[:1] != ( key, ) or not ( m.isfile() or m.isdir() ):
+                            raise RuntimeError( 'Invalid conda environment tarball: {}'.format( tarball ) )
+                    tar.extractall( tmp, members = members )
+
+                replace( Path( tmp, key ), entry )
+                imported += 1
+            except OSError:
+                # Entry has been imported concurrently, discard it.
+                pass
+            finally:
+                rmtree( tmp, ignore_errors = True )
+
+        return imported
+
+
+    def key( self, env_file ):
+        '''
+        Compute the store key of an environment (from the environment file and the platform).
+
+        :return: key as hex string
+        '''
+        description = {
+            'version': self.store_version,
+            'platform': self.info()['platform'],
+            'env_file': sha256( Path( env_file ).read_bytes() ).hexdigest()
+        }
+
+        return sha256( json_dumps( description, sort_keys = True ).encode( 'utf-8' ) ).hexdigest()
+
+
+    def env_path( self, env_file ):
+        '''
+        Retrieve the path of an environment (like class Env of Snakemake).
+        '''
+        env_dir = realpath( self.env_dir )
+        return Path( env_dir, md5( env_dir.encode() + Path( env_file ).read_bytes() ).hexdigest() )
+
+
+    def info( self ):
+        '''
+        Retrieve the conda configuration (see "conda info").
+        '''
+        if self.__info is None:
+            self.__info = json_loads( self.__conda( 'info', '--json' ) )
+        return self.__info
+
+
+    def __create_env( self, env_file, path ):
+        '''
+        Create an environment (like class Env of Snakemake, including its flag files).
+
+        :return: description of how the environment has been created, None if it already exists
+        '''
+        start_flag = Path( path, 'env_setup_start' )
+        done_flag = Path( path, 'env_setup_done' )
+
+        if done_flag.is_file():
+            return None
+
+        # Remove incomplete environments.
+        if path.exists():
+            rmtree( path )
+
+        start = monotonic()
+        key = self.key( env_file ) if self.store_dir is not None else None
+        entry = Path( self.store_dir, key ) if key is not None else None
+
+        try:
+            path.mkdir( parents = True )
+            start_flag.touch()
+
+            # Keep a copy of the environment file next to the environment (like Snakemake).
+            copyfile( env_file, '{}.yaml'.format( path ) )
+
+            if entry is not None and entry.is_dir():
+                self.__install( entry, path )
+                how = 'created from store'
+            else:
+                self.__conda( 'env', 'create', '--quiet', '--file', '{}.yaml'.format( path ), '--prefix', str( path ) )
+                how = 'solved and created'
+
+                if entry is not None:
+                    self.__store( entry, env_file, path )
+
+            done_flag.touch()
+
+        except BaseException:
+            rmtree( path, ignore_errors = True )
+            raise
+
+        return '{} in {:.1f} s ({})'.format( how, monotonic() - start, path )
+
+
+    def __install( self, entry, path ):
+        '''
+        Create an environment from the package files of a store entry (offline, without solving it).
+        '''
+        packages = Path( entry, 'packages.txt' ).read_text().split()
+
+        with TemporaryDirectory() as dir:
+            explicit = Path( dir, 'explicit.txt' )
+            explicit.write_text( '@EXPLICIT\n' + ''.join(
+                '{}#{}\n'.format( Path( entry, 'pkgs', name ).as_uri(), digest )
+                for name, _, digest in ( p.partition( '#' ) for p in packages )
+            ) )
+
+            # The package files of the entry are used as package cache, such that the shared package
+            # cache of conda does not refer to the store (packages are extracted only once per entry).
+            self.__conda(
+                'create', '--yes', '--quiet', '--offline', '--prefix', str( path ), '--file', str( explicit ),
+                env = dict( environ, CONDA_PKGS_DIRS = str( Path( entry, 'pkgs' ) ) )
+            )
+
+
+    def __store( self, entry, env_file, path ):
+        '''
+        Add the packages of a solved environment to the store (from the package cache of conda).
+        '''
+        # Explicit list of packages (URLs with MD5 digests).
+        urls = [
+            l.strip() for l in self.__conda( 'list', '--explicit', '--md5', '--prefix', str( path ) ).splitlines()
+            if l.strip() and not l.startswith( ( '#', '@' ) )
+        ]
+
+        packages = []
+        for url in urls:
+            url, _, digest = url.partition( '#' )
+            name = url.rsplit( '/', 1 )[-1]
+            cached = [ Path( d, name ) for d in self.info()['pkgs_dirs'] if Path( d, name ).is_file() ]
+            if not cached:
+                print( 'Package {} not found in package cache, conda environment {} not stored.'.format( name, env_file.name ) )
+                return
+            packages.append( ( name, digest, cached[0] ) )
+
+        # Write entry to a temporary directory first, such that only complete entries become visible.
+        tmp = Path( self.store_dir, '{}.tmp-{}-{}'.format( entry.name, getpid(), get_ident() ) )
+
+        try:
+            Path( tmp, 'pkgs' ).mkdir( parents = True )
+            for name, _, cached in packages:
+                try:
+                    link( cached, Path( tmp, 'pkgs', name ) )
+                except OSError:
+                    copyfile( cached, Path( tmp, 'pkgs', name ) )
+
+            Path( tmp, 'packages.txt' ).write_text( ''.join( '{}#{}\n'.format( name, digest ) for name, digest, _ in packages ) )
+            copyfile( env_file, Path( tmp, 'environment.yml' ) )
+            Path( tmp, 'meta.json' ).write_text( json_dumps( {
+                'env_file': env_file.name,
+                'platform': self.info()['platform'],
+                'created': time()
+            } ) )
+
+            replace( tmp, entry )
+        except OSError:
+            # Entry has been added concurrently (or store not writable), discard it.
+            rmtree( tmp, ignore_errors = True )
+
+
+    def __conda( self, *args, env = None ):
+        '''
+        Run a conda command (optionally with other environment variables).
+
+        :return: output of the command
+        '''
+        try:
+            result = run( [ self.conda, *args ], capture_output = True, text = True, env = env )
+        except OSError as err:
+            raise RuntimeError( 'Failed to run conda: {}'.format( err ) )
+
+        if result.returncode != 0:
+            raise RuntimeError( 'Command "conda {}" failed:\n{}'.format( ' '.join( args ), ( result.stderr or result.stdout ).strip() ) )
+
+        return result.stdout
@@ -0,0 +1,247 @@
+import socket
+from json import loads as json_loads, dumps as json_dumps
+from os import chmod, environ, rmdir, stat, unlink
+from os.path import join
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+from stat import S_IREAD, S_IWRITE
+from struct import calcsize, unpack
+from tempfile import mkdtemp
+from threading import Lock, Thread
+
+from .._config import *
+
+
+class CredentialsAgent:
+    '''
+    Local agent that holds the unlocked credentials cache and answers requests from the jobs of a
+    workflow (similar to ssh-agent). Hence, the jobs do not have to derive the key and decrypt the
+    cache again, looking up credentials becomes a round-trip via a Unix domain socket.
+
+    The socket is created in a new temporary directory (accessible for the current user only) and
+    its path is published to child processes via environment variable '{{ cookiecutter.project_slug | upper }}_AGENT_SOCK'.
+    Where supported (Linux), the agent only answers requests from processes of the same user.
+
+    Requests and responses are JSON objects, one per line:
+      - {"cmd": "retrieve", "sitename": ...} -> {"user": ..., "pwd": ...}
+      - {"cmd": "sitenames"} -> {"sitenames": [...]}
+    In case of an error, the response is {"error": ...}.
+    '''
+
+    def __init__( self, credentials_cache ):
+
+        if not CredentialsAgent.supported():
+            raise RuntimeError( 'Credentials agent requires Unix domain sockets' )
+
+        # Unlocked credentials cache.
+        self.credentials_cache = credentials_cache
+
+        # Path of the socket (available after starting the agent).
+        self.socket_path = None
+
+        self.__server = None
+        self.__thread = None
+
+
+    @staticmethod
+    def supported():
+        '''
+        Check if the credentials agent is supported on this platform.
+        '''
+        return hasattr( socket, 'AF_UNIX' )
+
+
+    def start( self ):
+        '''
+        Start answering requests in a background thread and publish the socket path to child processes.
+        '''
+        # Create socket in a private directory (mkdtemp creates it accessible for the current user only).
+        socket_dir = mkdtemp( prefix = '{{ cookiecutter.project_slug }}-agent-' )
+        self.socket_path = join( socket_dir, 'agent.sock' )
+
+        self.__server = CredentialsAgentServer( self.socket_path, CredentialsAgentHandler )
+        self.__server.credentials_cache = self.credentials_cache
+
+        # Set socket file permissions (read and write access for the current user only).
+        chmod( self.socket_path, S_IREAD | S_IWRITE )
+
+        self.__thread = Thread( target = self.__server.serve_forever, daemon = True )
+        self.__thread.start()
+
+        environ[CREDENTIALS_AGENT_SOCKET_VAR] = self.socket_path
+
+
+    def stop( self ):
+        '''
+        Stop the agent and remove the socket.
+        '''
+        if self.__server is None:
+            return
+
+        if environ.get( CREDENTIALS_AGENT_SOCKET_VAR ) == self.socket_path:
+            del environ[CREDENTIALS_AGENT_SOCKET_VAR]
+
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+        unlink( self.socket_path )
+        rmdir( Path( self.socket_path ).parent )
+
+        self.__server = None
+        self.__thread = None
+        self.socket_path = None
+
+
+    def __enter__( self ):
+        self.start()
+        return self
+
+
+    def __exit__( self, *args ):
+        self.stop()
+
+
+class CredentialsAgentServer( ThreadingMixIn, UnixStreamServer ):
+    '''
+    Socket server of the credentials agent (one thread per connection).
+    '''
+    daemon_threads = True
+
+
+class CredentialsAgentHandler( StreamRequestHandler ):
+    '''
+    Handle the requests of a single connection to the credentials agent.
+    '''
+
+    # Maximum size of a request in bytes.
+    max_request_size = 64*1024
+
+    def handle( self ):
+
+        # Only answer requests from processes of the same user.
+        if not self.__peer_is_owner():
+            return
+
+        while True:
+            line = self.rfile.readline( self.max_request_size )
+            if not line.endswith( b'\n' ):
+                # Connection closed (or request too long).
+                return
+
+            try:
+                response = self.__process( json_loads( line ) )
+            except ( RuntimeError, ValueError, KeyError, TypeError ) as err:
+                response = { 'error' : str( err ) }
+
+            self.wfile.write( json_dumps( response ).encode( 'utf-8' ) + b'\n' )
+            self.wfile.flush()
+
+
+    def __process( self, request ):
+        credentials_cache = self.server.credentials_cache
+
+        if request['cmd'] == 'retrieve':
+            user, pwd = credentials_cache.retrieve( request['sitename'] )
+            return { 'user' : user, 'pwd' : pwd }
+
+        if request['cmd'] == 'sitenames':
+            return { 'sitenames' : credentials_cache.sitenames() }
+
+        raise RuntimeError( 'Unknown request: "{}"'.format( request['cmd'] ) )
+
+
+    def __peer_is_owner( self ):
+        if not hasattr( socket, 'SO_PEERCRED' ):
+            # Rely on the permissions of the socket and its directory.
+            return True
+
+        # Retrieve process ID, user ID and group ID of the connected process.
+        creds = self.request.getsockopt( socket.SOL_SOCKET, socket.SO_PEERCRED, calcsize( '3i' ) )
+        _, uid, _ = unpack( '3i', creds )
+
+        # Compare with the owner of the socket (i.e., the user running the agent).
+        return uid == stat( self.server.server_address ).st_uid
+
+
+class CredentialsAgentClient:
+    '''
+    Retrieve credentials from a running credentials agent (same interface as the credentials cache,
+    except that no credentials can be stored).
+    '''
+
+    def __init__( self, socket_path ):
+
+        self.__socket = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        self.__socket.connect( socket_path )
+        self.__file = self.__socket.makefile( 'rwb' )
+
+        # Requests of concurrent threads must not be interleaved.
+        self.__lock = Lock()
+
+
+    @classmethod
+    def connect( cls ):
+        '''
+        Connect to the credentials agent published via environment variable (if available).
+
+        :return: new client, None if no agent is available
+        '''
+        socket_path = environ.get( CREDENTIALS_AGENT_SOCKET_VAR )
+
+        if not socket_path or not CredentialsAgent.supported():
+            return None
+
+        try:
+            return cls( socket_path )
+        except OSError:
+            return None
+
+
+    def retrieve( self, sitename ):
+        '''
+        Retrieve the credentials for a given site from the agent.
+
+        :return: tuple with user name and password
+        '''
+        response = self.__request( { 'cmd' : 'retrieve', 'sitename' : sitename } )
+        return ( response['user'], response['pwd'] )
+
+
+    def store( self, sitename ):
+        '''
+        Credentials cannot be stored via the agent.
+        '''
+        raise RuntimeError( 'Credentials cannot be stored via the credentials agent' )
+
+
+    def sitenames( self ):
+        '''
+        Retrieve list of sites for which credentials have been stored.
+
+        :return: list of known sitenames
+        '''
+        return self.__request( { 'cmd' : 'sitenames' } )['sitenames']
+
+
+    def close( self ):
+        '''
+        Close the connection to the agent.
+        '''
+        self.__file.close()
+        self.__socket.close()
+
+
+    def __request( self, request ):
+        with self.__lock:
+            self.__file.write( json_dumps( request ).encode( 'utf-8' ) + b'\n' )
+            self.__file.flush()
+            line = self.__file.readline()
+
+        if not line:
+            raise RuntimeError( 'Connection to credentials agent lost' )
+
+        response = json_loads( line )
+        if 'error' in response:
+            raise RuntimeError( response['error'] )
+
+        return response
@@ -1,9 +1,12 @@
+from contextlib import contextmanager
 from getpass import getpass
-from json import loads as json_loads, dumps as json_dumps
 from pathlib import Path
 
+from .credentials_agent import CredentialsAgentClient
+from .credentials_store import CredentialsStore
 from .crypto import Crypto
 from .file_permissions import FilePermissions
+from .lru_cache import LRUCache
 from .._config import *
 
 
@@ -11,16 +14,23 @@ class CredentialsCache:
     '''
     Store credentials needed for the workflow in an encrypted cache.
 
-    Returns a singleton instance of the credentials cache implementation.
+    Returns a singleton instance of the credentials cache implementation. If a credentials agent
+    is available (see class CredentialsAgent), a client for this agent is returned instead.
     '''
 
     # Singleton instance.
     __instance = None
 
-    def __new__( cls, new_cache = False ):
+    def __new__( cls, new_cache = False, backend = 'log' ):
 
         if CredentialsCache.__instance is None:
-            CredentialsCache.__instance = CredentialsCacheImpl( new_cache )
+            # Connect to credentials agent, unless a new cache is requested.
+            agent = None if new_cache else CredentialsAgentClient.connect()
+
+            if agent is not None:
+                CredentialsCache.__instance = agent
+            else:
+                CredentialsCache.__instance = CredentialsCacheImpl( new_cache, backend )
 
         return CredentialsCache.__instance
 
@@ -28,9 +38,24 @@ class CredentialsCache:
 class CredentialsCacheImpl:
     '''
     Implementation of the credentials cache.
+
+    The cache file is written via a credentials store backend (see class CredentialsStore).
+
+    Schema (version 2): one entry per site, with key "site:<sitename>" and the encrypted user name
+    and password as value, plus the schema version. Caches using the previous schema (list of
+    sitenames plus separate keys for user name and password) are migrated when they are loaded.
+
+    Credentials are decrypted on demand. Decrypted credentials are kept in a small in-memory cache
+    (see class LRUCache), which evicts them after a time-to-live.
     '''
 
-    def __init__( self, new_cache = False ):
+    # Version of the cache schema.
+    schema_version = 2
+
+    # Prefix for the keys of site entries.
+    site_prefix = 'site:'
+
+    def __init__( self, new_cache = False, backend = 'log', decrypted_cache_size = 32, decrypted_cache_ttl = 300. ):
 
         if not isinstance( new_cache, bool ):
             raise TypeError( 'Input parameter "new_cache" has to be of type "bool"' )
@@ -49,18 +74,32 @@ class CredentialsCacheImpl:
         # Helper class for setting file permissions.
         self.__file_permissions = FilePermissions()
 
+        # Backend for storing the cache file.
+        self.__store = CredentialsStore( self.cache_file_name, self.__crypto, backend )
+
+        # Flag indicating that updates are committed in a batch.
+        self.__batch = False
+
+        # Recently decrypted credentials.
+        self.__decrypted = LRUCache( decrypted_cache_size, decrypted_cache_ttl )
+
         # Load data from cache file if available.
-        if self.cache_file_name.is_file():
-            try:
-                with open( self.cache_file_name, 'rb' ) as f:
-                    encrypted_content = f.read()
-                    serialized_content = self.__crypto.decrypt( encrypted_content )
-                    self.__db = json_loads( serialized_content )
-
-            except RuntimeError as err:
-                raise RuntimeError( 'Error opening credential cache: {}'.format( err ) )
-        else:
-            self.__db = { 'sitenames' : [] }
+        try:
+            db = self.__store.load()
+        except RuntimeError as err:
+            raise RuntimeError( 'Error opening credential cache: {}'.format( err ) )
+
+        if db and not 'version' in db:
+            db = self.__migrate( db )
+
+        if db.get( 'version', self.schema_version ) > self.schema_version:
+            raise RuntimeError( 'Unsupported credentials cache version: {}'.format( db['version'] ) )
+
+        # Encrypted credentials by sitename.
+        self.__sites = {
+            key[len( self.site_prefix ):] : value
+            for key, value in db.items() if key.startswith( self.site_prefix )
+        }
 
 
     def retrieve( self, sitename ):
@@ -70,20 +109,20 @@ class CredentialsCacheImpl:
         :return: tuple with user name and password
         '''
         # Check if credentials have been stored for this site.
-        if not sitename in self.__db['sitenames']:
+        entry = self.__sites.get( sitename )
+        if entry is None:
             raise RuntimeError( 'Unknown sitename: "{}"'.format( sitename ) )
 
-        # Retrieve user name from cache.
-        key = '{}_user'.format( sitename )
-        value = self.__db[key]
-        user = self.__crypto.decrypt( value )
+        # Check if credentials have been decrypted recently.
+        credentials = self.__decrypted.get( sitename )
+        if credentials is not None:
+            return credentials
 
-        # Retrieve password from cache.
-        key = '{}_pwd'.format( sitename )
-        value = self.__db[key]
-        pwd = self.__crypto.decrypt( value )
+        # Decrypt user name and password.
+        credentials = ( self.__crypto.decrypt( entry['user'] ), self.__crypto.decrypt( entry['pwd'] ) )
+        self.__decrypted.put( sitename, credentials )
 
-        return ( user, pwd )
+        return credentials
 
 
     def store( self, sitename ):
@@ -93,37 +132,37 @@ class CredentialsCacheImpl:
         :return: none
         '''
         # Check if site is already known.
-        if sitename in self.__db['sitenames']:
+        if sitename in self.__sites:
             # Cache already has credentials stored for this site.
             # Ask user if they should be overwritten.
             if not self.__user_select( 'Overwrite existing credentials for "{}"? [Y/n] '.format( sitename ) ):
                 return
         else:
             # Cache already has no credentials stored for this site yet.
-            # Add site to list of known sites.
-            self.__db['sitenames'].append( sitename )
             print( 'Please enter credentials for "{}":'.format( sitename ) )
 
-        # Encrypt and store username.
-        key = '{}_user'.format( sitename )
-        value = getpass( 'User name:' )
-        self.__db[key] = self.__crypto.encrypt( value ).decode('utf-8')
-        del value
+        # Encrypt and store username and password.
+        user = getpass( 'User name:' )
+        pwd = getpass( 'Password:' )
+        self.__put_site( sitename, user, pwd )
+        del user, pwd
 
-        # Encrypt and store password.
-        key = '{}_pwd'.format( sitename )
-        value = getpass( 'Password:' )
-        self.__db[key] = self.__crypto.encrypt( value ).decode('utf-8')
-        del value
+        # Store cache (unless updates are committed in a batch).
+        if not self.__batch:
+            self.__commit()
 
-        # Store cache.
-        with open( self.cache_file_name, 'wb' ) as f:
-            serialized_content = json_dumps( self.__db )
-            encrypted_content = self.__crypto.encrypt( serialized_content )
-            f.write( encrypted_content )
 
-        # Set cache file permissions.
-        self.__file_permissions.restrict_access( self.cache_file_name )
+    @contextmanager
+    def batch( self ):
+        '''
+        Commit all credentials stored within this context at once (when leaving the context).
+        '''
+        self.__batch = True
+        try:
+            yield self
+        finally:
+            self.__batch = False
+            self.__commit()
 
 
     def sitenames( self ):
@@ -132,7 +171,106 @@ class CredentialsCacheImpl:
 
         :return: list of known sitenames
         '''
-        return self.__db['sitenames']
+        return list( self.__sites )
+
+
+    def import_credentials( self, credentials ):
+        '''
+        Store the credentials for several sites at once (existing credentials are overwritten).
+        All credentials are committed with a single write.
+
+        :param credentials: dict with sitenames as keys and tuples with user name and password as values
+        :return: none
+        '''
+        for sitename, ( user, pwd ) in credentials.items():
+            # Encrypt and store username and password.
+            self.__put_site( sitename, user, pwd )
+
+        # Store cache (unless updates are committed in a batch).
+        if not self.__batch:
+            self.__commit()
+
+
+    def export_credentials( self ):
+        '''
+        Retrieve the credentials for all sites.
+
+        :return: dict with sitenames as keys and tuples with user name and password as values
+        '''
+        return { sitename : self.retrieve( sitename ) for sitename in self.__sites }
+
+
+    def rotate( self, crypto, transaction = None ):
+        '''
+        Re-encrypt the whole cache for another crypto instance (i.e., with another passphrase).
+        The new cache file replaces the old one atomically, either immediately or when committing
+        the given transaction (see class FileTransaction). In the latter case, the cache must not
+        be modified before the transaction has been committed.
+
+        :return: none
+        '''
+        credentials = self.export_credentials()
+
+        # Wait for pending background tasks of the old store backend.
+        self.__store.close()
+
+        # Write all credentials to a new cache file.
+        self.__crypto = crypto
+        self.__sites = {}
+        self.__decrypted.clear()
+        self.__store = CredentialsStore( self.cache_file_name, crypto, self.__store.format )
+        self.__store.reset( { 'version' : self.schema_version }, transaction )
+        self.import_credentials( credentials )
+
+
+    def close( self ):
+        '''
+        Wait until pending background tasks of the store backend are done.
+        '''
+        self.__store.close()
+
+
+    def __put_site( self, sitename, user, pwd ):
+        entry = {
+            'user' : self.__crypto.encrypt( user ).decode('utf-8'),
+            'pwd' : self.__crypto.encrypt( pwd ).decode('utf-8')
+        }
+
+        self.__sites[sitename] = entry
+        self.__decrypted.pop( sitename )
+        self.__store.put( self.site_prefix + sitename, entry )
+
+        # New caches start with the current schema version.
+        if len( self.__sites ) == 1:
+            self.__store.put( 'version', self.schema_version )
+
+
+    def __migrate( self, db ):
+        '''
+        Migrate a cache from the previous schema (version 1) to the current schema. The encrypted
+        values are kept as they are, the migrated cache is written right away.
+
+        :return: migrated cache content
+        '''
+        for sitename in db.get( 'sitenames', [] ):
+            entry = { 'user' : db['{}_user'.format( sitename )], 'pwd' : db['{}_pwd'.format( sitename )] }
+            self.__store.put( self.site_prefix + sitename, entry )
+            self.__store.put( '{}_user'.format( sitename ), None )
+            self.__store.put( '{}_pwd'.format( sitename ), None )
+
+        self.__store.put( 'sitenames', None )
+        self.__store.put( 'version', self.schema_version )
+        self.__commit()
+
+        return self.__store.load()
+
+
+    def __commit( self ):
+        self.__store.commit()
+
+        # Set cache file permissions (not yet written with a pending transaction, see method "rotate").
+        if self.cache_file_name.is_file():
+            self.__file_permissions.restrict_access( self.cache_file_name )
 
 
     def __user_select( self, question ):
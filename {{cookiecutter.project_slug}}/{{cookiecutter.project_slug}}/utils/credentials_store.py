@@ -0,0 +1,368 @@
+from abc import ABC, abstractmethod
+from json import loads as json_loads, dumps as json_dumps
+from os import fsync, replace
+from struct import calcsize, pack, unpack
+from threading import Lock, Thread
+
+from .crypto import CryptoStreamWriter
+from .file_permissions import FilePermissions
+
+
+class CredentialsStore:
+    '''
+    Persistent storage of the credentials cache (a dict of JSON-serializable values).
+
+    There are 2 backends available:
+      1. 'log': append-only log of individually encrypted records. Storing a value only appends
+         a record, batched updates are committed with a single write that ends with an authenticated
+         commit marker. Records are chained, a log with removed, replayed or trailing uncommitted
+         records is rejected. The log is compacted in the background once it contains enough
+         overwritten records.
+      2. 'blob': the whole dict is encrypted as a single blob, which is rewritten for every commit.
+    Both backends replace whole files atomically (write to temporary file and rename). Both backends read files written by the other one (or by
+    previous versions), the file is converted to the format of the selected backend with the next commit.
+
+    Returns an instance of the store implementation for the selected backend.
+    '''
+
+    # Available backends.
+    backends = [ 'log', 'blob' ]
+
+    def __new__( cls, file_name, crypto, backend = 'log' ):
+
+        if backend not in cls.backends:
+            raise ValueError( 'Input parameter "backend" has to be one of: {}'.format( ', '.join( cls.backends ) ) )
+
+        if backend == 'log':
+            return LogCredentialsStoreImpl( file_name, crypto )
+
+        return BlobCredentialsStoreImpl( file_name, crypto )
+
+
+# Magic bytes at the beginning of a record log (distinct from the magic bytes of encrypted streams).
+LOG_MAGIC = b'\x00TWO-LOG\x02'
+
+# Header of a log record (length of the encrypted record).
+LOG_RECORD_HEADER = '>I'
+
+
+class CredentialsStoreImpl( ABC ):
+    '''
+    Common implementation of the credentials store backends (loading and pending updates).
+    '''
+
+    # Format written by the backend.
+    format = None
+
+    def __init__( self, file_name, crypto ):
+
+        # Path to the store file.
+        self.file_name = file_name
+
+        # Helper class for encrypting / decrypting data.
+        self._crypto = crypto
+
+        # Helper class for setting file permissions.
+        self._file_permissions = FilePermissions()
+
+        # Current content of the store.
+        self._db = {}
+
+        # Updates not yet committed (list of tuples with key and serialized value).
+        self._pending = []
+
+        # Format of the existing file (None if no file exists).
+        self._file_format = None
+
+        # Number of records and size of an existing record log.
+        self._num_records = 0
+        self._valid_size = 0
+
+        # Authentication tag of the last record of an existing record log (next record is chained to it).
+        self._chain = None
+
+        # Serialize access to the file (commits and background compaction).
+        self._lock = Lock()
+
+        # Transaction for replacing the file with the next commit (see method "reset").
+        self._transaction = None
+
+
+    def load( self ):
+        '''
+        Load the content of the store file (in any supported format).
+
+        :return: dict with the stored values
+        '''
+        if not self.file_name.is_file():
+            self._db = {}
+            self._file_format = None
+            return dict( self._db )
+
+        with open( self.file_name, 'rb' ) as f:
+            if f.read( len( LOG_MAGIC ) ) == LOG_MAGIC:
+                self._file_format = 'log'
+                self._db = self._read_log( f )
+            else:
+                f.seek( 0 )
+                self._file_format = 'blob'
+                self._db = json_loads( self._crypto.reader( f ).read() )
+
+        return dict( self._db )
+
+
+    def put( self, key, value ):
+        '''
+        Store a value (None to delete the key). The update becomes persistent with the next commit.
+        '''
+        with self._lock:
+            if value is None:
+                self._db.pop( key, None )
+            else:
+                self._db[key] = value
+
+            self._pending.append( ( key, json_dumps( value ) ) )
+
+
+    def reset( self, db, transaction = None ):
+        '''
+        Replace the whole content of the store. With the next commit, a new file is written. If a
+        transaction is given (see class FileTransaction), the new file only replaces the existing
+        one when committing the transaction.
+        '''
+        with self._lock:
+            self._db = dict( db )
+            self._pending = []
+            self._file_format = None
+            self._transaction = transaction
+
+
+    @abstractmethod
+    def commit( self ):
+        '''
+        Make all pending updates persistent.
+        '''
+
+
+    def close( self ):
+        '''
+        Wait until pending background tasks are done.
+        '''
+        pass
+
+
+    def _read_log( self, f ):
+        '''
+        Read and verify all records of a record log. Every record is authenticated together with the
+        tag of the previous record, hence removed, reordered or replayed records are detected. A log
+        that does not end with a commit marker (e.g., a truncated log) is rejected.
+        '''
+        db = {}
+        self._num_records = 0
+        committed = False
+
+        header_size = calcsize( LOG_RECORD_HEADER )
+
+        # The first record is chained to the magic bytes.
+        chain = LOG_MAGIC
+
+        while True:
+            header = f.read( header_size )
+            if not header:
+                break
+
+            if len( header ) < header_size:
+                raise RuntimeError( 'Credentials cache file is truncated!' )
+
+            length, = unpack( LOG_RECORD_HEADER, header )
+            sealed = f.read( length )
+            if len( sealed ) < length:
+                raise RuntimeError( 'Credentials cache file is truncated!' )
+
+            record = json_loads( self._crypto.unseal( sealed, chain ) )
+            chain = sealed[-CryptoStreamWriter.tag_size:]
+
+            if isinstance( record, dict ):
+                # Commit marker (number of records written so far).
+                if not record.get( 'commit' ) == self._num_records:
+                    raise RuntimeError( 'Decryption failed.' )
+                committed = True
+                continue
+
+            key, value = record
+            if value is None:
+                db.pop( key, None )
+            else:
+                db[key] = value
+
+            self._num_records += 1
+            committed = False
+
+        if not committed:
+            raise RuntimeError( 'Credentials cache file is truncated (last commit marker is missing)!' )
+
+        self._valid_size = f.tell()
+        self._chain = chain
+
+        return db
+
+
+    def _encode_records( self, updates, chain, num_records ):
+        '''
+        Encode updates (list of tuples with key and serialized value) as log records, followed by a
+        commit marker. The first record is chained to the given tag, "num_records" is the number of
+        records already in the log.
+
+        :return: tuple with encoded records (bytes) and tag of the commit marker
+        '''
+        records = [ '[{},{}]'.format( json_dumps( key ), value_json ) for key, value_json in updates ]
+        records.append( json_dumps( { 'commit': num_records + len( updates ) } ) )
+
+        encoded = []
+        for r in records:
+            sealed = self._crypto.seal( r.encode( 'utf-8' ), chain )
+            encoded.append( pack( LOG_RECORD_HEADER, len( sealed ) ) + sealed )
+            chain = sealed[-CryptoStreamWriter.tag_size:]
+
+        return b''.join( encoded ), chain
+
+
+    def _replace( self, write ):
+        '''
+        Atomically replace the store file (write to temporary file, then rename). With a pending
+        transaction, the file is renamed when committing the transaction instead.
+        '''
+        if self._transaction is None:
+            tmp_file_name = self.file_name.with_name( self.file_name.name + '.tmp' )
+        else:
+            tmp_file_name = self._transaction.tmp_file_name( self.file_name )
+
+        with open( tmp_file_name, 'wb' ) as f:
+            # Set file permissions before writing any data.
+            self._file_permissions.restrict_access( tmp_file_name )
+            write( f )
+            f.flush()
+            fsync( f.fileno() )
+
+        if self._transaction is None:
+            replace( tmp_file_name, self.file_name )
+        else:
+            self._transaction = None
+
+
+class BlobCredentialsStoreImpl( CredentialsStoreImpl ):
+    '''
+    Credentials store implementation writing the whole dict as single encrypted blob.
+    '''
+
+    format = 'blob'
+
+    def commit( self ):
+        with self._lock:
+            if not self._pending and self._file_format == self.format:
+                return
+
+            def write( f ):
+                with self._crypto.writer( f ) as w:
+                    w.write( json_dumps( self._db ).encode( 'utf-8' ) )
+
+            self._replace( write )
+
+            self._pending = []
+            self._file_format = self.format
+
+
+class LogCredentialsStoreImpl( CredentialsStoreImpl ):
+    '''
+    Credentials store implementation using an append-only log of encrypted records.
+
+    Log format: magic bytes | record | record | ..., where each record consists of its length
+    (4 bytes, big-endian) and the sealed JSON array [key, value] (see method "seal" of class CryptoImpl).
+    A value of null deletes the key. The last record for a key determines its value. Every commit ends
+    with a commit marker, the sealed JSON object {"commit": <number of records>}. Each record is sealed
+    with the authentication tag of the previous record (or the magic bytes) as additional data.
+    '''
+
+    format = 'log'
+
+    # Compact the log if it contains more than this factor times the number of live records.
+    compact_factor = 2
+
+    # Never compact logs with fewer records.
+    compact_min_records = 64
+
+    def __init__( self, file_name, crypto ):
+
+        super().__init__( file_name, crypto )
+
+        # Background compaction thread.
+        self.__compact_thread = None
+
+
+    def commit( self ):
+        with self._lock:
+            if not self._file_format == self.format:
+                # Write all records to a new log (initial commit or conversion from another format).
+                self.__write_snapshot()
+                self._pending = []
+                return
+
+            if not self._pending:
+                return
+
+            records, chain = self._encode_records( self._pending, self._chain, self._num_records )
+
+            with open( self.file_name, 'r+b' ) as f:
+                # Append after the last commit marker.
+                f.seek( self._valid_size )
+                f.write( records )
+                f.flush()
+                fsync( f.fileno() )
+                self._valid_size = f.tell()
+
+            self._chain = chain
+            self._num_records += len( self._pending )
+            self._pending = []
+
+            compact = self._num_records > max( self.compact_min_records, self.compact_factor * len( self._db ) )
+
+        if compact:
+            self.compact( background = True )
+
+
+    def compact( self, background = False ):
+        '''
+        Rewrite the log with only the live records, optionally in a background thread.
+        '''
+        if not background:
+            with self._lock:
+                self.__write_snapshot()
+            return
+
+        if self.__compact_thread is not None and self.__compact_thread.is_alive():
+            return
+
+        self.__compact_thread = Thread( target = self.compact )
+        self.__compact_thread.start()
+
+
+    def close( self ):
+        if self.__compact_thread is not None:
+            self.__compact_thread.join()
+            self.__compact_thread = None
+
+
+    def __write_snapshot( self ):
+        updates = [ ( k, json_dumps( v ) ) for k, v in self._db.items() ]
+        records, chain = self._encode_records( updates, LOG_MAGIC, 0 )
+
+        def write( f ):
+            f.write( LOG_MAGIC )
+            f.write( records )
+
+        self._replace( write )
+
+        self._file_format = self.format
+        self._num_records = len( updates )
+        self._valid_size = len( LOG_MAGIC ) + len( records )
+        self._chain = chain
@@ -1,12 +1,17 @@
 from base64 import b64encode, b64decode
 from getpass import getpass
 from hashlib import sha256
-from os import environ
-from Crypto import Random
-from Crypto.Cipher import AES
+from hmac import new as hmac_new
+from io import BytesIO, RawIOBase
+from os import environ, replace
+from shutil import copymode
+from struct import pack
 
 from .._config import *
 
+# Package Crypto (pycryptodome) is imported by the methods that use it, such that importing
+# this module does not slow down the start of the command line scripts.
+
 
 class Crypto:
     '''
@@ -39,23 +44,33 @@ class CryptoImpl:
     Simple crypto implementation using an AES cipher (CBC mode).
 
     Inspired by: https://stackoverflow.com/a/12525165
+
+    For large payloads (e.g., the file digest or the credentials cache), a streaming interface
+    with authenticated encryption (AES in GCM mode, see classes CryptoStreamWriter and
+    CryptoStreamReader) is available. Data encrypted with the CBC mode can still be read via
+    this interface.
     '''
 
-    def __init__( self ):
+    def __init__( self, user_key = None ):
 
-        # Check for credentials (defined via environment
-        # variable) or ask user for a secret passphrase.
-        if '{{ cookiecutter.project_slug | upper }}_PWD_FILE' in environ:
-            cred_file_name = Path( environ['{{ cookiecutter.project_slug | upper }}_PWD_FILE'] )
-            with open( cred_file_name, 'r' ) as f:
-                user_key = f.read()
-        else:
-            user_key = getpass( 'Enter your secret passphrase:' )
+        # Check for credentials (defined via environment variable) or ask user for a
+        # secret passphrase (unless the passphrase is passed explicitly).
+        if user_key is None:
+            if '{{ cookiecutter.project_slug | upper }}_PWD_FILE' in environ:
+                cred_file_name = Path( environ['{{ cookiecutter.project_slug | upper }}_PWD_FILE'] )
+                with open( cred_file_name, 'r' ) as f:
+                    user_key = f.read()
+            else:
+                user_key = getpass( 'Enter your secret passphrase:' )
 
         # Store passphrase as key for cipher.
         self.__key = sha256( user_key.encode() ).digest()
 
+        # Derive separate key for authenticated stream encryption.
+        self.__stream_key = hmac_new( self.__key, b'stream', sha256 ).digest()
+
         # Store cipher block size.
+        from Crypto.Cipher import AES
         self.__bs = AES.block_size
 
 
@@ -65,6 +80,9 @@ class CryptoImpl:
 
         :return: encrypted data as sequence of bytes
         '''
+        from Crypto import Random
+        from Crypto.Cipher import AES
+
         # Pad plaintext.
         raw = self.__pad( plaintext )
 
@@ -84,6 +102,8 @@ class CryptoImpl:
 
         :return: decrypted data as string
         '''
+        from Crypto.Cipher import AES
+
         try:
             # Decode ciphertext.
             enc = b64decode( ciphertext )
@@ -102,6 +122,98 @@ class CryptoImpl:
             raise RuntimeError( 'Decryption failed.' )
 
 
+    def writer( self, fout, aad = b'' ):
+        '''
+        Open a file-like object for writing encrypted data to a binary output stream.
+        The encrypted data is written chunk by chunk, the object has to be closed after
+        writing all data. Optional additional data (not stored) is authenticated with
+        every chunk, the same data has to be provided for reading.
+
+        :return: file-like object (see class CryptoStreamWriter)
+        '''
+        return CryptoStreamWriter( self.__stream_key, fout, aad )
+
+
+    def reader( self, fin, aad = b'' ):
+        '''
+        Open a file-like object for reading decrypted data from a binary input stream.
+        Input streams that have been encrypted with method "encrypt" are also supported
+        (without additional authenticated data).
+
+        :return: file-like object
+        '''
+        header = fin.read( len( CryptoStreamWriter.magic ) )
+
+        if not header == CryptoStreamWriter.magic:
+            # Data has been encrypted in CBC mode.
+            return BytesIO( self.decrypt( header + fin.read() ).encode( 'utf-8' ) )
+
+        return CryptoStreamReader( self.__stream_key, fin, aad )
+
+
+    def seal( self, data, aad = b'' ):
+        '''
+        Encrypt and authenticate a (small) bytes object, using the stream format.
+        Optional additional data (not stored) is authenticated with it.
+
+        :return: encrypted data (bytes)
+        '''
+        f = BytesIO()
+        with self.writer( f, aad ) as w:
+            w.write( data )
+        return f.getvalue()
+
+
+    def unseal( self, data, aad = b'' ):
+        '''
+        Decrypt and verify a bytes object encrypted with method "seal" (with the same
+        additional authenticated data).
+
+        :return: decrypted data (bytes)
+        '''
+        return self.reader( BytesIO( data ), aad ).read()
+
+
+    def reencrypt_file( self, file_name, crypto, transaction = None ):
+        '''
+        Re-encrypt a file (encrypted with this instance) for another crypto instance (i.e., with
+        another passphrase) in a single streaming pass. The file is replaced atomically, either
+        immediately or when committing the given transaction (see class FileTransaction).
+        '''
+        if transaction is None:
+            tmp_file_name = file_name.with_name( file_name.name + '.tmp' )
+        else:
+            tmp_file_name = transaction.tmp_file_name( file_name )
+
+        with open( file_name, 'rb' ) as fin, open( tmp_file_name, 'wb' ) as fout:
+            # Keep the file permissions of the original file.
+            copymode( file_name, tmp_file_name )
+
+            with crypto.writer( fout ) as w:
+                self.decrypt_stream( fin, w )
+
+        if transaction is None:
+            replace( tmp_file_name, file_name )
+
+
+    def encrypt_stream( self, fin, fout ):
+        '''
+        Encrypt all data from a binary input stream and write it to a binary output stream.
+        '''
+        with self.writer( fout ) as w:
+            for chunk in iter( lambda : fin.read( CryptoStreamWriter.chunk_size ), b'' ):
+                w.write( chunk )
+
+
+    def decrypt_stream( self, fin, fout ):
+        '''
+        Decrypt all data from a binary input stream and write it to a binary output stream.
+        '''
+        r = self.reader( fin )
+        for chunk in iter( lambda : r.read( CryptoStreamWriter.chunk_size ), b'' ):
+            fout.write( chunk )
+
+
     def __pad( self, s ):
         l = self.__bs - len( s ) % self.__bs
         return s + l * chr( l )
@@ -109,3 +221,186 @@ class CryptoImpl:
 
     def __unpad( self, s ):
         return s[:-ord( s[len( s )-1:] )]
+
+
+class CryptoStreamWriter( RawIOBase ):
+    '''
+    File-like object for writing data with authenticated encryption (AES in GCM mode).
+
+    The data is split into chunks, which are encrypted and authenticated individually. The nonce of
+    each chunk consists of a random prefix (per stream), the chunk counter and a flag for the last
+    chunk. Hence, reordering, removing or appending chunks is detected when reading the data.
+
+    Stream format: magic bytes | nonce prefix | chunk 0 | chunk 1 | ... | last chunk,
+    where each chunk consists of the encrypted data and the authentication tag. The header
+    (magic bytes and nonce prefix) and optional additional data are authenticated with every chunk.
+    '''
+
+    # Magic bytes at the beginning of the stream (not a valid base64 string).
+    magic = b'\x00TWO-GCM\x01'
+
+    # Size of the plaintext of each chunk.
+    chunk_size = 64*1024
+
+    # Size of the random nonce prefix.
+    prefix_size = 7
+
+    # Size of the authentication tag of each chunk.
+    tag_size = 16
+
+
+    def __init__( self, key, fout, aad = b'' ):
+
+        super().__init__()
+
+        self.__key = key
+        self.__fout = fout
+        self.__buffer = bytearray()
+        self.__counter = 0
+
+        # Header (also authenticated as part of every chunk).
+        from Crypto import Random
+        self.__header = self.magic + Random.new().read( self.prefix_size )
+        self.__fout.write( self.__header )
+
+        # Additional authenticated data (not written to the stream).
+        self.__aad = bytes( aad )
+
+
+    def writable( self ):
+        return True
+
+
+    def write( self, b ):
+        self.__buffer += b
+
+        # Always keep the last chunk in the buffer, it is written when closing the stream.
+        while len( self.__buffer ) > self.chunk_size:
+            self.__write_chunk( self.__buffer[:self.chunk_size], last = False )
+            del self.__buffer[:self.chunk_size]
+
+        return len( b )
+
+
+    def close( self ):
+        if not self.closed:
+            self.__write_chunk( self.__buffer, last = True )
+            self.__buffer = bytearray()
+        super().close()
+
+
+    def abort( self ):
+        '''
+        Close the stream without writing the last chunk, i.e., the data written so far never
+        authenticates when reading it.
+        '''
+        self.__buffer = bytearray()
+        super().close()
+
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        # Do not finalize a partially written stream.
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+    def __write_chunk( self, chunk, last ):
+        from Crypto.Cipher import AES
+        cipher = AES.new( self.__key, AES.MODE_GCM, nonce = chunk_nonce( self.__header, self.__counter, last ) )
+        cipher.update( self.__header + self.__aad )
+        ciphertext, tag = cipher.encrypt_and_digest( bytes( chunk ) )
+        self.__fout.write( ciphertext )
+        self.__fout.write( tag )
+        self.__counter += 1
+
+
+class CryptoStreamReader( RawIOBase ):
+    '''
+    File-like object for reading data written by class CryptoStreamWriter.
+
+    Every chunk is authenticated before its data is returned.
+    '''
+
+    def __init__( self, key, fin, aad = b'' ):
+
+        super().__init__()
+
+        self.__key = key
+        self.__fin = fin
+        self.__aad = bytes( aad )
+        self.__buffer = b''
+        self.__offset = 0
+        self.__counter = 0
+        self.__done = False
+
+        # Header (magic bytes have already been read).
+        self.__header = CryptoStreamWriter.magic + fin.read( CryptoStreamWriter.prefix_size )
+        if not len( self.__header ) == len( CryptoStreamWriter.magic ) + CryptoStreamWriter.prefix_size:
+            raise RuntimeError( 'Decryption failed.' )
+
+        # Read ahead one chunk, to detect the last chunk.
+        self.__next = self.__read_chunk()
+
+
+    def readable( self ):
+        return True
+
+
+    def readinto( self, b ):
+        while self.__offset == len( self.__buffer ) and not self.__done:
+            self.__buffer = self.__decrypt_next_chunk()
+            self.__offset = 0
+
+        n = min( len( b ), len( self.__buffer ) - self.__offset )
+        b[:n] = self.__buffer[self.__offset:self.__offset + n]
+        self.__offset += n
+        return n
+
+
+    def readall( self ):
+        # Collect all remaining chunks (avoid copying the data via a fixed-size buffer).
+        chunks = [ self.__buffer[self.__offset:] ]
+        while not self.__done:
+            chunks.append( self.__decrypt_next_chunk() )
+        self.__buffer = b''
+        self.__offset = 0
+        return b''.join( chunks )
+
+
+    def __read_chunk( self ):
+        return self.__fin.read( CryptoStreamWriter.chunk_size + CryptoStreamWriter.tag_size )
+
+
+    def __decrypt_next_chunk( self ):
+        chunk = self.__next
+        self.__next = self.__read_chunk()
+        last = ( 0 == len( self.__next ) )
+
+        if len( chunk ) < CryptoStreamWriter.tag_size:
+            raise RuntimeError( 'Decryption failed.' )
+
+        from Crypto.Cipher import AES
+
+        try:
+            cipher = AES.new( self.__key, AES.MODE_GCM, nonce = chunk_nonce( self.__header, self.__counter, last ) )
+            cipher.update( self.__header + self.__aad )
+            data = cipher.decrypt_and_verify(
+                chunk[:-CryptoStreamWriter.tag_size],
+                chunk[-CryptoStreamWriter.tag_size:]
+            )
+        except ValueError:
+            raise RuntimeError( 'Decryption failed.' )
+
+        self.__counter += 1
+        self.__done = last
+
+        return data
+
+
+def chunk_nonce( header, counter, last ):
+    '''
+    Nonce for a chunk of an encrypted stream (random prefix, chunk counter, flag for last chunk).
+    '''
+    return header[-CryptoStreamWriter.prefix_size:] + pack( '>IB', counter, 1 if last else 0 )
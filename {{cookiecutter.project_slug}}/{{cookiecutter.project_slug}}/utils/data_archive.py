@@ -0,0 +1,381 @@
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta
+from json import dump as json_dump, load as json_load
+from os import getpid, replace
+from pathlib import Path
+from re import escape, fullmatch
+from shutil import copyfileobj
+
+from .file_hasher import file_digest
+from .._config import ARCHIVE_DIR_NAME, DATA_DIR_NAME
+
+
+class DataArchive:
+    '''
+    Retention policy for the output files of the workflow runs (in folder "data").
+
+    Runs that are not retained as individual files (see method expired) are compacted into
+    compressed archives, one archive per partition of the output files (e.g., one per day for
+    partition format "%Y/%m/%d"). Next to each archive, an index lists the archived files of
+    every run (name, size and digest), such that the files of a run can be extracted again
+    without unpacking the whole archive. Archives are deleted once all their runs are older
+    than the maximum archive age (if defined).
+
+    The run ID of an output file is taken from its name ("<run_id>_<step>...", see the Snakefile)
+    and the time of a run from its run ID (see method WorkflowConfig.run_time). Files of runs that
+    are currently executed by Snakemake (i.e., files listed in the lock files of Snakemake) are
+    never compacted.
+
+    The retention policy is configured by attribute "retention" of the workflow configuration (see
+    attribute DataArchive.defaults for all settings and their default values). Relative paths refer
+    to the workflow root directory.
+    '''
+
+    # Default settings.
+    defaults = {
+        'keep_runs': None,
+        'max_age_days': None,
+        'archive_dir': str( ARCHIVE_DIR_NAME ),
+        'max_archive_age_days': None
+    }
+
+    # Version of the index format.
+    index_version = 1
+
+    def __init__( self, workflow_config, root_dir = '.' ):
+
+        settings = dict( self.defaults )
+
+        for key, value in workflow_config.retention().items():
+            if key not in settings:
+                raise RuntimeError( 'Unknown attribute "{}" in retention configuration!'.format( key ) )
+            settings[key] = value
+
+        # Workflow configuration (for retrieving the time and partition of a run).
+        self.workflow_config = workflow_config
+
+        # Workflow root directory, data directory and archive directory.
+        self.root_dir = Path( root_dir ).resolve()
+        self.data_dir = Path( self.root_dir, DATA_DIR_NAME )
+        self.archive_dir = Path( self.root_dir, settings['archive_dir'] )
+
+        # Number of most recent runs that are retained (None for no limit).
+        self.keep_runs = settings['keep_runs']
+
+        # Maximum age of retained runs and of archived runs (None for no limit).
+        self.max_age = _days( settings['max_age_days'] )
+        self.max_archive_age = _days( settings['max_archive_age_days'] )
+
+
+    def runs( self ):
+        '''
+        Retrieve all runs with output files in the data directory.
+
+        :return: dict with run IDs as keys and tuples with the time of the run and the list of its files as values
+        '''
+        runs = {}
+
+        if not self.data_dir.is_dir():
+            return runs
+
+        for step_dir in sorted( d for d in self.data_dir.iterdir() if d.is_dir() ):
+            # File names start with the run ID, followed by the step name (and the shard of a sharded step).
+            pattern = r'(.+)_{}(?:_\d+)?\..+'.format( escape( step_dir.name ) )
+
+            for f in step_dir.rglob( '*' ):
+                match = fullmatch( pattern, f.name )
+                if match is None or not f.is_file():
+                    continue
+
+                run_id = match.group( 1 )
+                if run_id not in runs:
+                    try:
+                        runs[run_id] = ( self.workflow_config.run_time( run_id ), [] )
+                    except RuntimeError:
+                        # Not an output file of a run.
+                        continue
+
+                runs[run_id][1].append( f )
+
+        return runs
+
+
+    def expired( self, runs, now = None ):
+        '''
+        Select the runs that are not retained as individual files, i.e., all runs except for the most
+        recent runs (attribute "keep_runs") and runs older than the maximum age (attribute "max_age_days").
+
+        :return: list of run IDs (oldest first)
+        '''
+        now = datetime.now() if now is None else now
+
+        ordered = sorted( runs, key = lambda run_id: runs[run_id][0], reverse = True )
+        expired = [
+            run_id for i, run_id in enumerate( ordered )
+            if ( self.keep_runs is not None and i >= self.keep_runs ) or
+               ( self.max_age is not None and now - runs[run_id][0] > self.max_age )
+        ]
+
+        return list( reversed( expired ) )
+
+
+    def compact( self, dryrun = False, verbose = False ):
+        '''
+        Compact all expired runs into archives and delete archives older than the maximum archive age.
+
+        :return: number of compacted runs
+        '''
+        runs = self.runs()
+        locked = self.__locked_files()
+
+        # Group the expired runs by partition (runs with locked files are skipped).
+        partitions = {}
+        for run_id in self.expired( runs ):
+            if any( f in locked for f in runs[run_id][1] ):
+                print( 'Run {} is being executed, not compacted.'.format( run_id ) )
+                continue
+            partitions.setdefault( self.workflow_config.partition( run_id ), {} )[run_id] = runs[run_id][1]
+
+        compacted = 0
+        for partition, partition_runs in sorted( partitions.items() ):
+            archive, _ = self.archive_files( partition )
+
+            if verbose or dryrun:
+                print( '{} {} runs to {}.'.format( 'Would compact' if dryrun else 'Compacting',
+                                                   len( partition_runs ), archive.relative_to( self.root_dir ) ) )
+
+            if not dryrun:
+                self.__archive( partition, partition_runs )
+                for files in partition_runs.values():
+                    self.__remove( files )
+
+            compacted += len( partition_runs )
+
+        self.__purge( dryrun, verbose )
+
+        return compacted
+
+
+    def extract( self, run_id, steps = None, output_dir = None, overwrite = False ):
+        '''
+        Extract the archived files of a run (optionally only of some steps) to their original location
+        below an output directory (default: workflow root directory). Existing files are only overwritten
+        if requested.
+
+        :return: list of extracted files
+        '''
+        import tarfile
+
+        archive, index = self.archive_files( self.workflow_config.partition( run_id ) )
+        files = self.__read_index( index ).get( run_id )
+
+        if files is None:
+            raise RuntimeError( 'Run {} not found in archive.'.format( run_id ) )
+
+        output_dir = Path( self.root_dir if output_dir is None else output_dir ).resolve()
+
+        extracted = []
+        with tarfile.open( archive, 'r:gz' ) as tar:
+            for f in files:
+                name = Path( f['name'] )
+                if name.is_absolute() or '..' in name.parts or len( name.parts ) < 3:
+                    raise RuntimeError( 'Invalid file name in archive {}: {}'.format( archive, f['name'] ) )
+
+                # Files are named "data/<step>/...".
+                if steps and name.parts[1] not in steps:
+                    continue
+
+                dst = Path( output_dir, name )
+                if dst.exists() and not overwrite:
+                    print( 'File {} exists, not extracted.'.format( dst ) )
+                    continue
+
+                dst.parent.mkdir( parents = True, exist_ok = True )
+                with tar.extractfile( f['name'] ) as src, open( dst, 'wb' ) as out:
+                    copyfileobj( src, out )
+
+                extracted.append( dst )
+
+        return extracted
+
+
+    def archived_runs( self ):
+        '''
+        Retrieve the run IDs of all archived runs (from the archive indexes).
+
+        :return: dict with run IDs as keys and archives as values
+        '''
+        runs = {}
+
+        if not self.archive_dir.is_dir():
+            return runs
+
+        for index in sorted( self.archive_dir.rglob( '*.index.json' ) ):
+            archive = index.with_name( index.name[:-len( '.index.json' )] + '.tar.gz' )
+            for run_id in self.__read_index( index ):
+                runs[run_id] = archive
+
+        return runs
+
+
+    def archive_files( self, partition ):
+        '''
+        Retrieve the archive and index of a partition (e.g., "archive/2021/03/01.tar.gz" and
+        "archive/2021/03/01.index.json" for partition "2021/03/01").
+
+        :return: tuple with paths of archive and index
+        '''
+        base = Path( self.archive_dir, partition )
+        return base.with_name( base.name + '.tar.gz' ), base.with_name( base.name + '.index.json' )
+
+
+    def __archive( self, partition, runs ):
+        '''
+        Add the files of runs to the archive of a partition. The archive is rewritten (compressed archives
+        cannot be appended to), files of these runs that are already contained in the archive are replaced.
+        '''
+        import tarfile
+
+        archive, index = self.archive_files( partition )
+        archive.parent.mkdir( parents = True, exist_ok = True )
+
+        index_runs = self.__read_index( index )
+        names = { self.__archive_name( f ) for files in runs.values() for f in files }
+
+        # Write archive and index to temporary files first, such that only complete files become visible.
+        # The archive is replaced first: if the index is not updated, the files are archived again next time.
+        tmp_archive = archive.with_name( '{}.tmp-{}'.format( archive.name, getpid() ) )
+        tmp_index = index.with_name( '{}.tmp-{}'.format( index.name, getpid() ) )
+
+        try:
+            with tarfile.open( tmp_archive, 'w:gz' ) as tar:
+                if archive.is_file():
+                    with tarfile.open( archive, 'r:gz' ) as old:
+                        for member in old:
+                            if member.isfile() and member.name not in names:
+                                tar.addfile( member, old.extractfile( member ) )
+
+                for run_id, files in sorted( runs.items() ):
+                    # Files of a run may have been extracted before, keep the entries of the other archived files.
+                    index_runs[run_id] = [ e for e in index_runs.get( run_id, [] ) if e['name'] not in names ]
+                    for f in sorted( files ):
+                        tar.add( f, arcname = self.__archive_name( f ), recursive = False )
+                        index_runs[run_id].append( {
+                            'name': self.__archive_name( f ),
+                            'size': f.stat().st_size,
+                            'sha256': file_digest( f )
+                        } )
+
+            with open( tmp_index, 'w' ) as f:
+                json_dump( { 'version': self.index_version, 'partition': partition, 'runs': index_runs }, f, indent = 1 )
+
+            replace( tmp_archive, archive )
+            replace( tmp_index, index )
+
+        finally:
+            for tmp in [ tmp_archive, tmp_index ]:
+                if tmp.exists():
+                    tmp.unlink()
+
+
+    def __purge( self, dryrun, verbose ):
+        '''
+        Delete archives whose runs are all older than the maximum archive age.
+        '''
+        if self.max_archive_age is None or not self.archive_dir.is_dir():
+            return
+
+        now = datetime.now()
+        for index in sorted( self.archive_dir.rglob( '*.index.json' ) ):
+            times = [ self.workflow_config.run_time( run_id ) for run_id in self.__read_index( index ) ]
+            if times and now - max( times ) <= self.max_archive_age:
+                continue
+
+            archive = index.with_name( index.name[:-len( '.index.json' )] + '.tar.gz' )
+            if verbose or dryrun:
+                print( '{} {}.'.format( 'Would delete' if dryrun else 'Deleting', archive.relative_to( self.root_dir ) ) )
+
+            if not dryrun:
+                if archive.exists():
+                    archive.unlink()
+                index.unlink()
+                _remove_empty_dirs( index.parent, self.archive_dir )
+
+
+    def __remove( self, files ):
+        '''
+        Remove archived files, their (now empty) partition folders and their Snakemake metadata.
+        '''
+        for f in files:
+            f.unlink()
+
+            record = _metadata_record( self.root_dir, f.relative_to( self.root_dir ) )
+            if record.is_file():
+                record.unlink()
+
+            _remove_empty_dirs( f.parent, self.data_dir )
+
+
+    def __locked_files( self ):
+        '''
+        Retrieve the files locked by running Snakemake executions (see class Persistence of Snakemake).
+        '''
+        locked = set()
+        lock_dir = Path( self.root_dir, '.snakemake', 'locks' )
+
+        if lock_dir.is_dir():
+            for lock_file in lock_dir.glob( '*.lock' ):
+                try:
+                    with open( lock_file ) as f:
+                        locked.update( Path( self.root_dir, l.strip() ).resolve() for l in f if l.strip() )
+                except OSError:
+                    # Lock has been removed meanwhile.
+                    pass
+
+        return locked
+
+
+    def __archive_name( self, file_name ):
+        # Files are archived with their path relative to the workflow root directory (e.g., "data/step1/...").
+        return Path( file_name ).relative_to( self.root_dir ).as_posix()
+
+
+    def __read_index( self, index ):
+        if not index.is_file():
+            return {}
+
+        with open( index ) as f:
+            return json_load( f ).get( 'runs', {} )
+
+
+def _days( value ):
+    # Convert a number of days to a time delta (None for no limit).
+    return timedelta( days = value ) if value is not None else None
+
+
+def _remove_empty_dirs( dir, stop_dir ):
+    # Remove a folder and its parent folders as long as they are empty (up to, but excluding, the stop folder).
+    dir = Path( dir )
+    while not dir == stop_dir and stop_dir in dir.parents:
+        try:
+            dir.rmdir()
+        except OSError:
+            return
+        dir = dir.parent
+
+
+def _metadata_record( root_dir, file_name ):
+    # Snakemake stores metadata for every output file in ".snakemake/metadata", named after the URL-safe
+    # Base64 encoding of the file name, which is split into folders if it is too long (see class Persistence).
+    metadata_dir = Path( root_dir, '.snakemake', 'metadata' )
+    try:
+        from os import pathconf
+        max_len = pathconf( str( metadata_dir ), 'PC_NAME_MAX' ) or 255
+    except ( ImportError, OSError ):
+        # Not available on Windows (maximum length of NTFS and FAT32 file names).
+        max_len = 255
+
+    b64id = urlsafe_b64encode( str( file_name ).encode() ).decode()
+    chunks = [ b64id[i:i + max_len - 1] for i in range( 0, len( b64id ), max_len - 1 ) ]
+
+    return Path( metadata_dir, *[ '@' + c for c in chunks[:-1] ], chunks[-1] )
@@ -0,0 +1,115 @@
+import concurrent.futures
+from functools import partial
+from hashlib import new as hashlib_new
+from mmap import mmap, ACCESS_READ
+from os import cpu_count, fstat
+
+
+# Supported digest algorithms.
+DIGEST_ALGORITHMS = [ 'sha256', 'blake2b', 'blake2s', 'sha512', 'sha3_256' ]
+
+# Default digest algorithm.
+DEFAULT_DIGEST_ALGORITHM = 'sha256'
+
+# Files larger than this threshold (in bytes) are hashed via mmap.
+DEFAULT_MMAP_THRESHOLD = 16*1024*1024
+
+
+def file_digest( file_name, algorithm = DEFAULT_DIGEST_ALGORITHM, mmap_threshold = DEFAULT_MMAP_THRESHOLD ):
+    '''
+    Compute the digest of a file.
+
+    Large files are hashed via mmap (no copy into a user-space buffer), all other files are read
+    into a fixed buffer. Defined at module level, such that it can be dispatched to worker processes.
+
+    :return: hex digest as string
+    '''
+    h = hashlib_new( algorithm )
+    with open( file_name, 'rb', buffering = 0 ) as f:
+        if mmap_threshold is not None and fstat( f.fileno() ).st_size > mmap_threshold:
+            with mmap( f.fileno(), 0, access = ACCESS_READ ) as m:
+                h.update( m )
+        else:
+            b  = bytearray( 128*1024 ) # 128kb buffer size for file hashing
+            mv = memoryview( b )
+            for n in iter( lambda : f.readinto( mv ), 0 ):
+                h.update( mv[:n] )
+    return h.hexdigest()
+
+
+class FileHasher:
+    '''
+    Helper class for computing file digests concurrently.
+
+    By default, a thread pool is used (hashlib releases the GIL while hashing large buffers).
+    Alternatively, a process pool can be used. The digests are always returned in the order
+    of the input files, hence the result is identical to hashing the files sequentially.
+    '''
+
+    # Available executor types (classes of module concurrent.futures, only loaded when they are used).
+    executors = {
+        'thread' : 'ThreadPoolExecutor',
+        'process' : 'ProcessPoolExecutor',
+    }
+
+
+    def __init__(
+        self,
+        num_workers = None,
+        executor = 'thread',
+        algorithm = DEFAULT_DIGEST_ALGORITHM,
+        mmap_threshold = DEFAULT_MMAP_THRESHOLD
+    ):
+
+        if num_workers is None:
+            num_workers = cpu_count() or 1
+
+        if not isinstance( num_workers, int ) or num_workers < 1:
+            raise TypeError( 'Input parameter "num_workers" has to be a positive "int"' )
+
+        if executor not in self.executors:
+            raise ValueError( 'Input parameter "executor" has to be one of: {}'.format( ', '.join( self.executors ) ) )
+
+        if algorithm not in DIGEST_ALGORITHMS:
+            raise ValueError( 'Input parameter "algorithm" has to be one of: {}'.format( ', '.join( DIGEST_ALGORITHMS ) ) )
+
+        # Number of concurrent workers.
+        self.num_workers = num_workers
+
+        # Executor type.
+        self.executor = executor
+
+        # Default digest algorithm.
+        self.algorithm = algorithm
+
+        # Files larger than this threshold (in bytes) are hashed via mmap (None: never use mmap).
+        self.mmap_threshold = mmap_threshold
+
+
+    def digests( self, file_names, algorithm = None ):
+        '''
+        Compute the digests for a list of files, optionally with another than the default algorithm.
+
+        :return: list of digests, in the same order as the input files
+        '''
+        if algorithm is None:
+            algorithm = self.algorithm
+        elif algorithm not in DIGEST_ALGORITHMS:
+            raise ValueError( 'Unsupported digest algorithm: {}'.format( algorithm ) )
+
+        digest = partial( file_digest, algorithm = algorithm, mmap_threshold = self.mmap_threshold )
+
+        file_names = list( file_names )
+
+        # Avoid the overhead of a worker pool where it does not pay off.
+        if self.num_workers == 1 or len( file_names ) < 2:
+            return [ digest( f ) for f in file_names ]
+
+        num_workers = min( self.num_workers, len( file_names ) )
+
+        # Submit files in chunks to worker processes, to reduce the IPC overhead.
+        chunksize = 1 if self.executor == 'thread' else max( 1, len( file_names ) // ( 4 * num_workers ) )
+
+        executor = getattr( concurrent.futures, self.executors[self.executor] )
+        with executor( max_workers = num_workers ) as pool:
+            return list( pool.map( digest, file_names, chunksize = chunksize ) )
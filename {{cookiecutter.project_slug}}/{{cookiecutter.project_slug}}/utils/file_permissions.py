@@ -1,5 +1,6 @@
+from os import name as os_name
 from pathlib import Path
-from stat import S_IREAD, S_IWRITE
+from stat import S_IREAD, S_IWRITE, S_IRWXG, S_IRWXO
 
 
 class FilePermissions:
@@ -23,3 +24,22 @@ class FilePermissions:
 
         # Set file permissions
         file.chmod( S_IREAD | S_IWRITE )
+
+
+    def check_access( self, file ):
+        '''
+        Check that a file is accessible for the current user only (raises an exception otherwise).
+        On Windows, the permissions are not checked (the user is responsible for setting them).
+        '''
+        if not isinstance( file, Path ):
+            raise TypeError( 'Input parameter "file" has to be of type "pathlib.Path"' )
+
+        if not file.is_file():
+            raise RuntimeError( 'Not a file:', file )
+
+        if os_name == 'nt':
+            return
+
+        # Check file permissions.
+        if file.stat().st_mode & ( S_IRWXG | S_IRWXO ):
+            raise RuntimeError( 'File "{}" must be accessible for the current user only'.format( file ) )
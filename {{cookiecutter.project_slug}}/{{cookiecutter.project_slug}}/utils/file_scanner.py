@@ -0,0 +1,190 @@
+from fnmatch import translate
+from os import name as os_name, scandir
+from os.path import join, splitext
+from pathlib import PurePosixPath
+from re import compile as re_compile, IGNORECASE
+
+
+class GlobPattern:
+    '''
+    Glob pattern (relative to a root directory), matched segment by segment.
+
+    Supports the same syntax as pathlib (i.e., "*", "?", "[...]" within a path segment and
+    "**" for this directory and all subdirectories, recursively).
+    '''
+
+    def __init__( self, pattern ):
+
+        # Path matching is case-insensitive on Windows (like pathlib).
+        flags = IGNORECASE if os_name == 'nt' else 0
+
+        self.pattern = pattern
+        self.__segments = tuple(
+            s if s == '**' or not any( c in s for c in '*?[' ) else re_compile( translate( s ), flags )
+            for s in PurePosixPath( pattern ).parts
+        )
+        self.__case_insensitive = bool( flags )
+
+
+    def match( self, parts ):
+        '''
+        Check if the pattern matches a path (given as tuple of path segments).
+        '''
+        return self.__match( 0, parts, 0, False )
+
+
+    def may_contain_matches( self, parts ):
+        '''
+        Check if the pattern may match any path below a directory (given as tuple of path segments).
+        '''
+        return self.__match( 0, parts, 0, True )
+
+
+    def __match( self, i_seg, parts, i_part, prefix ):
+        segments = self.__segments
+
+        while i_part < len( parts ):
+
+            if i_seg == len( segments ):
+                return False
+
+            seg = segments[i_seg]
+
+            if seg == '**':
+                # Match zero or more path segments.
+                return any(
+                    self.__match( i_seg + 1, parts, i, prefix )
+                    for i in range( i_part, len( parts ) + 1 )
+                )
+
+            if not self.__match_segment( seg, parts[i_part] ):
+                return False
+
+            i_seg += 1
+            i_part += 1
+
+        if prefix:
+            # All path segments have been consumed, the directory may contain matches
+            # if there are pattern segments left.
+            return i_seg < len( segments )
+
+        # Trailing "**" segments match the empty remainder.
+        return all( s == '**' for s in segments[i_seg:] )
+
+
+    def __match_segment( self, seg, part ):
+        if isinstance( seg, str ):
+            return seg == part or ( self.__case_insensitive and seg.lower() == part.lower() )
+        return seg.match( part ) is not None
+
+
+class FileScanner:
+    '''
+    Enumerate all files below a root directory that match any of a list of glob patterns.
+
+    The directory tree is walked only once (via os.scandir), descending only into directories
+    that may contain matches. Every file is visited at most once, hence files matching more
+    than one pattern are reported only once.
+
+    Complexity: O(n * p) for n visited directory entries and p patterns of bounded depth (plus
+    sorting the entry names within each directory, to make the enumeration order deterministic).
+    '''
+
+    def __init__( self, root_dir, glob_patterns, exclude_ext = (), exclude_dirs = () ):
+
+        # Root directory (as string, to avoid the overhead of pathlib objects).
+        self.root_dir = str( root_dir )
+
+        # Glob patterns (relative to root directory).
+        self.patterns = [ GlobPattern( p ) for p in glob_patterns ]
+
+        # File extensions to be excluded.
+        self.exclude_ext = set( exclude_ext )
+
+        # Names of directories to be excluded (including all files below them).
+        self.exclude_dirs = set( exclude_dirs )
+
+
+    def files( self, sub_dir = None ):
+        '''
+        Enumerate all matching files, optionally only below a subdirectory of the root directory.
+
+        :return: generator of file paths (as strings)
+        '''
+        return ( path for path, is_dir in self.walk( sub_dir ) if not is_dir )
+
+
+    def directories( self, sub_dir = None ):
+        '''
+        Enumerate all directories that may contain matching files, optionally only below a
+        subdirectory of the root directory.
+
+        :return: generator of directory paths (as strings)
+        '''
+        return ( path for path, is_dir in self.walk( sub_dir ) if is_dir )
+
+
+    def match_file( self, parts ):
+        '''
+        Check if a file (given as tuple of path segments relative to root directory) matches.
+        '''
+        return (
+            splitext( parts[-1] )[1] not in self.exclude_ext and
+            self.exclude_dirs.isdisjoint( parts[:-1] ) and
+            any( p.match( parts ) for p in self.patterns )
+        )
+
+
+    def match_dir( self, parts ):
+        '''
+        Check if a directory (given as tuple of path segments relative to root directory) may contain matching files.
+        '''
+        return (
+            self.exclude_dirs.isdisjoint( parts ) and
+            any( p.may_contain_matches( parts ) for p in self.patterns )
+        )
+
+
+    def walk( self, sub_dir = None ):
+        '''
+        Walk the directory tree, optionally only below a subdirectory of the root directory.
+
+        :return: generator of tuples with path (as string) and flag indicating a directory
+        '''
+        # Keep track of visited directories (avoid infinite loops due to symbolic links).
+        visited = set()
+
+        # Path segments of the start directory, relative to root directory.
+        start_parts = PurePosixPath( sub_dir ).parts if sub_dir else ()
+
+        # Directories still to be scanned (path and tuple of path segments relative to root directory).
+        stack = [ ( join( self.root_dir, *start_parts ), start_parts ) ]
+
+        while stack:
+            dir_path, dir_parts = stack.pop()
+
+            try:
+                with scandir( dir_path ) as it:
+                    entries = sorted( it, key = lambda e : e.name )
+            except ( FileNotFoundError, NotADirectoryError, PermissionError ):
+                continue
+
+            yield ( dir_path, True )
+
+            sub_dirs = []
+
+            for entry in entries:
+                parts = dir_parts + ( entry.name, )
+
+                if entry.is_dir():
+                    if self.match_dir( parts ):
+                        st = entry.stat()
+                        if ( st.st_dev, st.st_ino ) not in visited:
+                            visited.add( ( st.st_dev, st.st_ino ) )
+                            sub_dirs.append( ( join( dir_path, entry.name ), parts ) )
+
+                elif entry.is_file() and self.match_file( parts ):
+                    yield ( join( dir_path, entry.name ), False )
+
+            # Scan subdirectories in alphabetical order.
+            stack.extend( reversed( sub_dirs ) )
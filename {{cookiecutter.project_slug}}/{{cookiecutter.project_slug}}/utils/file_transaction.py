@@ -0,0 +1,57 @@
+from os import replace
+
+
+class FileTransaction:
+    '''
+    Replace several files together. The new content of all files is written to temporary files
+    first, the original files are only replaced once all of them have been written successfully
+    (each file is replaced atomically). If writing any of the files fails, no file is replaced.
+
+    Use as context manager: the transaction is committed when leaving the context, or aborted
+    (i.e., all temporary files are removed) if an exception is raised.
+    '''
+
+    def __init__( self ):
+
+        # Files to be replaced (list of tuples with temporary file name and file name).
+        self.__files = []
+
+
+    def tmp_file_name( self, file_name ):
+        '''
+        Register a file to be replaced by the transaction.
+
+        :return: name of the temporary file for the new content of the file
+        '''
+        tmp_file_name = file_name.with_name( file_name.name + '.tmp' )
+        self.__files.append( ( tmp_file_name, file_name ) )
+        return tmp_file_name
+
+
+    def commit( self ):
+        '''
+        Replace all registered files with their temporary files.
+        '''
+        for tmp_file_name, file_name in self.__files:
+            replace( tmp_file_name, file_name )
+        self.__files = []
+
+
+    def abort( self ):
+        '''
+        Remove all temporary files, the registered files are not modified.
+        '''
+        for tmp_file_name, _ in self.__files:
+            tmp_file_name.unlink( missing_ok = True )
+        self.__files = []
+
+
+    def __enter__( self ):
+        return self
+
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
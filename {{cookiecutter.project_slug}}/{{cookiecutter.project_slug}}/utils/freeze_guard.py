@@ -0,0 +1,341 @@
+from abc import ABC, abstractmethod
+from ctypes import CDLL, c_char_p, c_int, c_uint32, get_errno
+from ctypes.util import find_library
+from os import close, fsdecode, fsencode, read, stat, strerror
+from os.path import join
+from select import select
+from struct import calcsize, unpack_from
+from sys import platform
+from threading import Event, Lock, Thread
+
+from .file_scanner import FileScanner
+
+
+class FreezeGuard:
+    '''
+    Watch all files relevant for the workflow in the background and mark the workflow as dirty
+    as soon as any of these files is modified, added or deleted.
+
+    There are 2 backends available:
+      1. 'inotify': use the inotify API of the Linux kernel (no additional overhead while nothing happens).
+      2. 'poll': periodically compare the file status (size, modification time, inode, change time).
+    By default ('auto'), inotify is used if available, polling otherwise.
+
+    Returns an instance of the guard implementation for the selected backend.
+    '''
+
+    # Available backends.
+    backends = [ 'auto', 'inotify', 'poll' ]
+
+    def __new__(
+        cls,
+        root_dir,
+        glob_patterns,
+        exclude_ext = (),
+        exclude_dirs = (),
+        backend = 'auto',
+        poll_interval = 5.,
+        on_change = None
+    ):
+        if backend not in cls.backends:
+            raise ValueError( 'Input parameter "backend" has to be one of: {}'.format( ', '.join( cls.backends ) ) )
+
+        scanner = FileScanner(
+            root_dir = root_dir,
+            glob_patterns = glob_patterns,
+            exclude_ext = exclude_ext,
+            exclude_dirs = exclude_dirs
+        )
+
+        if backend in [ 'auto', 'inotify' ]:
+            try:
+                return InotifyFreezeGuardImpl( scanner, on_change )
+            except OSError as err:
+                if backend == 'inotify':
+                    raise RuntimeError( 'Backend "inotify" not available: {}'.format( err ) )
+
+        return PollingFreezeGuardImpl( scanner, on_change, poll_interval )
+
+
+class FreezeGuardImpl( ABC ):
+    '''
+    Common implementation of the freeze guard backends (state handling and background thread).
+    '''
+
+    def __init__( self, scanner, on_change ):
+
+        # Helper class for enumerating the watched files and directories.
+        self._scanner = scanner
+
+        # Callback, called with the path of the changed file when the guard becomes dirty.
+        self._on_change = on_change
+
+        # Changed files since the guard has been cleared the last time.
+        self._changes = set()
+        self._lock = Lock()
+
+        # Flags for dirty state and for stopping the background thread.
+        self._dirty = Event()
+        self._stop = Event()
+
+        # The guard is dirty until it is cleared for the first time (i.e., the first check is never skipped).
+        self._dirty.set()
+
+        self._thread = None
+
+
+    def start( self ):
+        '''
+        Start watching the files in a background thread.
+        '''
+        self._stop.clear()
+        self._thread = Thread( target = self._run, daemon = True )
+        self._thread.start()
+
+
+    def stop( self ):
+        '''
+        Stop watching the files.
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+    def is_dirty( self ):
+        '''
+        Check if any file has changed since the guard has been cleared the last time.
+        '''
+        return self._dirty.is_set()
+
+
+    def clear( self ):
+        '''
+        Clear the dirty state.
+
+        :return: set of changed files since the guard has been cleared the last time
+        '''
+        with self._lock:
+            changes = self._changes
+            self._changes = set()
+            self._dirty.clear()
+        return changes
+
+
+    def invalidate( self ):
+        '''
+        Mark the guard as dirty (without calling the callback).
+        '''
+        self._dirty.set()
+
+
+    def _mark_dirty( self, path ):
+        with self._lock:
+            self._changes.add( path )
+            notify = not self._dirty.is_set()
+            self._dirty.set()
+
+        if notify and self._on_change is not None:
+            self._on_change( path )
+
+
+    def _relative_parts( self, path ):
+        return tuple( path[len( self._scanner.root_dir ):].replace( '\\', '/' ).strip( '/' ).split( '/' ) )
+
+
+    @abstractmethod
+    def _run( self ):
+        '''
+        Watch the files (executed by the background thread until the guard is stopped).
+        '''
+
+
+# Constants of the inotify API (see inotify(7)).
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+IN_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+# Header of struct inotify_event (wd, mask, cookie, len), followed by the name.
+IN_EVENT_HEADER = 'iIII'
+
+
+class InotifyFreezeGuardImpl( FreezeGuardImpl ):
+    '''
+    Freeze guard implementation using the inotify API of the Linux kernel.
+
+    All directories that may contain relevant files are watched (including directories created later on).
+    '''
+
+    def __init__( self, scanner, on_change ):
+
+        if not platform.startswith( 'linux' ):
+            raise OSError( 'inotify is only available on Linux' )
+
+        super().__init__( scanner, on_change )
+
+        # Load inotify API from the C library.
+        libc = CDLL( find_library( 'c' ), use_errno = True )
+        self.__inotify_add_watch = libc.inotify_add_watch
+        self.__inotify_add_watch.argtypes = [ c_int, c_char_p, c_uint32 ]
+        self.__inotify_add_watch.restype = c_int
+
+        self.__fd = libc.inotify_init1( IN_CLOEXEC )
+        if self.__fd < 0:
+            raise OSError( get_errno(), strerror( get_errno() ) )
+
+        # Map watch descriptors to directory paths.
+        self.__watches = {}
+
+        try:
+            for dir_path in scanner.directories():
+                self.__add_watch( dir_path )
+        except OSError:
+            close( self.__fd )
+            raise
+
+
+    def stop( self ):
+        super().stop()
+        if self.__fd >= 0:
+            close( self.__fd )
+            self.__fd = -1
+
+
+    def _run( self ):
+        header_size = calcsize( IN_EVENT_HEADER )
+
+        while not self._stop.is_set():
+
+            # Wait for events (with timeout, to be able to stop the thread).
+            ready, _, _ = select( [ self.__fd ], [], [], 0.5 )
+            if not ready:
+                continue
+
+            buffer = read( self.__fd, 64 * 1024 )
+            offset = 0
+
+            while offset < len( buffer ):
+                wd, mask, _, length = unpack_from( IN_EVENT_HEADER, buffer, offset )
+                name = fsdecode( buffer[offset + header_size:offset + header_size + length].rstrip( b'\0' ) )
+                offset += header_size + length
+
+                self.__handle_event( wd, mask, name )
+
+
+    def __handle_event( self, wd, mask, name ):
+
+        if mask & IN_Q_OVERFLOW:
+            # Events have been lost, the state of the files is unknown.
+            self._mark_dirty( self._scanner.root_dir )
+            return
+
+        if mask & IN_IGNORED:
+            # Watch has been removed (e.g., the directory has been deleted).
+            self.__watches.pop( wd, None )
+            return
+
+        dir_path = self.__watches.get( wd )
+        if dir_path is None:
+            return
+
+        if mask & ( IN_DELETE_SELF | IN_MOVE_SELF ):
+            # Watched directory itself has been deleted or moved.
+            self._mark_dirty( dir_path )
+            return
+
+        path = join( dir_path, name )
+        parts = self._relative_parts( path )
+
+        if mask & IN_ISDIR:
+            if not self._scanner.match_dir( parts ):
+                return
+
+            if mask & ( IN_CREATE | IN_MOVED_TO ):
+                # Watch new directory and check for relevant files that might have been moved along.
+                sub_dir = '/'.join( parts )
+                for dir_path in self._scanner.directories( sub_dir ):
+                    self.__add_watch( dir_path )
+                for file_path in self._scanner.files( sub_dir ):
+                    self._mark_dirty( file_path )
+
+            elif mask & IN_MOVED_FROM:
+                # Relevant files might have been moved away along with the directory.
+                self._mark_dirty( path )
+
+        elif self._scanner.match_file( parts ):
+            self._mark_dirty( path )
+
+
+    def __add_watch( self, dir_path ):
+        wd = self.__inotify_add_watch( self.__fd, fsencode( dir_path ), IN_WATCH_MASK )
+        if wd < 0:
+            raise OSError( get_errno(), 'Cannot watch "{}": {}'.format( dir_path, strerror( get_errno() ) ) )
+        self.__watches[wd] = dir_path
+
+
+class PollingFreezeGuardImpl( FreezeGuardImpl ):
+    '''
+    Freeze guard implementation that periodically compares the status of all relevant files.
+    '''
+
+    def __init__( self, scanner, on_change, poll_interval ):
+
+        if not poll_interval > 0:
+            raise ValueError( 'Input parameter "poll_interval" has to be positive' )
+
+        super().__init__( scanner, on_change )
+
+        # Polling interval in seconds.
+        self.__poll_interval = poll_interval
+
+        # File status at the last poll.
+        self.__status = None
+
+
+    def start( self ):
+        # Take the initial snapshot synchronously, to catch all changes after starting the guard.
+        self.__status = self.__snapshot()
+        super().start()
+
+
+    def _run( self ):
+        while not self._stop.wait( self.__poll_interval ):
+            status = self.__snapshot()
+
+            for path in status.keys() ^ self.__status.keys():
+                # File has been added or deleted.
+                self._mark_dirty( path )
+
+            for path in status.keys() & self.__status.keys():
+                if not status[path] == self.__status[path]:
+                    # File has been modified.
+                    self._mark_dirty( path )
+
+            self.__status = status
+
+
+    def __snapshot( self ):
+        status = {}
+        for path in self._scanner.files():
+            try:
+                st = stat( path )
+                status[path] = ( st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns )
+            except FileNotFoundError:
+                pass
+        return status
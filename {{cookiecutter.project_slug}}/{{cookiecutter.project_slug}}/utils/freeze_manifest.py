@@ -0,0 +1,199 @@
+from hashlib import new as hashlib_new
+from pathlib import PurePosixPath
+
+from .file_hasher import DIGEST_ALGORITHMS
+
+
+class MerkleManifest:
+    '''
+    Merkle tree of file digests, mirroring the directory structure below the workflow root directory.
+
+    Every directory node stores the digests of its files, the nodes of its subdirectories and a hash
+    computed from both. The hash of the root node hence depends on all files. The hashes along the
+    path from the root node to any directory node allow to verify this subtree in O(depth).
+
+    Paths are relative to the workflow root directory, using "/" as separator.
+
+    The manifest records the digest algorithm used for the files, which is also used for the node hashes.
+    '''
+
+    # Identifier for the manifest format (stored in the serialized manifest).
+    format_name = 'merkle'
+
+    # Version of the manifest format.
+    format_version = 1
+
+    # Digest algorithm of manifests that do not specify one.
+    default_algorithm = 'sha256'
+
+
+    def __init__( self, tree, algorithm = default_algorithm ):
+
+        if algorithm not in DIGEST_ALGORITHMS:
+            raise RuntimeError( 'Unsupported digest algorithm: {}'.format( algorithm ) )
+
+        # Root node of the tree.
+        self.tree = tree
+
+        # Digest algorithm (for files and nodes).
+        self.algorithm = algorithm
+
+
+    @classmethod
+    def from_digests( cls, files_digest, algorithm = default_algorithm ):
+        '''
+        Create a manifest from a flat dict of file digests (computed with the given algorithm).
+
+        :return: new manifest
+        '''
+        merkle = cls( cls.__new_node(), algorithm )
+        root = merkle.tree
+
+        for file_name, digest in files_digest.items():
+            parts = PurePosixPath( file_name ).parts
+            node = root
+            for p in parts[:-1]:
+                node = node['dirs'].setdefault( p, cls.__new_node() )
+            node['files'][parts[-1]] = digest
+
+        merkle.__update_hashes( root )
+
+        return merkle
+
+
+    @classmethod
+    def from_json( cls, manifest ):
+        '''
+        Create a manifest from its (de-serialized) JSON representation.
+
+        :return: new manifest
+        '''
+        if not manifest.get( 'format' ) == cls.format_name:
+            raise RuntimeError( 'Not a Merkle tree manifest' )
+
+        if manifest.get( 'version' ) != cls.format_version:
+            raise RuntimeError( 'Unsupported manifest version: {}'.format( manifest.get( 'version' ) ) )
+
+        merkle = cls( manifest['tree'], manifest.get( 'algorithm', cls.default_algorithm ) )
+
+        if not merkle.root_hash() == manifest['root']:
+            raise RuntimeError( 'Root hash of manifest does not match' )
+
+        return merkle
+
+
+    @classmethod
+    def is_merkle( cls, manifest ):
+        '''
+        Check if a (de-serialized) manifest is a Merkle tree manifest (or a flat dict of file digests).
+        '''
+        return manifest.get( 'format' ) == cls.format_name
+
+
+    def to_json( self ):
+        '''
+        Retrieve JSON representation of the manifest (for serialization).
+        '''
+        return {
+            'format' : self.format_name,
+            'version' : self.format_version,
+            'algorithm' : self.algorithm,
+            'root' : self.root_hash(),
+            'tree' : self.tree
+        }
+
+
+    def root_hash( self ):
+        '''
+        Retrieve the hash of the root node.
+        '''
+        return self.tree['hash']
+
+
+    def digests( self, sub_dir = None ):
+        '''
+        Retrieve the digests of all files, optionally only for the files in a subtree.
+        The node hashes are verified before retrieving the digests.
+
+        :return: dict with relative paths as keys and digests as values
+        '''
+        if sub_dir is None:
+            if not self.verify():
+                raise RuntimeError( 'Manifest is inconsistent' )
+            return self.__digests( self.tree, '' )
+
+        parts = PurePosixPath( sub_dir ).parts
+        node = self.verify_path( sub_dir )
+
+        return self.__digests( node, '/'.join( parts ) + '/' ) if node is not None else {}
+
+
+    def verify( self ):
+        '''
+        Verify the consistency of all node hashes of the tree.
+        '''
+        return self.__verify( self.tree )
+
+
+    def verify_path( self, sub_dir ):
+        '''
+        Verify the consistency of the subtree of a directory. Only the nodes along the path from
+        the root node to the subtree are verified in addition, i.e., O(depth) on top of the size
+        of the subtree (instead of the size of the whole tree).
+
+        :return: node of the directory, None if the directory is not part of the manifest
+        '''
+        node = self.tree
+        path = [ node ]
+
+        for p in PurePosixPath( sub_dir ).parts:
+            node = node['dirs'].get( p )
+            if node is None:
+                break
+            path.append( node )
+
+        # Verify hashes along the path (the hashes of all other nodes are covered by their parents).
+        for n in path:
+            if not self.__node_hash( n ) == n['hash']:
+                raise RuntimeError( 'Manifest is inconsistent' )
+
+        # Verify the subtree itself.
+        if node is not None and not self.__verify( node ):
+            raise RuntimeError( 'Manifest is inconsistent' )
+
+        return node
+
+
+    @staticmethod
+    def __new_node():
+        return { 'hash' : None, 'files' : {}, 'dirs' : {} }
+
+
+    def __update_hashes( self, node ):
+        for child in node['dirs'].values():
+            self.__update_hashes( child )
+        node['hash'] = self.__node_hash( node )
+
+
+    def __verify( self, node ):
+        return (
+            all( self.__verify( child ) for child in node['dirs'].values() ) and
+            self.__node_hash( node ) == node['hash']
+        )
+
+
+    def __node_hash( self, node ):
+        h = hashlib_new( self.algorithm )
+        for name in sorted( node['files'] ):
+            h.update( 'f\0{}\0{}\n'.format( name, node['files'][name] ).encode() )
+        for name in sorted( node['dirs'] ):
+            h.update( 'd\0{}\0{}\n'.format( name, node['dirs'][name]['hash'] ).encode() )
+        return h.hexdigest()
+
+
+    @classmethod
+    def __digests( cls, node, prefix ):
+        files_digest = { prefix + name : digest for name, digest in node['files'].items() }
+        for name, child in node['dirs'].items():
+            files_digest.update( cls.__digests( child, prefix + name + '/' ) )
+        return files_digest
@@ -1,8 +1,18 @@
 from hashlib import sha256
-from json import loads as json_loads, dumps as json_dumps
+from json import JSONEncoder, loads as json_loads
+from os import replace, sep, stat
+from os.path import dirname, join, normpath, relpath
 from pathlib import Path
+from shutil import copymode
+from time import time_ns
 
 from .crypto import Crypto
+from .file_hasher import DEFAULT_DIGEST_ALGORITHM, DEFAULT_MMAP_THRESHOLD, DIGEST_ALGORITHMS, FileHasher
+from .file_permissions import FilePermissions
+from .file_scanner import FileScanner
+from .freeze_guard import FreezeGuard
+from .freeze_manifest import MerkleManifest
+from .workflow_config import WorkflowConfig
 from .._config import *
 
 
@@ -12,8 +22,35 @@ class FreezeWorkflow:
 
     Create a digest of all relevant files for the worklfow.
     This digest allows to check if any file has been modified, added or deleted.
+
+    Optionally, the check can be run in incremental mode. In this case, a sidecar index
+    stores the file status (size, modification time, inode, change time) of all files
+    that have been verified against the digest. Only files whose status has changed
+    since then are hashed again. A full verification of all files can be enforced
+    periodically (every n-th check) or on demand.
+
+    Files are hashed concurrently (see class FileHasher). By default, the number of workers
+    is taken from the "num_cores" attribute of the workflow configuration. The digest algorithm
+    is recorded in the manifest, the check always uses the same algorithm as the freeze.
+
+    By default, the digest is stored as Merkle tree manifest (see class MerkleManifest), which
+    allows to verify only a subtree of the workflow root directory, to stop the check at the
+    first mismatching directory (fail-fast mode) and to report changes per directory. Digests
+    stored in the flat format (dict of file digests, used by previous versions) can still be read.
+
+    For long-running processes, the files can be watched in the background (see class FreezeGuard).
+    While watching, a check is skipped as long as no file has been changed.
     '''
 
+    # Available formats for storing the digest.
+    manifest_formats = [
+        'merkle', # Merkle tree manifest
+        'flat',   # flat dict of file digests (previous versions)
+    ]
+
+    # Available digest algorithms.
+    digest_algorithms = DIGEST_ALGORITHMS
+
     # This glob pattern defines which files are relevant for the workflow.
     glob_patterns = [
         'environment.yml',   # main conda environment file
@@ -27,8 +64,24 @@ class FreezeWorkflow:
         '.pyc' # Python byte code files (from __pycache__ subdirectories)
     ]
 
+    # This pattern defines names of directories to be excluded from the glob pattern (including their contents).
+    exclude_dirs = [
+        '__pycache__' # Python byte code (including temporary files written while byte-compiling a module)
+    ]
+
 
-    def __init__( self, dir, verbose = False ):
+    def __init__(
+        self,
+        dir,
+        verbose = False,
+        incremental = False,
+        full_verify_interval = 0,
+        num_workers = None,
+        executor = 'thread',
+        manifest_format = 'merkle',
+        algorithm = DEFAULT_DIGEST_ALGORITHM,
+        mmap_threshold = DEFAULT_MMAP_THRESHOLD
+    ):
 
         if not isinstance( dir, str ):
             raise TypeError( 'Input parameter "dir" has to be of type "str"' )
@@ -36,126 +89,469 @@ class FreezeWorkflow:
         if not isinstance( verbose, bool ):
             raise TypeError( 'Input parameter "verbose" has to be of type "bool"' )
 
+        if not isinstance( incremental, bool ):
+            raise TypeError( 'Input parameter "incremental" has to be of type "bool"' )
+
+        if not isinstance( full_verify_interval, int ) or full_verify_interval < 0:
+            raise TypeError( 'Input parameter "full_verify_interval" has to be a non-negative "int"' )
+
+        if manifest_format not in self.manifest_formats:
+            raise ValueError( 'Input parameter "manifest_format" has to be one of: {}'.format( ', '.join( self.manifest_formats ) ) )
+
+        if manifest_format == 'flat' and not algorithm == 'sha256':
+            raise ValueError( 'The flat manifest format only supports digest algorithm "sha256"' )
+
         # Worflow root directory.
         self.root_dir = Path( dir ).resolve( strict = True )
 
         # File name for saving the file digest.
         self.freeze_file_name = Path( Path.cwd(), FREEZE_FILE_NAME ).resolve()
 
+        # File name for saving the file status index (incremental mode).
+        self.index_file_name = Path( Path.cwd(), FREEZE_INDEX_FILE_NAME ).resolve()
+
         # Verbosity flag.
         self.verbose = verbose
 
+        # Format for storing the digest.
+        self.manifest_format = manifest_format
+
+        # Incremental mode flag.
+        self.incremental = incremental
+
+        # Enforce a full verification every n-th check in incremental mode (0: never).
+        self.full_verify_interval = full_verify_interval
+
+        # Number of incremental checks since the last full verification.
+        self.__checks_since_full_verify = 0
+
         # Helper class for decrypting / encrypting the file digest.
         self.__crypto = Crypto()
 
+        # Helper class for computing the file digests.
+        self.__hasher = FileHasher(
+            num_workers = self.__default_num_workers() if num_workers is None else num_workers,
+            executor = executor,
+            algorithm = algorithm,
+            mmap_threshold = mmap_threshold
+        )
+
+        # Helper class for setting file permissions.
+        self.__file_permissions = FilePermissions()
+
+        # Helper class for watching the files (if enabled).
+        self.__guard = None
+
 
     def freeze( self ):
         '''
         Create new digest of all files relevant for the workflow.
         '''
-        files_digest = {}
+        files_status = {}
 
-        # Compute digest for each file.
-        for pattern in self.glob_patterns:
-            glob = self.root_dir.glob( pattern )
-            for g in glob:
-                if g.is_file() and g.suffix not in self.exclude_ext:
-                    files_digest[str( g )] = self.__sha256sum( g )
+        # Collect all files.
+        for g in self.__files():
+            # Retrieve the file status before hashing, a modification
+            # during hashing will then be detected by the next check.
+            files_status[self.__relative( g )] = self.__stat( g )
 
-                    if self.verbose: print( 'Added file: ', g )
+            if self.verbose: print( 'Added file: ', g )
 
-        # Serialize digest (convert to JSON).
-        files_digest_json = json_dumps( files_digest )
+        # Compute digest for each file.
+        files_digest = dict( zip(
+            files_status,
+            self.__hasher.digests( self.__absolute( f ) for f in files_status )
+        ) )
+
+        if self.manifest_format == 'merkle':
+            # Create Merkle tree manifest.
+            files_digest = MerkleManifest.from_digests( files_digest, self.__hasher.algorithm ).to_json()
+        else:
+            # Use absolute paths for flat digest.
+            files_digest = { self.__absolute( f ) : d for f, d in files_digest.items() }
 
-        # Encrypt serialized digest.
-        files_digest_encrypt = self.__crypto.encrypt( files_digest_json )
+        # Serialize digest (convert to JSON), encrypt it and write it to file.
+        files_digest_hash = self.__write_encrypted( self.freeze_file_name, files_digest )
 
-        # Write digest to file.
-        with open( self.freeze_file_name, 'wb' ) as f:
-            f.write( files_digest_encrypt )
+        # Write file status index, bound to the new digest.
+        self.__store_index( files_digest_hash, files_status )
 
 
-    def check( self ):
+    def check( self, full_verify = False, fail_fast = False, subtree = None ):
         '''
         Check existing digest if files relevant for the workflow have been modified, added or deleted.
+
+        In incremental mode, only files whose status differs from the sidecar index are hashed.
+        Set "full_verify" to hash all files regardless of the index (and rebuild the index).
+
+        In fail-fast mode, the check stops at the first directory that contains a modified file
+        (added or deleted files are detected before hashing any file). Set "subtree" to a path
+        relative to the workflow root directory to check only the files in this directory.
+
+        While watching the files, the check returns immediately if no file has changed (unless
+        a full verification is requested).
+
+        :return: True if the workflow is unchanged, False otherwise
         '''
-        # Open file digest.
-        with open( self.freeze_file_name, 'rb' ) as f:
-            files_digest_encrypt = f.read()
+        # Decide whether the file status index may be used for this check.
+        if self.incremental and not full_verify:
+            self.__checks_since_full_verify += 1
+            if 0 < self.full_verify_interval <= self.__checks_since_full_verify:
+                full_verify = True
+
+        if self.__guard is not None and subtree is None:
+            # Nothing has happened since the last check.
+            if not full_verify and not self.__guard.is_dirty():
+                if self.verbose: print( 'No file changed since last check.' )
+                return True
+
+            # Changes from now on will be checked by the next check.
+            self.__guard.clear()
 
-        # Decrypt file digest.
         try:
-            files_digest_json = self.__crypto.decrypt( files_digest_encrypt )
+            check = self.__check( full_verify, fail_fast, subtree )
+        except BaseException:
+            check = False
+            raise
+        finally:
+            # Never skip the next check if this one has not been successful.
+            if self.__guard is not None and not check:
+                self.__guard.invalidate()
+
+        return check
+
+
+    def __check( self, full_verify, fail_fast, subtree ):
+        # Open and decrypt file digest.
+        try:
+            files_digest_json = self.__read_encrypted( self.freeze_file_name )
         except RuntimeError as err:
             raise RuntimeError( 'Error opening freeze digest: {}'.format( err ) )
 
+        files_digest_hash = sha256( files_digest_json ).hexdigest()
+
         # De-serialize the decrypted file digest (convert from JSON to Python object).
-        files_digest_freeze = json_loads( files_digest_json )
+        manifest = self.__load_manifest( json_loads( files_digest_json ) )
+
+        # Retrieve stored digests (optionally only for a subtree).
+        sub_dir = self.__sub_dir( subtree )
+        files_digest_freeze = manifest.digests( sub_dir )
+
+        index = None if ( full_verify or not self.incremental ) else self.__load_index( files_digest_hash )
 
-        known_files = list( files_digest_freeze.keys() )
+        if index is None:
+            # No usable index, fall back to a full verification.
+            index_timestamp = 0
+            index_status = {}
+            self.__checks_since_full_verify = 0
+        else:
+            index_timestamp, index_status = index
+
+        files_status = {}
+        files_to_hash = {}
+
+        found_files = set()
         unknown_files = list()
         changed_files = list()
 
         # Go through all files and check their status against the information from the digest.
-        for pattern in self.glob_patterns:
-            glob = self.root_dir.glob( pattern )
-            for g in glob:
-                if g.is_file() and g.suffix not in self.exclude_ext:
-                
-                    if str( g ) not in files_digest_freeze:
-                        # File was not found in the digest.
-                        unknown_files.append( str( g ) )
-                        continue
-                    else:
-                        # Remove file from list.
-                        # All files still in this list after this for-loop have 
-                        # been in the stored digest, but have not been found now.
-                        known_files.remove( str( g ) )
-
-                    # Retrieve stored digest for this file.
-                    freeze_digest = files_digest_freeze[str( g )]
-                    
-                    # Calculate current digest for this file.
-                    files_digest = self.__sha256sum( g )
-
-                    # Compare digests.
-                    if not freeze_digest == files_digest:
-                        # Digests disagree, the file must have been modified.
-                        changed_files.append( str( g ) )
-                    elif self.verbose:
-                        print( 'File unchanged:', g )
-
-        check = True
-
-        # Print list of all changed files.
-        if not 0 == len( changed_files ):
-            print( '\nThe following files have been changed:' )
-            for cf in changed_files:
-                print( '\t{}'.format( cf ) )
-            check = False
-        
-        # Print list of all missing files.
-        if not 0 == len( known_files ):
-            print( '\nThe following files are missing:' )
-            for kf in known_files:
-                print( '\t{}'.format( kf ) )
-            check = False
-
-        # Print list of all unknown files.
-        if not 0 == len( unknown_files ):
-            print( '\nThe following files have been added:' )
-            for uf in unknown_files:
-                print( '\t{}'.format( uf ) )
-            check = False
+        for g in self.__files( sub_dir ):
+            f = self.__relative( g )
+
+            if f not in files_digest_freeze:
+                # File was not found in the digest.
+                unknown_files.append( f )
+                continue
+
+            found_files.add( f )
+
+            # Retrieve the current file status.
+            status = self.__stat( g )
+
+            # Skip hashing if the file status is unchanged since the last verification.
+            # Files modified at or after the time the index has been written are hashed
+            # nonetheless, since a change within the timestamp resolution goes unnoticed.
+            if index_status.get( f ) == status and status[1] < index_timestamp:
+                files_status[f] = status
+                if self.verbose: print( 'File unchanged (status):', g )
+                continue
+
+            files_to_hash[f] = status
+
+        # All files from the stored digest that have not been found now are missing.
+        known_files = [ f for f in files_digest_freeze if f not in found_files ]
+
+        # In fail-fast mode, hash files directory by directory. Otherwise, hash all files at once.
+        if not fail_fast:
+            batches = [ files_to_hash ]
+        elif unknown_files or known_files:
+            batches = []
+        else:
+            batches = self.__group_by_dir( files_to_hash ).values()
+
+        for batch in batches:
+
+            # Calculate current digests for this batch of files (with the algorithm used for freezing).
+            files_digest = self.__hasher.digests(
+                ( self.__absolute( f ) for f in batch ),
+                algorithm = manifest.algorithm
+            )
+
+            for ( f, status ), digest in zip( batch.items(), files_digest ):
+
+                # Compare against stored digest for this file.
+                if not files_digest_freeze[f] == digest:
+                    # Digests disagree, the file must have been modified.
+                    changed_files.append( f )
+                else:
+                    # Only verified files are added to the index.
+                    files_status[f] = status
+                    if self.verbose: print( 'File unchanged:', self.__absolute( f ) )
+
+            if fail_fast and changed_files:
+                break
+
+        # Update the file status index (incremental mode, complete checks only).
+        if self.incremental and sub_dir is None and files_status != index_status:
+            self.__store_index( files_digest_hash, files_status )
+
+        # Print lists of all changed, missing and unknown files (per directory).
+        check = all( [
+            self.__report( 'The following files have been changed:', changed_files ),
+            self.__report( 'The following files are missing:', known_files ),
+            self.__report( 'The following files have been added:', unknown_files ),
+        ] )
+
+        if fail_fast and not check:
+            print( '\nCheck stopped at first mismatch (fail-fast mode).' )
 
         return check
 
 
-    def __sha256sum( self, file_name ):
-        h  = sha256()
-        b  = bytearray( 128*1024 ) # 128kb buffer size for file hashing
-        mv = memoryview( b )
-        with open( file_name, 'rb', buffering = 0 ) as f:
-            for n in iter( lambda : f.readinto( mv ), 0 ):
-                h.update( mv[:n] )
-        return h.hexdigest()
\ No newline at end of file
+    def digest_hash( self ):
+        '''
+        Retrieve a hash of the stored digest, which changes whenever the workflow is frozen again.
+
+        :return: SHA-256 hash of the serialized digest (as hex string)
+        '''
+        try:
+            return sha256( self.__read_encrypted( self.freeze_file_name ) ).hexdigest()
+        except RuntimeError as err:
+            raise RuntimeError( 'Error opening freeze digest: {}'.format( err ) )
+
+
+    def rotate( self, crypto, transaction = None ):
+        '''
+        Re-encrypt the digest and the file status index for another crypto instance (i.e., with
+        another passphrase), each in a single streaming pass. The files are replaced immediately or
+        when committing the given transaction (see class FileTransaction).
+        '''
+        for file_name in [ self.freeze_file_name, self.index_file_name ]:
+            if file_name.is_file():
+                self.__crypto.reencrypt_file( file_name, crypto, transaction )
+
+        self.__crypto = crypto
+
+
+    def watch( self, backend = 'auto', poll_interval = 5., on_change = None ):
+        '''
+        Start watching all files relevant for the workflow in the background.
+
+        The optional callback "on_change" is called (from a background thread) with the path
+        of the changed file as soon as a file is changed after a successful check.
+        '''
+        self.unwatch()
+
+        self.__guard = FreezeGuard(
+            root_dir = self.root_dir,
+            glob_patterns = self.glob_patterns,
+            exclude_ext = self.exclude_ext,
+            exclude_dirs = self.exclude_dirs,
+            backend = backend,
+            poll_interval = poll_interval,
+            on_change = on_change
+        )
+
+        self.__guard.start()
+
+
+    def unwatch( self ):
+        '''
+        Stop watching the files.
+        '''
+        if self.__guard is not None:
+            self.__guard.stop()
+            self.__guard = None
+
+
+    def is_dirty( self ):
+        '''
+        Check if any file has changed since the last check (always True if the files are not watched).
+        '''
+        return self.__guard is None or self.__guard.is_dirty()
+
+
+    def __files( self, sub_dir = None ):
+        '''
+        Enumerate all files relevant for the workflow (single walk of the workflow root directory).
+
+        :return: generator of file paths (as strings)
+        '''
+        return FileScanner(
+            root_dir = self.root_dir,
+            glob_patterns = self.glob_patterns,
+            exclude_ext = self.exclude_ext,
+            exclude_dirs = self.exclude_dirs
+        ).files( sub_dir )
+
+
+    def __load_manifest( self, manifest ):
+        '''
+        Load the de-serialized file digest as Merkle tree manifest.
+
+        :return: Merkle tree manifest
+        '''
+        if MerkleManifest.is_merkle( manifest ):
+            return MerkleManifest.from_json( manifest )
+
+        # Flat digest (absolute paths, SHA256), convert to Merkle tree manifest.
+        return MerkleManifest.from_digests(
+            { self.__relative( f ) : d for f, d in manifest.items() },
+            algorithm = 'sha256'
+        )
+
+
+    def __report( self, title, files ):
+        '''
+        Print list of files, grouped by directory.
+
+        :return: True if the list is empty, False otherwise
+        '''
+        if 0 == len( files ):
+            return True
+
+        print( '\n' + title )
+        for d, files_in_dir in sorted( self.__group_by_dir( dict.fromkeys( files ) ).items() ):
+            print( '\t{}:'.format( self.__absolute( d ) ) )
+            for f in files_in_dir:
+                print( '\t\t{}'.format( self.__absolute( f ) ) )
+
+        return False
+
+
+    def __group_by_dir( self, files ):
+        files_by_dir = {}
+        for f, value in files.items():
+            files_by_dir.setdefault( dirname( f ), {} )[f] = value
+        return files_by_dir
+
+
+    def __sub_dir( self, subtree ):
+        if subtree is None:
+            return None
+
+        # Path of subtree relative to workflow root directory.
+        sub_dir = Path( self.root_dir, subtree ).resolve().relative_to( self.root_dir )
+
+        return sub_dir.as_posix() if sub_dir.parts else None
+
+
+    def __relative( self, file_name ):
+        prefix = str( self.root_dir ) + sep
+        if file_name.startswith( prefix ):
+            file_name = file_name[len( prefix ):]
+        else:
+            file_name = relpath( file_name, self.root_dir )
+        return file_name.replace( sep, '/' )
+
+
+    def __absolute( self, file_name ):
+        return normpath( join( str( self.root_dir ), file_name.replace( '/', sep ) ) )
+
+
+    def __write_encrypted( self, file_name, obj ):
+        '''
+        Serialize an object (convert to JSON) and write it encrypted to a file. The data is
+        encrypted chunk by chunk while serializing, i.e., the encrypted data is never held in memory.
+        The file is replaced atomically (write to temporary file, then rename).
+
+        :return: SHA-256 hash of the serialized object
+        '''
+        tmp_file_name = file_name.with_name( file_name.name + '.tmp' )
+
+        h = sha256()
+        with open( tmp_file_name, 'wb' ) as f:
+            # Keep the file permissions of an existing file.
+            if file_name.is_file():
+                copymode( file_name, tmp_file_name )
+
+            with self.__crypto.writer( f ) as w:
+                for chunk in JSONEncoder().iterencode( obj ):
+                    data = chunk.encode( 'utf-8' )
+                    h.update( data )
+                    w.write( data )
+
+        replace( tmp_file_name, file_name )
+
+        return h.hexdigest()
+
+
+    def __read_encrypted( self, file_name ):
+        '''
+        Read and decrypt the contents of a file.
+
+        :return: decrypted data (bytes)
+        '''
+        with open( file_name, 'rb' ) as f:
+            return self.__crypto.reader( f ).read()
+
+
+    def __load_index( self, files_digest_hash ):
+        '''
+        Load the file status index.
+
+        :return: tuple with index timestamp and file status dict, None if no valid index is available
+        '''
+        if not self.index_file_name.is_file():
+            return None
+
+        try:
+            index = json_loads( self.__read_encrypted( self.index_file_name ) )
+        except ( RuntimeError, ValueError ):
+            # A corrupted index is not an error, it only forces a full verification.
+            return None
+
+        # The index is only valid for the digest it has been created for.
+        if not index.get( 'digest' ) == files_digest_hash:
+            return None
+
+        return ( index['timestamp'], { k : tuple( v ) for k, v in index['files'].items() } )
+
+
+    def __store_index( self, files_digest_hash, files_status ):
+        '''
+        Store the file status index (encrypted, to protect it against manipulation).
+        '''
+        index = {
+            'digest' : files_digest_hash,
+            'timestamp' : time_ns(),
+            'files' : files_status
+        }
+
+        self.__write_encrypted( self.index_file_name, index )
+
+        # Set index file permissions.
+        self.__file_permissions.restrict_access( self.index_file_name )
+
+
+    def __stat( self, file_name ):
+        st = stat( file_name )
+        return ( st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns )
+
+
+    def __default_num_workers( self ):
+        try:
+            return WorkflowConfig( root_dir = self.root_dir ).num_cores()
+        except ( OSError, RuntimeError ):
+            # No usable workflow configuration, let the hasher decide.
+            return None
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from weakref import WeakSet
+
+try:
+    from os import register_at_fork
+except ImportError:
+    # Not available on Windows (processes are never forked there).
+    register_at_fork = None
+
+
+class LRUCache:
+    '''
+    Bounded in-memory cache, evicting the least recently used entry when full and all entries
+    older than a time-to-live (in seconds). Intended for keeping decrypted values in memory only
+    as long as they are actually in use.
+    '''
+
+    def __init__( self, max_size = 32, ttl = 300. ):
+
+        if not isinstance( max_size, int ) or max_size < 0:
+            raise TypeError( 'Input parameter "max_size" has to be a non-negative "int"' )
+
+        if not ttl > 0:
+            raise ValueError( 'Input parameter "ttl" has to be positive' )
+
+        # Maximum number of entries (0: caching disabled).
+        self.max_size = max_size
+
+        # Time-to-live of an entry in seconds.
+        self.ttl = ttl
+
+        # Entries (key -> tuple with expiry time and value), ordered from least to most recently used.
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+        # Reset in child processes after a fork (see function _after_fork_in_child).
+        _instances.add( self )
+
+
+    def get( self, key ):
+        '''
+        Retrieve an entry (and mark it as most recently used).
+
+        :return: value, None if the entry is not available (or has expired)
+        '''
+        with self.__lock:
+            self.__evict_expired()
+
+            entry = self.__entries.get( key )
+            if entry is None:
+                return None
+
+            self.__entries.move_to_end( key )
+            return entry[1]
+
+
+    def put( self, key, value ):
+        '''
+        Add or replace an entry.
+        '''
+        if self.max_size == 0:
+            return
+
+        with self.__lock:
+            self.__entries[key] = ( monotonic() + self.ttl, value )
+            self.__entries.move_to_end( key )
+
+            while len( self.__entries ) > self.max_size:
+                self.__entries.popitem( last = False )
+
+
+    def pop( self, key ):
+        '''
+        Remove an entry (if available).
+        '''
+        with self.__lock:
+            self.__entries.pop( key, None )
+
+
+    def clear( self ):
+        '''
+        Remove all entries.
+        '''
+        with self.__lock:
+            self.__entries.clear()
+
+
+    def __len__( self ):
+        with self.__lock:
+            self.__evict_expired()
+            return len( self.__entries )
+
+
+    def __evict_expired( self ):
+        # Entries expire in the order they have been added or replaced, which differs from the order
+        # of use. Hence, all entries are checked (the cache is small).
+        now = monotonic()
+        for key in [ k for k, ( expiry, _ ) in self.__entries.items() if expiry <= now ]:
+            del self.__entries[key]
+
+
+    def _reset_after_fork( self ):
+        # Another thread may have held the lock while forking (see class RunPool), it would remain
+        # locked in the child. Hence, start over with a new lock and without any entries.
+        self.__lock = Lock()
+        self.__entries = OrderedDict()
+
+
+# Live instances of class LRUCache.
+_instances = WeakSet()
+
+
+def _after_fork_in_child():
+    for cache in list( _instances ):
+        cache._reset_after_fork()
+
+
+# Register a single handler for all instances (registered handlers cannot be removed).
+if register_at_fork is not None:
+    register_at_fork( after_in_child = _after_fork_in_child )
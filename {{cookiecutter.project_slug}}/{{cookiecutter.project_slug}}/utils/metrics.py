@@ -0,0 +1,344 @@
+from contextlib import contextmanager
+from csv import DictReader
+from datetime import datetime
+from json import dumps as json_dumps
+from os import getpid, replace, times
+from pathlib import Path
+from threading import get_ident, Lock
+from time import monotonic, time
+
+from .._config import METRICS_LEDGER_FILE_NAME
+
+
+# Prefix of all exported metrics.
+METRICS_PREFIX = '{{ cookiecutter.project_slug }}'
+
+
+class Metrics:
+    '''
+    Record timing metrics of workflow executions.
+
+    For every execution (i.e., every attempt of a run), a record is appended to a ledger in JSON-lines
+    format and the metrics of this execution are exported as text file for the textfile collector of the
+    Prometheus node exporter (see attribute Metrics.gauges). Each record contains:
+      - wall time and CPU time (of Snakemake and of all jobs) of the execution,
+      - wall time, CPU time, peak memory (RSS) and output size per rule, based on the log messages of
+        Snakemake and on the benchmark files of the jobs (see directive "benchmark" in the Snakefile),
+      - the time spent in phases before or during the execution (see method phase), e.g., checking
+        the freeze or unlocking the credentials cache, and in creating or checking conda environments.
+
+    The metrics are configured by attribute "metrics" of the workflow configuration (see attribute
+    Metrics.defaults for all settings and their default values). Relative paths refer to the workflow
+    root directory.
+    '''
+
+    # Default settings.
+    defaults = {
+        'enabled': True,
+        'ledger': str( METRICS_LEDGER_FILE_NAME ),
+        'textfile': None
+    }
+
+    # Exported gauges (name, help text and key of the record). Names are prefixed with the project name.
+    gauges = [
+        ( 'run_timestamp_seconds', 'Start of the last workflow execution (Unix time).', 'timestamp' ),
+        ( 'run_success', 'Whether the last workflow execution has been successful.', 'success' ),
+        ( 'run_attempt', 'Attempt of the last workflow execution.', 'attempt' ),
+        ( 'run_wall_seconds', 'Wall time of the last workflow execution.', 'wall_seconds' ),
+        ( 'run_cpu_seconds', 'CPU time of the last workflow execution (including all jobs).', 'cpu_seconds' ),
+        ( 'run_peak_rss_bytes', 'Peak memory (RSS) of the jobs of the last workflow execution.', 'peak_rss_bytes' ),
+        ( 'run_output_bytes', 'Size of the outputs of the last workflow execution.', 'output_bytes' )
+    ]
+
+    # Exported gauges per rule (name, help text and key of the rule record).
+    rule_gauges = [
+        ( 'rule_jobs', 'Number of jobs per rule of the last workflow execution.', 'jobs' ),
+        ( 'rule_failed_jobs', 'Number of failed jobs per rule of the last workflow execution.', 'failed_jobs' ),
+        ( 'rule_wall_seconds', 'Wall time per rule of the last workflow execution.', 'wall_seconds' ),
+        ( 'rule_cpu_seconds', 'CPU time per rule of the last workflow execution.', 'cpu_seconds' ),
+        ( 'rule_peak_rss_bytes', 'Peak memory (RSS) per rule of the last workflow execution.', 'peak_rss_bytes' ),
+        ( 'rule_output_bytes', 'Size of the outputs per rule of the last workflow execution.', 'output_bytes' )
+    ]
+
+    def __init__( self ):
+
+        # Flag indicating that records are written (only after the metrics have been configured).
+        self.enabled = False
+
+        # Ledger and text file for the node exporter (None for no export).
+        self.ledger = None
+        self.textfile = None
+
+        # Time spent in phases since the last run has been started (phase name -> seconds).
+        self.__phases = {}
+
+
+    def configure( self, config, root_dir ):
+        '''
+        Configure the metrics (from attribute "metrics" of the workflow configuration).
+        '''
+        settings = dict( self.defaults )
+
+        for key, value in config.items():
+            if key not in settings:
+                raise RuntimeError( 'Unknown attribute "{}" in metrics configuration!'.format( key ) )
+            settings[key] = value
+
+        self.enabled = bool( settings['enabled'] )
+        self.ledger = Path( root_dir, settings['ledger'] ).resolve() if settings['ledger'] else None
+        self.textfile = Path( root_dir, settings['textfile'] ).resolve() if settings['textfile'] else None
+
+
+    @contextmanager
+    def phase( self, name ):
+        '''
+        Measure the time spent in a phase (reported with the next run).
+        '''
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.__phases[name] = self.__phases.get( name, 0. ) + monotonic() - start
+
+
+    def run( self, run_id ):
+        '''
+        Start recording the executions of a run. The time spent in phases so far is reported with
+        the first execution of this run.
+
+        :return: recorder for the run (see class RunMetrics)
+        '''
+        phases, self.__phases = self.__phases, {}
+        return RunMetrics( self, run_id, phases )
+
+
+    def write( self, record ):
+        '''
+        Append a record to the ledger and export it as text file for the node exporter.
+        '''
+        if not self.enabled:
+            return
+
+        if self.ledger is not None:
+            self.ledger.parent.mkdir( parents = True, exist_ok = True )
+
+            # Write each record with a single call, such that concurrent runs do not interleave records.
+            with open( self.ledger, 'a' ) as f:
+                f.write( json_dumps( record ) + '\n' )
+
+        if self.textfile is not None:
+            self.textfile.parent.mkdir( parents = True, exist_ok = True )
+
+            # Replace the text file atomically, the node exporter must never read an incomplete file.
+            tmp = self.textfile.with_name( '{}.tmp-{}-{}'.format( self.textfile.name, getpid(), get_ident() ) )
+            tmp.write_text( self.prometheus_text( record ) )
+            replace( tmp, self.textfile )
+
+
+    def prometheus_text( self, record ):
+        '''
+        Format a record in the text format of Prometheus.
+        '''
+        lines = []
+
+        def add_gauge( name, help, samples ):
+            name = '{}_{}'.format( METRICS_PREFIX, name )
+            lines.append( '# HELP {} {}'.format( name, help ) )
+            lines.append( '# TYPE {} gauge'.format( name ) )
+            for labels, value in samples:
+                lines.append( '{}{} {}'.format( name, labels, _prometheus_value( value ) ) )
+
+        for name, help, key in self.gauges:
+            add_gauge( name, help, [ ( '', record[key] ) ] )
+
+        add_gauge(
+            'phase_seconds',
+            'Time spent in phases of the last workflow execution (e.g., checking the freeze).',
+            [ ( _prometheus_labels( phase = p ), s ) for p, s in sorted( record['phases'].items() ) ]
+        )
+
+        for name, help, key in self.rule_gauges:
+            add_gauge( name, help, [
+                ( _prometheus_labels( rule = r ), m[key] ) for r, m in sorted( record['rules'].items() )
+            ] )
+
+        return '\n'.join( lines ) + '\n'
+
+
+class RunMetrics:
+    '''
+    Record the executions of a run (see class Metrics). Use method "log_handler" as Snakemake log
+    handler (see function run_workflow) and call methods start and finish for every execution.
+    '''
+
+    def __init__( self, metrics, run_id, phases ):
+
+        self.metrics = metrics
+        self.run_id = run_id
+
+        # Time spent in phases (reported with the next execution).
+        self.phases = phases
+
+        # Attempt of the current execution.
+        self.attempt = 0
+
+        # Started and finished jobs of the current execution (job ID -> job record).
+        self.__jobs = {}
+        self.__lock = Lock()
+
+
+    def start( self ):
+        '''
+        Start recording an execution.
+        '''
+        self.attempt += 1
+        self.__jobs = {}
+        self.__start_time = time()
+        self.__start_wall = monotonic()
+        self.__start_cpu = times()
+
+        # Only wrap Snakemake's conda environment creation if records are written (see function _conda_seconds).
+        self.__start_conda = _conda_seconds() if self.metrics.enabled else None
+
+
+    def log_handler( self, msg ):
+        '''
+        Snakemake log handler.
+        '''
+        level = msg.get( 'level' )
+
+        if level not in [ 'job_info', 'job_finished', 'job_error' ]:
+            return
+
+        with self.__lock:
+            if level == 'job_info':
+                self.__jobs[msg.get( 'jobid' )] = {
+                    'rule': msg.get( 'name' ),
+                    'output': [ str( o ) for o in msg.get( 'output' ) or [] ],
+                    'benchmark': str( msg['benchmark'] ) if msg.get( 'benchmark' ) else None,
+                    'start': monotonic(),
+                    'end': None,
+                    'failed': False
+                }
+            else:
+                job = self.__jobs.get( msg.get( 'jobid' ) )
+                if job is not None:
+                    job['end'] = monotonic()
+                    job['failed'] = level == 'job_error'
+
+
+    def finish( self, success ):
+        '''
+        Finish recording an execution and write its record (see method Metrics.write).
+
+        :return: record of the execution
+        '''
+        wall = monotonic() - self.__start_wall
+        cpu = times()
+        cpu_seconds = sum( cpu[i] - self.__start_cpu[i] for i in range( 4 ) )
+
+        phases = dict( self.phases )
+        if self.__start_conda is not None:
+            phases['conda_envs'] = phases.get( 'conda_envs', 0. ) + _conda_seconds() - self.__start_conda
+        self.phases = {}
+
+        # Aggregate the finished jobs per rule (jobs that have not been finished, e.g., in a dry run, are ignored).
+        rules = {}
+        for job in self.__jobs.values():
+            if job['end'] is None:
+                continue
+
+            benchmark = _read_benchmark( job['benchmark'] )
+            rule = rules.setdefault( job['rule'], {
+                'jobs': 0, 'failed_jobs': 0, 'wall_seconds': 0., 'cpu_seconds': 0., 'peak_rss_bytes': 0, 'output_bytes': 0
+            } )
+
+            rule['jobs'] += 1
+            rule['failed_jobs'] += int( job['failed'] )
+            rule['wall_seconds'] += job['end'] - job['start']
+            rule['cpu_seconds'] += benchmark.get( 'cpu_time', 0. )
+            rule['peak_rss_bytes'] = max( rule['peak_rss_bytes'], int( benchmark.get( 'max_rss', 0. ) * 1024 * 1024 ) )
+            rule['output_bytes'] += sum( _file_size( o ) for o in job['output'] )
+
+        record = {
+            'run_id': self.run_id,
+            'attempt': self.attempt,
+            'start': datetime.fromtimestamp( self.__start_time ).isoformat(),
+            'timestamp': self.__start_time,
+            'success': bool( success ),
+            'wall_seconds': wall,
+            'cpu_seconds': cpu_seconds,
+            'peak_rss_bytes': max( [ r['peak_rss_bytes'] for r in rules.values() ], default = 0 ),
+            'output_bytes': sum( r['output_bytes'] for r in rules.values() ),
+            'phases': phases,
+            'rules': rules
+        }
+
+        self.metrics.write( record )
+        return record
+
+
+# Total time spent in creating or checking conda environments (in this process).
+_conda_time = [ 0. ]
+
+
+def _conda_seconds():
+    # Snakemake does not report the time spent in creating or checking conda environments. Hence,
+    # the method for creating an environment is wrapped (once per process) to measure this time.
+    from snakemake.deployment.conda import Env
+
+    if not getattr( Env.create, 'timed', False ):
+        create = Env.create
+
+        def timed_create( *args, **kwargs ):
+            start = monotonic()
+            try:
+                return create( *args, **kwargs )
+            finally:
+                _conda_time[0] += monotonic() - start
+
+        timed_create.timed = True
+        Env.create = timed_create
+
+    return _conda_time[0]
+
+
+def _read_benchmark( path ):
+    # Read the benchmark file of a job (written by Snakemake, max_rss in MB, s in seconds and mean_load in percent).
+    if path is None or not Path( path ).is_file():
+        return {}
+
+    with open( path ) as f:
+        rows = list( DictReader( f, delimiter = '\t' ) )
+
+    values = {}
+    for key in [ 's', 'max_rss', 'mean_load', 'cpu_time' ]:
+        try:
+            values[key] = float( rows[-1][key] )
+        except ( IndexError, KeyError, TypeError, ValueError ):
+            # Not measured (e.g., the job has finished too quickly) or not available in this version of Snakemake.
+            continue
+
+    # Older versions of Snakemake only report the mean CPU load.
+    if 'cpu_time' not in values and 's' in values and 'mean_load' in values:
+        values['cpu_time'] = values['s'] * values['mean_load'] / 100.
+
+    return values
+
+
+def _file_size( path ):
+    try:
+        return Path( path ).stat().st_size
+    except OSError:
+        return 0
+
+
+def _prometheus_labels( **labels ):
+    return '{' + ','.join( '{}="{}"'.format( k, str( v ).replace( '\\', '\\\\' ).replace( '"', '\\"' ) )
+                           for k, v in labels.items() ) + '}'
+
+
+def _prometheus_value( value ):
+    if isinstance( value, ( bool, int ) ):
+        return str( int( value ) )
+    return repr( float( value ) )
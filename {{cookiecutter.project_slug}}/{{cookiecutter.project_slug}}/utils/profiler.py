@@ -0,0 +1,293 @@
+from contextlib import contextmanager
+from datetime import datetime
+from json import dump as json_dump
+from os import getpid
+from pathlib import Path
+from sys import _current_frames
+from threading import enumerate as enumerate_threads, Event, get_ident, Lock, Thread
+from time import monotonic
+
+
+class Profiler:
+    '''
+    Profile the phases of a command (e.g., checking the freeze, unlocking the credentials cache,
+    building the DAG of jobs or executing the jobs) in named spans.
+
+    In the default mode, every phase is profiled with cProfile. In sampling mode, the stacks of all
+    threads are sampled periodically instead. The sampling interval is increased automatically, such
+    that sampling never takes more than a fixed share of the time (see attribute Profiler.max_overhead).
+    Spans with the same name (e.g., in every loop iteration) are accumulated.
+
+    Method dump writes the profiles to a new subdirectory of the profile directory:
+      - "spans.speedscope.json": timeline of all spans,
+      - "<span>.prof": cProfile statistics of a phase (default mode only, see module pstats),
+      - "<span>.speedscope.json": profile of a phase (one profile per thread in sampling mode).
+    The ".speedscope.json" files can be viewed with speedscope (https://www.speedscope.app).
+
+    Only the process that created the profiler is profiled (e.g., not the worker processes of
+    concurrent workflow executions, see class RunPool). Without a profile directory, all spans are no-ops.
+    '''
+
+    # Maximum share of the time spent with sampling.
+    max_overhead = 0.02
+
+    # Maximum depth of stacks (deeper frames are omitted).
+    max_depth = 256
+
+    def __init__( self, profile_dir = None, name = 'profile', sampling_interval = None ):
+
+        # Flag indicating that spans are profiled.
+        self.enabled = profile_dir is not None
+
+        # Directory for this profile (a new subdirectory of the profile directory).
+        self.output_dir = None
+        if self.enabled:
+            self.output_dir = Path( profile_dir, '{}_{:%Y-%m-%d-%H-%M-%S}_{}'.format( name, datetime.now(), getpid() ) ).resolve()
+
+        # Sampling interval (in seconds, None for profiling with cProfile).
+        self.sampling_interval = sampling_interval
+
+        self.__pid = getpid()
+        self.__thread = get_ident()
+        self.__start = monotonic()
+
+        # Names of active spans (innermost last).
+        self.__active = []
+
+        # Timeline of all spans (tuples with event type "O" or "C", span name and time).
+        self.__events = []
+
+        # Profiles by span name (cProfile) and aggregated samples by span name, thread name and stack.
+        self.__profiles = {}
+        self.__samples = {}
+
+        # Frames of sampled stacks (frame key -> index).
+        self.__frames = {}
+
+        self.__lock = Lock()
+        self.__stop_sampling = Event()
+        self.__sampler = None
+
+        if self.enabled and self.sampling_interval is not None:
+            self.__sampler = Thread( target = self.__sample_loop, name = 'profiler', daemon = True )
+            self.__sampler.start()
+
+
+    @contextmanager
+    def span( self, name ):
+        '''
+        Profile a phase. Spans can be nested, the enclosing span is paused meanwhile.
+        '''
+        if not self.__active_here():
+            yield
+            return
+
+        self.__open( name )
+        try:
+            yield
+        finally:
+            self.__close()
+
+
+    def log_handler( self, msg ):
+        '''
+        Snakemake log handler, switches from span "snakemake_dag" to span "snakemake_jobs" as soon as
+        Snakemake has built the DAG of jobs (and created the conda environments) and starts the jobs.
+        '''
+        if msg.get( 'level' ) == 'run_info' and self.__active_here() and self.__active[-1:] == [ 'snakemake_dag' ]:
+            self.__close()
+            self.__open( 'snakemake_jobs' )
+
+
+    def dump( self ):
+        '''
+        Write all profiles recorded so far (see class description).
+        '''
+        if not self.enabled or not getpid() == self.__pid:
+            return
+
+        self.output_dir.mkdir( parents = True, exist_ok = True )
+
+        with self.__lock:
+            now = self.__now()
+
+            # Timeline of all spans (active spans are closed at the current time).
+            names = sorted( { name for _, name, _ in self.__events } )
+            events = [ { 'type': t, 'frame': names.index( name ), 'at': at } for t, name, at in self.__events ]
+            events += [ { 'type': 'C', 'frame': names.index( name ), 'at': now } for name in reversed( self.__active ) ]
+            self.__write_speedscope( 'spans', [ { 'name': n } for n in names ], [ {
+                'type': 'evented',
+                'name': 'spans',
+                'unit': 'seconds',
+                'startValue': 0.,
+                'endValue': now,
+                'events': events
+            } ] )
+
+            # cProfile statistics (active profiles are not included, they are dumped with the next call).
+            from pstats import Stats
+            for name, profile in self.__profiles.items():
+                if name in self.__active:
+                    continue
+                stats = Stats( profile )
+                stats.dump_stats( str( Path( self.output_dir, '{}.prof'.format( name ) ) ) )
+                frames, samples, weights = _stats_to_stacks( stats, self.max_depth )
+                self.__write_speedscope( name, frames, [ _sampled_profile( name, samples, weights ) ] )
+
+            # Sampled stacks.
+            frames = [ { 'name': n, 'file': f, 'line': l } for n, f, l in self.__frames ]
+            for name, threads in self.__samples.items():
+                self.__write_speedscope( name, frames, [
+                    _sampled_profile( '{} ({})'.format( name, thread ), list( stacks.keys() ), list( stacks.values() ) )
+                    for thread, stacks in sorted( threads.items() )
+                ] )
+
+
+    def close( self ):
+        '''
+        Stop sampling and write all profiles.
+        '''
+        if self.__sampler is not None:
+            self.__stop_sampling.set()
+            self.__sampler.join()
+            self.__sampler = None
+
+        if self.enabled and getpid() == self.__pid:
+            self.dump()
+            print( 'Profile written to: {}'.format( self.output_dir ) )
+
+
+    def __active_here( self ):
+        # Spans are only profiled in the thread and process that created the profiler.
+        return self.enabled and getpid() == self.__pid and get_ident() == self.__thread
+
+
+    def __open( self, name ):
+        with self.__lock:
+            if self.__active and self.sampling_interval is None:
+                self.__profiles[self.__active[-1]].disable()
+
+            self.__active.append( name )
+            self.__events.append( ( 'O', name, self.__now() ) )
+
+            if self.sampling_interval is None:
+                from cProfile import Profile
+                self.__profiles.setdefault( name, Profile() ).enable()
+
+
+    def __close( self ):
+        with self.__lock:
+            name = self.__active.pop()
+
+            if self.sampling_interval is None:
+                self.__profiles[name].disable()
+
+            self.__events.append( ( 'C', name, self.__now() ) )
+
+            if self.__active and self.sampling_interval is None:
+                self.__profiles[self.__active[-1]].enable()
+
+
+    def __now( self ):
+        return monotonic() - self.__start
+
+
+    def __sample_loop( self ):
+        last = monotonic()
+        while not self.__stop_sampling.is_set():
+            start = monotonic()
+            self.__sample( start - last )
+            last = start
+
+            # Sample less often if sampling takes too long (bounded overhead).
+            cost = monotonic() - start
+            self.__stop_sampling.wait( max( self.sampling_interval, cost / self.max_overhead - cost ) )
+
+
+    def __sample( self, weight ):
+        with self.__lock:
+            if not self.__active:
+                return
+
+            samples = self.__samples.setdefault( self.__active[-1], {} )
+            names = { t.ident: t.name for t in enumerate_threads() }
+
+            for ident, frame in _current_frames().items():
+                if ident == get_ident():
+                    continue
+
+                stack = []
+                while frame is not None and len( stack ) < self.max_depth:
+                    code = frame.f_code
+                    key = ( code.co_name, code.co_filename, code.co_firstlineno )
+                    stack.append( self.__frames.setdefault( key, len( self.__frames ) ) )
+                    frame = frame.f_back
+
+                thread = samples.setdefault( names.get( ident, str( ident ) ), {} )
+                stack = tuple( reversed( stack ) )
+                thread[stack] = thread.get( stack, 0. ) + weight
+
+
+    def __write_speedscope( self, name, frames, profiles ):
+        with open( Path( self.output_dir, '{}.speedscope.json'.format( name ) ), 'w' ) as f:
+            json_dump( {
+                '$schema': 'https://www.speedscope.app/file-format-schema.json',
+                'name': name,
+                'exporter': '{{ cookiecutter.project_slug }}',
+                'activeProfileIndex': 0,
+                'shared': { 'frames': frames },
+                'profiles': profiles
+            }, f )
+
+
+def _sampled_profile( name, samples, weights ):
+    return {
+        'type': 'sampled',
+        'name': name,
+        'unit': 'seconds',
+        'startValue': 0.,
+        'endValue': sum( weights ),
+        'samples': [ list( s ) for s in samples ],
+        'weights': weights
+    }
+
+
+def _stats_to_stacks( stats, max_depth ):
+    # cProfile only records the time per function and per caller, not per stack. Hence, the time of
+    # each function is distributed among its stacks in proportion to the time of the calls along them.
+    frames = {}
+    stacks = {}
+
+    def frame_index( func ):
+        file, line, name = func
+        return frames.setdefault( ( name, file, line ), len( frames ) )
+
+    callees = {}
+    for func, ( _, _, _, _, callers ) in stats.stats.items():
+        for caller, ( _, _, _, ct ) in callers.items():
+            callees.setdefault( caller, [] ).append( ( func, ct ) )
+
+    total = sum( tt for _, _, tt, _, _ in stats.stats.values() )
+    min_time = total * 1e-4
+
+    def walk( func, time, stack ):
+        _, _, tt, ct, _ = stats.stats[func]
+        stack = stack + ( frame_index( func ), )
+
+        if ct > 0:
+            stacks[stack] = stacks.get( stack, 0. ) + time * tt / ct
+
+        for callee, callee_ct in callees.get( func, [] ):
+            callee_time = time * callee_ct / ct if ct > 0 else 0.
+            # Omit recursive calls, very deep stacks and negligible calls.
+            if frame_index( callee ) in stack or len( stack ) >= max_depth or callee_time < min_time:
+                continue
+            walk( callee, callee_time, stack )
+
+    # Start with all functions that have not been called by a profiled function.
+    for func, ( _, _, _, ct, callers ) in stats.stats.items():
+        if not callers:
+            walk( func, ct, () )
+
+    frames = [ { 'name': n, 'file': f, 'line': l } for ( n, f, l ) in frames ]
+    return frames, list( stacks.keys() ), list( stacks.values() )
@@ -0,0 +1,286 @@
+from json import dumps as json_dumps
+from hashlib import sha256
+from os import chmod, getpid, link, replace, stat, utime
+from pathlib import Path
+from shutil import copyfile, rmtree
+from stat import S_IREAD
+from threading import get_ident
+from time import monotonic, time
+
+from .file_hasher import file_digest
+from .._config import RESULT_CACHE_DIR_NAME
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    # Not available on Windows (no reflinks).
+    ioctl = None
+
+
+# Linux ioctl request for cloning a file (reflink, copy-on-write).
+FICLONE = 0x40049409
+
+
+class ResultCache:
+    '''
+    Content-addressed cache for the outputs of workflow steps (Snakemake rules with a script).
+
+    Each execution of a cached step is identified by a key, computed from the digests of the step's
+    script and conda environment file (i.e., the same digests as stored by the freeze), the step's
+    section of the workflow configuration (except for scheduling hints, see attribute
+    ResultCache.ignored_config), the shard of a sharded step (see wildcard "shard" in the
+    Snakefile) and the digests of all input files (but not their names, which contain the run ID). If the
+    cache contains outputs for this key, they are materialized (via reflink, hardlink or copy) instead of
+    executing the step. Otherwise, the step is executed and its outputs are added to the cache (via reflink
+    or copy, never via hardlink, such that the outputs stay independent of the cache). Cached files are
+    read-only for the owner (this includes hardlinked outputs).
+
+    Only steps listed in the configuration are cached, i.e., steps whose outputs only depend on their
+    inputs (and not, e.g., on data fetched from a server). The size of the cache is bounded, the least
+    recently used entries are evicted first.
+
+    The cache is configured by attribute "result_cache" of the workflow configuration (see attribute
+    ResultCache.defaults for all settings and their default values).
+    '''
+
+    # Available modes for materializing files ('auto': try reflink, then hardlink, then copy).
+    link_modes = [ 'auto', 'reflink', 'hardlink', 'copy' ]
+
+    # Default settings.
+    defaults = {
+        'steps': [],
+        'dir': str( RESULT_CACHE_DIR_NAME ),
+        'max_size_mb': 1024,
+        'link': 'auto'
+    }
+
+    # Attributes of a step's section of the workflow configuration that do not affect the outputs
+    # of the step (scheduling hints, see the Snakefile), hence they are not part of the key.
+    ignored_config = [ 'threads', 'resources' ]
+
+    # Version of the key format (change whenever the key computation changes).
+    key_version = 3
+
+    def __init__( self, config ):
+
+        settings = dict( self.defaults )
+
+        for key, value in config.get( 'result_cache', {} ).items():
+            if key not in settings:
+                raise RuntimeError( 'Unknown attribute "{}" in result cache configuration!'.format( key ) )
+            settings[key] = value
+
+        if settings['link'] not in self.link_modes:
+            raise ValueError( 'Result cache attribute "link" has to be one of: {}'.format( ', '.join( self.link_modes ) ) )
+
+        # Workflow configuration.
+        self.config = config
+
+        # Names of cached steps.
+        self.steps = set( settings['steps'] )
+
+        # Cache directory.
+        self.cache_dir = Path( settings['dir'] ).resolve()
+
+        # Maximum size of all cached files (in bytes).
+        self.max_size = int( settings['max_size_mb'] * 1024 * 1024 )
+
+        # Mode for materializing files.
+        self.link = settings['link']
+
+
+    def wrap( self, rule ):
+        '''
+        Enable the cache for a Snakemake rule (if the rule is listed in the configuration).
+        '''
+        if rule.name not in self.steps or rule.run_func is None or rule.script is None:
+            return
+
+        run_func = rule.run_func
+        script = Path( rule.basedir, rule.script )
+
+        def cached_run( input, output, *args, **kwargs ):
+            start = monotonic()
+            wildcards = args[1] if len( args ) > 1 else kwargs.get( 'wildcards', {} )
+            key = self.key( rule.name, script, rule.conda_env, input, wildcards.get( 'shard' ) )
+
+            if key is not None and self.fetch( key, output ):
+                print( 'Outputs of step "{}" restored from result cache.'.format( rule.name ) )
+                _restored_benchmark( args, monotonic() - start )
+                return
+
+            run_func( input, output, *args, **kwargs )
+
+            if key is not None:
+                self.store( key, rule.name, output )
+
+        rule.run_func = cached_run
+
+
+    def key( self, step, script, conda_env, input, shard = None ):
+        '''
+        Compute the key of a step execution.
+
+        :return: key as hex string, None if the step execution cannot be cached (e.g., directory as input)
+        '''
+        files = [ Path( f ) for f in input ]
+        if not all( f.is_file() for f in files ):
+            return None
+
+        config = self.config.get( step )
+        if isinstance( config, dict ):
+            config = { k: v for k, v in config.items() if k not in self.ignored_config }
+
+        description = {
+            'version': self.key_version,
+            'step': step,
+            'script': file_digest( script ),
+            'conda_env': file_digest( conda_env ) if conda_env is not None else None,
+            'config': config,
+            'shard': shard,
+            'input': [ file_digest( f ) for f in files ]
+        }
+
+        return sha256( json_dumps( description, sort_keys = True ).encode( 'utf-8' ) ).hexdigest()
+
+
+    def fetch( self, key, output ):
+        '''
+        Materialize the cached outputs for a key.
+
+        :return: True if the outputs have been materialized, False otherwise
+        '''
+        entry = Path( self.cache_dir, key )
+        cached = [ Path( entry, str( i ) ) for i in range( len( output ) ) ]
+
+        if not all( c.is_file() for c in cached ):
+            return False
+
+        try:
+            for c, o in zip( cached, output ):
+                o = Path( o )
+                o.parent.mkdir( parents = True, exist_ok = True )
+                if o.exists():
+                    o.unlink()
+                self.__materialize( c, o )
+        except OSError:
+            # Evicted concurrently or not accessible, execute the step instead.
+            for o in output:
+                Path( o ).unlink( missing_ok = True )
+            return False
+
+        # Mark entry as recently used.
+        utime( entry )
+        return True
+
+
+    def store( self, key, step, output ):
+        '''
+        Add the outputs of a step execution to the cache (only regular files can be cached).
+        '''
+        outputs = [ Path( o ) for o in output ]
+        if not all( o.is_file() for o in outputs ):
+            return
+
+        entry = Path( self.cache_dir, key )
+        if entry.is_dir():
+            return
+
+        # Write entry to a temporary directory first, such that only complete entries become visible.
+        tmp = Path( self.cache_dir, '{}.tmp-{}-{}'.format( key, getpid(), get_ident() ) )
+
+        try:
+            tmp.mkdir( parents = True )
+            for i, o in enumerate( outputs ):
+                cached = Path( tmp, str( i ) )
+                # Cached files are copies (never hardlinks), making them read-only does not affect the outputs.
+                self.__materialize( o, cached, store = True )
+                chmod( cached, S_IREAD )
+
+            Path( tmp, 'meta.json' ).write_text( json_dumps( {
+                'step': step,
+                'output': [ str( o ) for o in outputs ],
+                'created': time()
+            } ) )
+
+            replace( tmp, entry )
+        except OSError:
+            # Entry has been added concurrently (or cache not writable), discard it.
+            rmtree( tmp, ignore_errors = True )
+            return
+
+        self.evict()
+
+
+    def evict( self ):
+        '''
+        Remove the least recently used entries until the cache does not exceed the maximum size.
+        '''
+        if not self.cache_dir.is_dir():
+            return
+
+        entries = []
+        total = 0
+        for entry in self.cache_dir.iterdir():
+            if not entry.is_dir() or '.tmp-' in entry.name:
+                continue
+            try:
+                size = sum( f.stat().st_size for f in entry.iterdir() )
+                entries.append( ( stat( entry ).st_mtime, size, entry ) )
+                total += size
+            except OSError:
+                # Entry has been removed concurrently.
+                continue
+
+        for _, size, entry in sorted( entries ):
+            if total <= self.max_size:
+                break
+            rmtree( entry, ignore_errors = True )
+            total -= size
+
+
+    def __materialize( self, src, dst, store = False ):
+        '''
+        Create a file from another one using the configured link mode. Files are never hardlinked
+        when storing them in the cache (the step's output would become read-only as well).
+        '''
+        modes = [ 'reflink', 'hardlink', 'copy' ] if self.link == 'auto' else [ self.link ]
+        if store:
+            modes = [ m for m in modes if not m == 'hardlink' ] or [ 'reflink', 'copy' ]
+
+        for mode in modes:
+            try:
+                if mode == 'reflink':
+                    _reflink( src, dst )
+                elif mode == 'hardlink':
+                    link( src, dst )
+                else:
+                    copyfile( src, dst )
+                return
+            except OSError:
+                if mode == modes[-1]:
+                    raise
+
+
+def _restored_benchmark( args, running_time ):
+    # Snakemake writes the benchmark record of a job (see directive "benchmark" in the Snakefile), which is
+    # only measured if the script is executed. For restored outputs, the time for restoring them is recorded.
+    from snakemake.benchmark import BenchmarkRecord
+
+    for bench_record in args:
+        if isinstance( bench_record, BenchmarkRecord ) and bench_record.running_time is None:
+            bench_record.running_time = running_time
+
+
+def _reflink( src, dst ):
+    # Clone the file (copy-on-write), only supported on Linux by some file systems (e.g., Btrfs, XFS).
+    if ioctl is None:
+        raise OSError( 'Reflinks are not supported on this platform' )
+
+    with open( src, 'rb' ) as fsrc, open( dst, 'wb' ) as fdst:
+        try:
+            ioctl( fdst.fileno(), FICLONE, fsrc.fileno() )
+        except OSError:
+            fdst.close()
+            Path( dst ).unlink()
+            raise
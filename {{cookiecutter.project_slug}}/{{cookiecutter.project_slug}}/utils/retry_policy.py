@@ -0,0 +1,192 @@
+from pathlib import Path
+from random import uniform
+from re import compile as re_compile
+
+
+class FailureMonitor:
+    '''
+    Collect the failures of a workflow execution from the Snakemake log messages.
+    Use method "log_handler" as Snakemake log handler (see function run_workflow).
+    '''
+
+    # Pattern for retrieving exit codes of failed jobs from error messages.
+    exit_status_regex = re_compile( r'exit status (\d+)' )
+
+    # Maximum number of bytes read from the end of each log file of a failed job.
+    max_log_size = 65536
+
+    def __init__( self ):
+
+        # Names of the failed rules.
+        self.failed_rules = []
+
+        # Log files of the failed jobs.
+        self.log_files = []
+
+        # Error messages.
+        self.messages = []
+
+
+    def log_handler( self, msg ):
+        '''
+        Snakemake log handler.
+        '''
+        level = msg.get( 'level' )
+
+        if level == 'job_error':
+            self.failed_rules.append( msg.get( 'name' ) )
+            self.log_files.extend( msg.get( 'log' ) or [] )
+        elif level == 'error':
+            self.messages.append( str( msg.get( 'msg' ) ) )
+
+
+    def exit_codes( self ):
+        '''
+        Retrieve the exit codes of failed jobs (as reported in the error messages).
+        '''
+        return { int( c ) for m in self.messages for c in self.exit_status_regex.findall( m ) }
+
+
+    def text( self ):
+        '''
+        Retrieve error messages and the (end of the) log files of the failed jobs.
+        '''
+        text = list( self.messages )
+
+        for log_file in self.log_files:
+            path = Path( log_file )
+            if not path.is_file():
+                continue
+
+            with open( path, 'rb' ) as f:
+                f.seek( max( 0, path.stat().st_size - self.max_log_size ) )
+                text.append( f.read().decode( 'utf-8', errors = 'replace' ) )
+
+        return '\n'.join( text )
+
+
+class RetryPolicy:
+    '''
+    Policy for retrying failed workflow executions, defined by attribute "retry" of the workflow
+    configuration (see attribute RetryPolicy.defaults for all settings and their default values).
+
+    Retries are delayed with exponential backoff (with random jitter), the number of attempts and the
+    total time per run (deadline) are limited. Optionally, only transient failures are retried.
+    A failure counts as transient if a job exited with one of the transient exit codes or if the error
+    messages (or the log files of the failed jobs) match one of the transient patterns (regular
+    expressions). All other failures (e.g., errors in the Snakefile or in a step script) are permanent.
+    '''
+
+    # Available settings for retrying failures.
+    retry_on_choices = [ 'any', 'transient' ]
+
+    # Default settings.
+    defaults = {
+        'max_attempts': 5,
+        'initial_delay': 60,
+        'max_delay': 3600,
+        'multiplier': 2,
+        'jitter': 0.2,
+        'deadline': None,
+        'keep_going': True,
+        'retry_on': 'any',
+        'transient_exit_codes': [ 75 ],
+        'transient_patterns': []
+    }
+
+    def __init__( self, config = None, initial_delay = None ):
+
+        settings = dict( self.defaults )
+
+        for key, value in ( config or {} ).items():
+            if key not in settings:
+                raise RuntimeError( 'Unknown attribute "{}" in retry configuration!'.format( key ) )
+            settings[key] = value
+
+        # Explicitly specified initial delay (e.g., from the command line).
+        if initial_delay is not None:
+            settings['initial_delay'] = initial_delay
+
+        if not isinstance( settings['max_attempts'], int ) or settings['max_attempts'] < 1:
+            raise TypeError( 'Retry attribute "max_attempts" has to be a positive "int"' )
+
+        for key in [ 'initial_delay', 'max_delay', 'jitter' ]:
+            if not isinstance( settings[key], ( int, float ) ) or settings[key] < 0:
+                raise TypeError( 'Retry attribute "{}" has to be a non-negative number'.format( key ) )
+
+        if not isinstance( settings['multiplier'], ( int, float ) ) or settings['multiplier'] < 1:
+            raise TypeError( 'Retry attribute "multiplier" has to be a number not smaller than 1' )
+
+        if settings['deadline'] is not None and not isinstance( settings['deadline'], ( int, float ) ):
+            raise TypeError( 'Retry attribute "deadline" has to be a number (or null)' )
+
+        if settings['retry_on'] not in self.retry_on_choices:
+            raise ValueError( 'Retry attribute "retry_on" has to be one of: {}'.format( ', '.join( self.retry_on_choices ) ) )
+
+        # Maximum number of attempts per run (including the first one).
+        self.max_attempts = settings['max_attempts']
+
+        # Delay before the first retry, growing by the multiplier up to the maximum delay (in seconds).
+        self.initial_delay = settings['initial_delay']
+        self.max_delay = settings['max_delay']
+        self.multiplier = settings['multiplier']
+
+        # Relative random variation of the delay (e.g., 0.2 for +/- 20%).
+        self.jitter = settings['jitter']
+
+        # Maximum time from the start of the first attempt to the start of a retry (in seconds, None for no limit).
+        self.deadline = settings['deadline']
+
+        # Keep executing independent jobs if a job fails (such that retries only run the failed jobs).
+        self.keep_going = settings['keep_going']
+
+        # Retry all failures ('any') or only transient failures ('transient').
+        self.retry_on = settings['retry_on']
+
+        # Indicators for transient failures.
+        self.transient_exit_codes = set( settings['transient_exit_codes'] )
+        self.transient_patterns = [ re_compile( p ) for p in settings['transient_patterns'] ]
+
+
+    def classify( self, failure ):
+        '''
+        Classify a failure (see class FailureMonitor).
+
+        :return: 'transient' or 'permanent'
+        '''
+        if failure.exit_codes() & self.transient_exit_codes:
+            return 'transient'
+
+        if self.transient_patterns:
+            text = failure.text()
+            if any( p.search( text ) for p in self.transient_patterns ):
+                return 'transient'
+
+        return 'permanent'
+
+
+    def retry_delay( self, attempt, elapsed, failure ):
+        '''
+        Decide whether a failed attempt should be retried.
+
+        :param attempt: number of the failed attempt (starting with 1)
+        :param elapsed: time since the start of the first attempt (in seconds)
+        :param failure: failures collected during the failed attempt (see class FailureMonitor)
+        :return: tuple with the delay before the next attempt (in seconds, None if the run should
+            not be retried) and the reason
+        '''
+        kind = self.classify( failure )
+
+        if self.retry_on == 'transient' and kind == 'permanent':
+            return None, 'permanent failure'
+
+        if attempt >= self.max_attempts:
+            return None, 'maximum number of attempts ({}) reached'.format( self.max_attempts )
+
+        delay = min( self.max_delay, self.initial_delay * self.multiplier ** ( attempt - 1 ) )
+        delay = max( 0., delay * ( 1. + uniform( -self.jitter, self.jitter ) ) )
+
+        if self.deadline is not None and elapsed + delay > self.deadline:
+            return None, 'deadline ({} seconds) reached'.format( self.deadline )
+
+        return delay, '{} failure'.format( kind )
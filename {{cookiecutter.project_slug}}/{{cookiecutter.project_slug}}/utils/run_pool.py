@@ -0,0 +1,222 @@
+from collections import deque
+from multiprocessing import get_all_start_methods, get_context
+from signal import SIGTERM, signal
+from sys import exit as sys_exit
+from time import sleep
+
+
+# Event of the pool that is set while its worker processes are being terminated (only in worker processes).
+_terminating = None
+
+
+class RunPool:
+    '''
+    Bounded pool of worker processes for executing workflow runs concurrently, one process per run.
+
+    Snakemake and the credentials cache must not be used from several threads. Hence, every run is
+    executed in its own process, forked from the main process: workers inherit the unlocked credentials
+    cache (or connect to the credentials agent) and the parsed workflow (see class WorkflowSession).
+    The cores and resource limits (e.g., memory) from the workflow configuration are divided evenly
+    between the concurrent runs.
+
+    If all workers are busy, the queue policy decides what happens with a new run:
+      - 'queue': queue the run, it is started as soon as a worker becomes available
+        (if the maximum number of queued runs is reached, the new run is skipped).
+      - 'latest': queue the run, replacing all queued runs (i.e., only the latest run is started).
+      - 'skip': skip the run.
+    '''
+
+    # Available queue policies.
+    policies = [ 'queue', 'latest', 'skip' ]
+
+    # Time in seconds a run has for stopping its jobs when being terminated (before it is killed).
+    terminate_timeout = 30.
+
+    def __init__( self, max_runs, num_cores, policy = 'queue', max_queued = None, resources = None ):
+
+        if not RunPool.supported():
+            raise RuntimeError( 'Concurrent runs require processes with start method "fork"' )
+
+        if not isinstance( max_runs, int ) or max_runs < 1:
+            raise TypeError( 'Input parameter "max_runs" has to be a positive "int"' )
+
+        if policy not in self.policies:
+            raise ValueError( 'Input parameter "policy" has to be one of: {}'.format( ', '.join( self.policies ) ) )
+
+        # Maximum number of concurrent runs.
+        self.max_runs = max_runs
+
+        # Number of cores for each run.
+        self.cores_per_run = max( 1, num_cores // max_runs )
+
+        # Resource limits for each run.
+        self.resources_per_run = { name: min( value, max( 1, value // max_runs ) ) for name, value in ( resources or {} ).items() }
+
+        # Queue policy and maximum number of queued runs (None for no limit).
+        self.policy = policy
+        self.max_queued = max_queued
+
+        self.__context = get_context( 'fork' )
+
+        # Set while the worker processes are being terminated (shared with the worker processes).
+        self.__terminating = self.__context.Event()
+
+        # Worker processes of running runs (run ID -> process).
+        self.__running = {}
+
+        # Queued runs (tuples with run ID and target).
+        self.__queued = deque()
+
+
+    @staticmethod
+    def supported():
+        '''
+        Check if concurrent runs are supported on this platform.
+        '''
+        return 'fork' in get_all_start_methods()
+
+
+    @staticmethod
+    def terminating():
+        '''
+        Check if the current process is a worker process that is being terminated (e.g., runs must not be retried).
+        '''
+        return _terminating is not None and _terminating.is_set()
+
+
+    def submit( self, run_id, target ):
+        '''
+        Submit a run. The target is called in the worker process with the run ID, the number of
+        cores and the resource limits for the run, it returns True if the run has been successful.
+
+        :return: 'started', 'queued' or 'skipped'
+        '''
+        self.poll()
+
+        if len( self.__running ) < self.max_runs:
+            self.__start( run_id, target )
+            return 'started'
+
+        if self.policy == 'skip':
+            print( 'All {} workers are busy, skipping run {}.'.format( self.max_runs, run_id ) )
+            return 'skipped'
+
+        if self.policy == 'latest':
+            for queued_id, _ in self.__queued:
+                print( 'Run {} has been replaced by run {}.'.format( queued_id, run_id ) )
+            self.__queued.clear()
+
+        elif self.max_queued is not None and len( self.__queued ) >= self.max_queued:
+            print( 'Maximum number of queued runs reached, skipping run {}.'.format( run_id ) )
+            return 'skipped'
+
+        self.__queued.append( ( run_id, target ) )
+        print( 'All {} workers are busy, run {} has been queued.'.format( self.max_runs, run_id ) )
+        return 'queued'
+
+
+    def poll( self ):
+        '''
+        Collect finished runs and start queued runs (if workers are available).
+
+        :return: number of runs that are running or queued
+        '''
+        for run_id, process in list( self.__running.items() ):
+            if process.exitcode is None:
+                continue
+
+            process.join()
+            del self.__running[run_id]
+
+            if process.exitcode == 0:
+                print( 'Run {} has finished.'.format( run_id ) )
+            else:
+                print( 'Run {} has failed (exit code {}).'.format( run_id, process.exitcode ) )
+
+        while self.__queued and len( self.__running ) < self.max_runs:
+            self.__start( *self.__queued.popleft() )
+
+        return len( self.__running ) + len( self.__queued )
+
+
+    def join( self, poll_interval = 1. ):
+        '''
+        Wait until all running and queued runs have finished.
+        '''
+        while self.poll() > 0:
+            sleep( poll_interval )
+
+
+    def terminate( self ):
+        '''
+        Drop all queued runs and stop all running runs. Running runs are interrupted, such that
+        Snakemake stops their jobs and releases its locks (a run can then be executed again).
+
+        :return: list of run IDs of the stopped and dropped runs (in the order they have been submitted)
+        '''
+        stopped = []
+
+        self.__terminating.set()
+
+        for run_id, process in self.__running.items():
+            if process.exitcode is None:
+                process.terminate()
+                process.join( self.terminate_timeout )
+                if process.exitcode is None:
+                    process.kill()
+
+                # Snakemake finishes running jobs first, hence the run may have finished nevertheless.
+                if not process.exitcode == 0:
+                    process.join()
+                    print( 'Run {} has been stopped.'.format( run_id ) )
+                    stopped.append( run_id )
+                    continue
+
+            # Runs that have finished in the meantime are not stopped.
+            process.join()
+            if process.exitcode == 0:
+                print( 'Run {} has finished.'.format( run_id ) )
+            else:
+                print( 'Run {} has failed (exit code {}).'.format( run_id, process.exitcode ) )
+
+        for run_id, _ in self.__queued:
+            print( 'Queued run {} has been dropped.'.format( run_id ) )
+            stopped.append( run_id )
+
+        self.__running.clear()
+        self.__queued.clear()
+
+        self.__terminating.clear()
+
+        return stopped
+
+
+    def __start( self, run_id, target ):
+        process = self.__context.Process(
+            target = _run_worker,
+            args = ( target, run_id, self.cores_per_run, self.resources_per_run, self.__terminating ),
+            name = 'run-{}'.format( run_id )
+        )
+        process.start()
+        self.__running[run_id] = process
+
+
+def _run_worker( target, run_id, num_cores, resources, terminating ):
+    global _terminating
+    _terminating = terminating
+
+    # Terminating a worker interrupts the run (see method RunPool.terminate). While Snakemake
+    # executes jobs, it handles this signal itself (the running jobs are finished first).
+    signal( SIGTERM, _interrupt_worker )
+
+    # The exit code of the worker process indicates whether the run has been successful.
+    try:
+        success = target( run_id, num_cores, resources )
+    except KeyboardInterrupt:
+        success = False
+    sys_exit( 0 if success else 1 )
+
+
+def _interrupt_worker( signum, frame ):
+    # Interrupt the run like Ctrl-C does (e.g., while waiting for a retry).
+    raise KeyboardInterrupt
@@ -1,6 +1,5 @@
 import platform
 from pathlib import Path
-from snakemake import snakemake
 
 from .._config import SNAKE_FILE_NAME
 
@@ -12,8 +11,17 @@ def run_workflow(
     forceall,
     dryrun,
     conda_create_envs_only,
-    num_cores
+    num_cores,
+    keepgoing = False,
+    log_handler = None,
+    resources = None
 ) :
+    # Snakemake is only imported when the workflow is executed (importing it takes a large share of the start-up time).
+    from snakemake import snakemake
+
+    # The target is either a single target or a list of targets (executed by a single snakemake call).
+    targets = target if isinstance( target, list ) else [ target ]
+
     # Using individual conda environments dor each snakemake
     # rule is currently not working on Windows. Hence, the
     # following lines turn this feature off.
@@ -24,9 +32,12 @@ def run_workflow(
         configfiles = [ config_file ],
         #workdir = root_dir,
         cores = num_cores,
+        resources = resources or {},
         use_conda = use_conda,
         forceall = forceall,
         conda_create_envs_only = conda_create_envs_only,
         dryrun = dryrun,
-        targets = [ target ]
+        keepgoing = keepgoing,
+        log_handler = log_handler or [],
+        targets = targets
     )
\ No newline at end of file
@@ -0,0 +1,319 @@
+from collections import deque
+from datetime import datetime, timedelta
+from time import monotonic, sleep, time
+
+
+class CronSchedule:
+    '''
+    Schedule defined by a cron expression with 5 fields (minute, hour, day of month, month, day of week),
+    in local time. Each field is either "*" or a list of values, ranges ("a-b") and steps ("*/n", "a-b/n").
+    Months and days of the week can also be given by name ("jan", "mon"), Sunday is either 0 or 7.
+    If both day of month and day of week are restricted, a day matches if either of them matches.
+    The macros "@hourly", "@daily", "@weekly", "@monthly" and "@yearly" are supported as well.
+    '''
+
+    # Schedule is defined in terms of wall-clock time.
+    wall_clock = True
+
+    # Macros for common expressions.
+    macros = {
+        '@hourly' : '0 * * * *',
+        '@daily' : '0 0 * * *',
+        '@midnight' : '0 0 * * *',
+        '@weekly' : '0 0 * * 0',
+        '@monthly' : '0 0 1 * *',
+        '@yearly' : '0 0 1 1 *',
+        '@annually' : '0 0 1 1 *',
+    }
+
+    # Names for months and days of the week.
+    month_names = [ 'jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec' ]
+    day_names = [ 'sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat' ]
+
+    def __init__( self, expression ):
+
+        self.expression = expression
+
+        fields = self.macros.get( expression.strip().lower(), expression ).split()
+        if not len( fields ) == 5:
+            raise ValueError( 'Cron expression "{}" has to consist of 5 fields'.format( expression ) )
+
+        self.minutes = self.__parse_field( fields[0], 0, 59 )
+        self.hours = self.__parse_field( fields[1], 0, 23 )
+        self.days = self.__parse_field( fields[2], 1, 31 )
+        self.months = self.__parse_field( fields[3], 1, 12, self.month_names )
+        self.weekdays = { d % 7 for d in self.__parse_field( fields[4], 0, 7, self.day_names ) }
+
+        # Restrictions of day of month and day of week are combined with OR (if both are restricted).
+        self.__days_restricted = not fields[2] == '*'
+        self.__weekdays_restricted = not fields[4] == '*'
+
+
+    def first_slot( self, start ):
+        '''
+        Retrieve the first slot at or after the start of the scheduler.
+        '''
+        return self.next_after( start - timedelta( microseconds = 1 ) )
+
+
+    def next_after( self, dt ):
+        '''
+        Retrieve the first slot strictly after a point in time.
+
+        :return: datetime of slot (local time, without time zone)
+        '''
+        t = dt.replace( second = 0, microsecond = 0 ) + timedelta( minutes = 1 )
+        limit = t + timedelta( days = 5 * 366 )
+
+        # Advance field by field (coarse to fine), resetting the finer fields when advancing.
+        while t < limit:
+            if t.month not in self.months:
+                t = ( t.replace( day = 1, hour = 0, minute = 0 ) + timedelta( days = 32 ) ).replace( day = 1 )
+            elif not self.__day_matches( t ):
+                t = t.replace( hour = 0, minute = 0 ) + timedelta( days = 1 )
+            elif t.hour not in self.hours:
+                t = t.replace( minute = 0 ) + timedelta( hours = 1 )
+            elif t.minute not in self.minutes:
+                t += timedelta( minutes = 1 )
+            else:
+                return t
+
+        raise ValueError( 'Cron expression "{}" does not match any date'.format( self.expression ) )
+
+
+    def __day_matches( self, t ):
+        day = t.day in self.days
+        weekday = ( t.weekday() + 1 ) % 7 in self.weekdays
+
+        if self.__days_restricted and self.__weekdays_restricted:
+            return day or weekday
+
+        return day and weekday
+
+
+    @staticmethod
+    def __parse_field( field, low, high, names = None ):
+        values = set()
+
+        for item in field.lower().split( ',' ):
+            item, _, step = item.partition( '/' )
+            step = int( step ) if step else 1
+
+            if item == '*':
+                first, last = low, high
+            else:
+                first, _, last = item.partition( '-' )
+                first = CronSchedule.__parse_value( first, names )
+                last = CronSchedule.__parse_value( last, names ) if last else ( high if step > 1 else first )
+
+            if not ( low <= first <= last <= high ) or step < 1:
+                raise ValueError( 'Invalid cron field: "{}"'.format( field ) )
+
+            values.update( range( first, last + 1, step ) )
+
+        return values
+
+
+    @staticmethod
+    def __parse_value( value, names ):
+        if names is not None and value in names:
+            return names.index( value ) + ( 1 if len( names ) == 12 else 0 )
+        return int( value )
+
+
+class IntervalSchedule:
+    '''
+    Schedule with a fixed period.
+
+    By default, the first slot is the start of the scheduler and the slots are computed on a
+    monotonic clock (i.e., drift-free and not affected by changes of the system clock).
+    Aligned schedules use wall-clock slots that are multiples of the period since midnight (e.g.,
+    every 15 minutes at :00, :15, :30 and :45). For periods shorter than a day, the slots restart
+    at every midnight (e.g., every 7 hours at 00:00, 07:00, 14:00 and 21:00), such that they do not
+    shift from day to day. Longer periods are multiples of the period since the origin below.
+    '''
+
+    # Origin for aligned slots with periods of at least one day (midnight, local time).
+    align_origin = datetime( 2000, 1, 1 )
+
+    def __init__( self, period, align = False ):
+
+        if not isinstance( period, timedelta ) or not period > timedelta( 0 ):
+            raise ValueError( 'Input parameter "period" has to be a positive "datetime.timedelta"' )
+
+        # Period between slots.
+        self.period = period
+
+        # Align slots to multiples of the period since midnight.
+        self.align = align
+
+        # Schedule is defined in terms of wall-clock time only if it is aligned.
+        self.wall_clock = align
+
+        self.__origin = self.align_origin
+
+
+    def first_slot( self, start ):
+        '''
+        Retrieve the first slot at or after the start of the scheduler.
+        '''
+        if not self.align:
+            self.__origin = start
+            return start
+
+        return self.next_after( start - timedelta( microseconds = 1 ) )
+
+
+    def next_after( self, dt ):
+        '''
+        Retrieve the first slot strictly after a point in time.
+
+        :return: datetime of slot (local time, without time zone)
+        '''
+        if self.align and self.period < timedelta( days = 1 ):
+            # Slots since midnight of the same day, the next day starts with a slot at midnight again.
+            midnight = dt.replace( hour = 0, minute = 0, second = 0, microsecond = 0 )
+            n = ( dt - midnight ) // self.period
+            return min( midnight + ( n + 1 ) * self.period, midnight + timedelta( days = 1 ) )
+
+        n = ( dt - self.__origin ) // self.period
+        return self.__origin + ( n + 1 ) * self.period
+
+
+def schedule_slots( schedule, start, end ):
+    '''
+    Enumerate the slots of a schedule within a time range (including start and end), e.g., for backfilling runs.
+    Unaligned interval schedules start with the start of the time range.
+
+    :return: list of datetimes of the slots (local time, without time zone)
+    '''
+    slots = []
+
+    slot = schedule.first_slot( start )
+    while slot <= end:
+        slots.append( slot )
+        slot = schedule.next_after( slot )
+
+    return slots
+
+
+class Scheduler:
+    '''
+    Wait for the slots of a schedule (see classes CronSchedule and IntervalSchedule).
+
+    Waiting is done on the monotonic clock in short steps. For wall-clock schedules, the remaining
+    time is re-evaluated after each step, such that changes of the system clock are taken into
+    account. All other schedules are not affected by changes of the system clock at all.
+
+    Slots that could not be run on time are handled by an explicit policy:
+      - 'skip': skip all missed slots, wait for the next slot.
+      - 'once': run once for all missed slots (for the latest one).
+      - 'all': run every missed slot, one after the other.
+    The catch-up policy applies to slots missed while waiting (e.g., the host has been suspended
+    or the system clock has been advanced), the overrun policy applies to slots missed while the
+    workflow has been running.
+    '''
+
+    # Available policies for missed slots.
+    policies = [ 'skip', 'once', 'all' ]
+
+    # A slot counts as missed if it has been reached with this delay (in seconds).
+    tolerance = 1.
+
+    # Maximum step for waiting (in seconds).
+    max_sleep = 60.
+
+    # Step for waiting if a poll function is provided (in seconds).
+    poll_interval = 1.
+
+    def __init__( self, schedule, catch_up = 'once', overrun = 'once' ):
+
+        for name, policy in [ ( 'catch_up', catch_up ), ( 'overrun', overrun ) ]:
+            if policy not in self.policies:
+                raise ValueError( 'Input parameter "{}" has to be one of: {}'.format( name, ', '.join( self.policies ) ) )
+
+        self.schedule = schedule
+        self.catch_up = catch_up
+        self.overrun = overrun
+
+        # Reference points of wall-clock time and monotonic clock.
+        self.__start_wall = datetime.now()
+        self.__start_mono = monotonic()
+
+        # Due slots that still have to be run.
+        self.__pending = deque()
+
+        # Next slot that is not due yet.
+        self.__next = schedule.first_slot( self.__start_wall )
+
+        # Flag indicating that the workflow has been running since the last slot has been returned.
+        self.__running = False
+
+
+    def next_run( self, poll = None ):
+        '''
+        Wait until the next run is due. The optional poll function is called regularly while
+        waiting (e.g., for collecting finished runs, see class RunPool).
+
+        :return: datetime of the slot (local time), e.g., for defining the run ID
+        '''
+        if self.__running:
+            # Collect slots that became due while running.
+            self.__collect( self.overrun, 'overrun' )
+            self.__running = False
+
+        while not self.__pending:
+            remaining = self.__seconds_until( self.__next )
+            if remaining > 0:
+                if poll is not None:
+                    poll()
+                sleep( min( remaining, self.max_sleep if poll is None else self.poll_interval ) )
+            else:
+                self.__collect( self.catch_up, 'catch-up' )
+
+        self.__running = True
+        return self.__pending.popleft()
+
+
+    def next_slot( self ):
+        '''
+        Retrieve the slot of the next run (without waiting).
+        '''
+        if self.__running:
+            self.__collect( self.overrun, 'overrun' )
+            self.__running = False
+
+        return self.__pending[0] if self.__pending else self.__next
+
+
+    def __collect( self, policy, policy_name ):
+        # Enumerate all due slots.
+        due = []
+        while self.__seconds_until( self.__next ) <= 0:
+            due.append( self.__next )
+            self.__next = self.schedule.next_after( self.__next )
+
+        missed = [ s for s in due if -self.__seconds_until( s ) > self.tolerance ]
+        on_time = due[len( missed ):]
+
+        if policy == 'skip' or ( policy == 'once' and on_time ):
+            keep = []
+        elif policy == 'once':
+            keep = missed[-1:]
+        else:
+            keep = missed
+
+        if len( keep ) < len( missed ):
+            print( 'Skipped {} missed workflow execution(s) ({} policy "{}").'.format(
+                len( missed ) - len( keep ), policy_name, policy ) )
+
+        self.__pending.extend( keep + on_time )
+
+
+    def __seconds_until( self, slot ):
+        if self.schedule.wall_clock:
+            # Slots are wall-clock times (use timestamps, to handle daylight saving time correctly).
+            return slot.timestamp() - time()
+
+        # Slots are relative to the start of the scheduler, measured on the monotonic clock.
+        return ( slot - self.__start_wall ).total_seconds() - ( monotonic() - self.__start_mono )
@@ -0,0 +1,148 @@
+# Step Worker
+#
+# Long-lived worker process that executes Python step scripts on request (see class WorkerPool).
+# The worker is run by the Python interpreter of a conda environment, where this package is not
+# installed. Hence, this script only uses the standard library.
+#
+# Usage (started by the worker pool):
+#   python step_worker.py SOCKET_FD IDLE_TIMEOUT
+
+import json
+import os
+import socket
+import sys
+import traceback
+from runpy import run_path
+from shutil import rmtree
+from tempfile import mkdtemp
+
+
+class NamedList( list ):
+    '''
+    List whose items can also be accessed by name (like the input and output files of a Snakemake job).
+    '''
+
+    def __init__( self, items, names ):
+        super().__init__( items )
+        for name, ( start, end ) in names.items():
+            setattr( self, name, self[start] if end is None else NamedList( self[start:end], {} ) )
+
+
+class Snakemake:
+    '''
+    Object "snakemake" of a step script (same attributes as in a script executed by Snakemake).
+    '''
+
+    def __init__( self, task ):
+        self.input = NamedList( **task['input'] )
+        self.output = NamedList( **task['output'] )
+        self.params = NamedList( **task['params'] )
+        self.wildcards = NamedList( **task['wildcards'] )
+        self.resources = NamedList( **task['resources'] )
+        self.log = NamedList( **task['log'] )
+        self.threads = task['threads']
+        self.config = task['config']
+        self.rule = task['rule']
+        self.bench_iteration = task['bench_iteration']
+        self.scriptdir = os.path.dirname( task['script'] )
+
+
+def run_task( task ):
+    '''
+    Execute a step script in a new working directory (the previous state of the working directory,
+    environment variables, module search path and command line arguments is restored afterwards).
+    '''
+    cwd = os.getcwd()
+    environ = dict( os.environ )
+    path = list( sys.path )
+    argv = list( sys.argv )
+
+    workdir = mkdtemp( prefix = 'step-{}-'.format( task['rule'] ) )
+
+    try:
+        os.chdir( workdir )
+        sys.path.insert( 0, os.path.dirname( task['script'] ) )
+        sys.argv = [ task['script'] ]
+
+        run_path( task['script'], init_globals = { 'snakemake': Snakemake( task ) }, run_name = '__main__' )
+        return {}
+
+    except SystemExit as err:
+        if err.code is None or err.code == 0:
+            return {}
+        if isinstance( err.code, int ):
+            return { 'error': 'Step script {} failed with exit status {}'.format( task['script'], err.code ) }
+        return { 'error': 'Step script {} failed with exit status 1: {}'.format( task['script'], err.code ) }
+
+    except BaseException:
+        return { 'error': 'Step script {} failed:\n{}'.format( task['script'], traceback.format_exc() ) }
+
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        os.chdir( cwd )
+        os.environ.clear()
+        os.environ.update( environ )
+        sys.path[:] = path
+        sys.argv = argv
+
+        rmtree( workdir, ignore_errors = True )
+
+
+def rss():
+    '''
+    Retrieve the current memory usage (RSS) of this process in bytes.
+    '''
+    try:
+        with open( '/proc/self/statm' ) as f:
+            return int( f.read().split()[1] ) * os.sysconf( 'SC_PAGE_SIZE' )
+    except ( OSError, ValueError, IndexError ):
+        # Not available (e.g., on macOS), use the peak memory usage instead (in KB on Linux, in bytes on macOS).
+        import resource
+        peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def main( fd, idle_timeout ):
+
+    # The modules of the package (next to this script) must not shadow the modules used by the step scripts.
+    script_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    sys.path = [ p for p in sys.path if not os.path.abspath( p or '.' ) == script_dir ]
+
+    # Requests and responses are JSON objects, one per line. The worker exits if the connection is
+    # closed (e.g., the worker pool has been closed or Snakemake has exited) or after being idle for too long.
+    conn = socket.socket( fileno = fd )
+    conn.settimeout( idle_timeout )
+    f = conn.makefile( 'rwb' )
+
+    while True:
+        try:
+            line = f.readline()
+        except OSError:
+            return
+
+        if not line:
+            return
+
+        request = json.loads( line )
+        if request.get( 'cmd' ) == 'exit':
+            return
+
+        response = run_task( request )
+        response['rss'] = rss()
+
+        try:
+            f.write( json.dumps( response ).encode( 'utf-8' ) + b'\n' )
+            f.flush()
+        except OSError:
+            return
+
+
+if __name__ == '__main__':
+
+    try:
+        main( int( sys.argv[1] ), float( sys.argv[2] ) )
+    except KeyboardInterrupt:
+        # Interrupted together with Snakemake (same process group).
+        pass
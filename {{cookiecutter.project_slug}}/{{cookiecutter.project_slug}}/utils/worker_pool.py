@@ -0,0 +1,333 @@
+import atexit
+import socket
+from json import dumps as json_dumps, loads as json_loads
+from os import environ, getpid, name as os_name, pathsep
+from pathlib import Path
+from subprocess import Popen, TimeoutExpired
+from sys import executable
+from threading import Condition
+from time import monotonic
+from weakref import WeakSet
+
+
+# Script of the worker processes (executed by the Python interpreter of a conda environment).
+STEP_WORKER_SCRIPT = Path( __file__ ).with_name( 'step_worker.py' )
+
+# All worker pools (closed at exit).
+_pools = WeakSet()
+
+# Worker pools by rule name (see method WorkerPool.wrap).
+_rule_pools = {}
+
+
+class WorkerPool:
+    '''
+    Execute Python step scripts in long-lived worker processes, one per conda environment.
+
+    Snakemake starts a new Python interpreter for every job of a rule with a script, and the script
+    imports all its modules again. For workflows with many short steps, this start-up dominates the
+    execution time. Instead, the jobs of the steps listed in the configuration are sent to a worker
+    process via a local socket (see script step_worker.py). The worker executes the step script in
+    the same way as Snakemake would (i.e., with the object "snakemake" for accessing the input and
+    output files, parameters, etc.), but modules imported by a step script stay loaded for the next job.
+
+    Each job is executed in a new temporary working directory, the input, output and log files are
+    passed as absolute paths. Module state may persist between the jobs of a worker, hence workers
+    are recycled after a number of jobs or if their memory usage (RSS) exceeds a limit. Workers exit
+    when they have been idle for too long or when the pool (or Snakemake) exits.
+
+    The worker pool is configured by attribute "worker_pool" of the workflow configuration (see
+    attribute WorkerPool.defaults for all settings and their default values).
+    '''
+
+    # Default settings.
+    defaults = {
+        'steps': [],
+        'workers_per_env': 1,
+        'max_tasks': 100,
+        'max_memory_mb': 1024,
+        'idle_timeout': 600
+    }
+
+    def __init__( self, config ):
+
+        settings = dict( self.defaults )
+
+        for key, value in config.get( 'worker_pool', {} ).items():
+            if key not in settings:
+                raise RuntimeError( 'Unknown attribute "{}" in worker pool configuration!'.format( key ) )
+            settings[key] = value
+
+        # Names of steps executed by the worker processes.
+        self.steps = set( settings['steps'] )
+
+        # Maximum number of worker processes per conda environment.
+        self.workers_per_env = max( 1, int( settings['workers_per_env'] ) )
+
+        # Maximum number of jobs per worker process.
+        self.max_tasks = max( 1, int( settings['max_tasks'] ) )
+
+        # Maximum memory usage (RSS) of a worker process (in bytes).
+        self.max_memory = int( settings['max_memory_mb'] * 1024 * 1024 )
+
+        # Time after which idle worker processes exit (in seconds).
+        self.idle_timeout = float( settings['idle_timeout'] )
+
+        # Idle workers and number of workers per conda environment (of the process that started them).
+        self.__idle = {}
+        self.__count = {}
+        self.__pid = getpid()
+        self.__cond = Condition()
+
+        _pools.add( self )
+
+
+    @staticmethod
+    def supported():
+        '''
+        Check if the worker pool is supported on this platform (sockets are passed to the worker processes).
+        '''
+        return os_name == 'posix'
+
+
+    def wrap( self, rule ):
+        '''
+        Execute the jobs of a Snakemake rule in worker processes (if the rule is listed in the configuration).
+        '''
+        if rule.name not in self.steps or rule.script is None or not self.supported():
+            return
+
+        # Jobs of rules with a script call function "script" of Snakemake (via the globals of the workflow).
+        # This function is replaced once per process by a function that sends the jobs of the wrapped rules
+        # to their worker pool. Hence, errors are reported by Snakemake like errors of other scripts.
+        workflow_globals = rule.workflow.globals
+        if not getattr( workflow_globals['script'], 'worker_pool', False ):
+            workflow_globals['script'] = _dispatch_script( workflow_globals['script'] )
+
+        _rule_pools[rule.name] = self
+
+
+    def run( self, conda_env, task, bench_record = None ):
+        '''
+        Execute a job in a worker process of a conda environment (None for the current Python interpreter).
+        The worker process is benchmarked during the job (if a Snakemake benchmark record is given).
+        '''
+        worker = self.__acquire( conda_env )
+
+        try:
+            if bench_record is not None:
+                from snakemake.benchmark import benchmarked
+                with benchmarked( worker.pid, bench_record ):
+                    response = worker.request( task )
+            else:
+                response = worker.request( task )
+        except BaseException:
+            # Worker has terminated (or the job has been interrupted), the worker cannot be reused.
+            self.__release( conda_env, worker, recycle = True )
+            raise
+
+        recycle = worker.tasks >= self.max_tasks or response.get( 'rss', 0 ) > self.max_memory
+        self.__release( conda_env, worker, recycle )
+
+        if 'error' in response:
+            raise RuntimeError( response['error'] )
+
+
+    def close( self ):
+        '''
+        Stop all idle worker processes (busy workers are stopped when their job has finished).
+        '''
+        with self.__cond:
+            if not self.__pid == getpid():
+                return
+
+            workers = [ w for idle in self.__idle.values() for w in idle ]
+            self.__idle = {}
+            for conda_env in self.__count:
+                self.__count[conda_env] = 0
+
+        for worker in workers:
+            worker.close()
+
+
+    def __acquire( self, conda_env ):
+        with self.__cond:
+            # Workers started before forking belong to the parent process.
+            if not self.__pid == getpid():
+                self.__idle = {}
+                self.__count = {}
+                self.__pid = getpid()
+
+            while True:
+                idle = self.__idle.setdefault( conda_env, [] )
+
+                # Reuse the most recently used worker (unless it is about to exit due to the idle timeout).
+                while idle:
+                    worker = idle.pop()
+                    if worker.alive() and monotonic() - worker.last_used < self.idle_timeout / 2:
+                        return worker
+                    worker.close()
+                    self.__count[conda_env] -= 1
+
+                if self.__count.get( conda_env, 0 ) < self.workers_per_env:
+                    self.__count[conda_env] = self.__count.get( conda_env, 0 ) + 1
+                    break
+
+                self.__cond.wait()
+
+        try:
+            return StepWorker( conda_env, self.idle_timeout )
+        except BaseException:
+            with self.__cond:
+                self.__count[conda_env] -= 1
+                self.__cond.notify()
+            raise
+
+
+    def __release( self, conda_env, worker, recycle ):
+        if recycle:
+            worker.close()
+
+        with self.__cond:
+            if recycle:
+                self.__count[conda_env] = max( 0, self.__count.get( conda_env, 0 ) - 1 )
+            else:
+                self.__idle.setdefault( conda_env, [] ).append( worker )
+            self.__cond.notify()
+
+
+class StepWorker:
+    '''
+    Worker process executing step scripts (see class WorkerPool), connected via a socket pair.
+    '''
+
+    def __init__( self, conda_env, idle_timeout ):
+
+        # Use the Python interpreter of the conda environment (like an activated environment).
+        env = dict( environ )
+        python = executable
+        if conda_env is not None:
+            python = str( Path( conda_env, 'bin', 'python' ) )
+            env['PATH'] = str( Path( conda_env, 'bin' ) ) + pathsep + env.get( 'PATH', '' )
+            env['CONDA_PREFIX'] = str( conda_env )
+
+        parent, child = socket.socketpair()
+
+        try:
+            self.process = Popen(
+                [ python, str( STEP_WORKER_SCRIPT ), str( child.fileno() ), str( idle_timeout ) ],
+                pass_fds = [ child.fileno() ],
+                env = env
+            )
+        except OSError as err:
+            parent.close()
+            raise RuntimeError( 'Failed to start step worker ({}): {}'.format( python, err ) )
+        finally:
+            child.close()
+
+        # Process ID of the worker.
+        self.pid = self.process.pid
+
+        # Number of jobs executed so far and time of the last job.
+        self.tasks = 0
+        self.last_used = monotonic()
+
+        self.__socket = parent
+        self.__file = parent.makefile( 'rwb' )
+
+
+    def request( self, task ):
+        '''
+        Execute a job.
+
+        :return: response of the worker (with key "error" if the job has failed)
+        '''
+        self.tasks += 1
+
+        self.__file.write( json_dumps( task, default = str ).encode( 'utf-8' ) + b'\n' )
+        self.__file.flush()
+        line = self.__file.readline()
+
+        self.last_used = monotonic()
+
+        if not line:
+            raise RuntimeError( 'Step worker terminated unexpectedly (exit status {})'.format( self.process.wait() ) )
+
+        return json_loads( line )
+
+
+    def alive( self ):
+        '''
+        Check if the worker process is still running.
+        '''
+        return self.process.poll() is None
+
+
+    def close( self ):
+        '''
+        Stop the worker process.
+        '''
+        try:
+            self.__file.write( json_dumps( { 'cmd': 'exit' } ).encode( 'utf-8' ) + b'\n' )
+            self.__file.flush()
+        except OSError:
+            pass
+
+        try:
+            self.__file.close()
+        except OSError:
+            pass
+        self.__socket.close()
+
+        try:
+            self.process.wait( timeout = 5 )
+        except TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def _dispatch_script( script ):
+    # Send the jobs of the wrapped rules to their worker pool, all other jobs to function "script" of Snakemake.
+    def dispatch( path, basedir, input, output, params, wildcards, threads, resources, log, config, rulename,
+                  conda_env, container_img, singularity_args, env_modules, bench_record, jobid, bench_iteration,
+                  *args ):
+
+        pool = _rule_pools.get( rulename )
+        file = Path( basedir, path )
+
+        # Jobs in containers and scripts in other languages (or remote scripts) are executed by Snakemake.
+        if pool is None or container_img is not None or not file.suffix == '.py' or not file.is_file():
+            return script( path, basedir, input, output, params, wildcards, threads, resources, log, config, rulename,
+                           conda_env, container_img, singularity_args, env_modules, bench_record, jobid, bench_iteration,
+                           *args )
+
+        pool.run( conda_env, {
+            'script': str( file.resolve() ),
+            'rule': rulename,
+            'input': _named_list( input, paths = True ),
+            'output': _named_list( output, paths = True ),
+            'log': _named_list( log, paths = True ),
+            'params': _named_list( params ),
+            'wildcards': _named_list( wildcards ),
+            'resources': _named_list( resources ),
+            'threads': threads,
+            'config': config,
+            'bench_iteration': bench_iteration
+        }, bench_record )
+
+    dispatch.worker_pool = True
+    return dispatch
+
+
+@atexit.register
+def _close_pools():
+    for pool in list( _pools ):
+        pool.close()
+
+
+def _named_list( items, paths = False ):
+    # Convert a named list of Snakemake (e.g., the input files of a job) for sending it to a worker.
+    # Paths are made absolute, as the jobs are executed in a temporary working directory.
+    values = [ str( Path( i ).resolve() ) if paths else i for i in items ]
+    names = { name: list( index ) for name, index in getattr( items, '_names', {} ).items() }
+    return { 'items': values, 'names': names }
@@ -1,5 +1,8 @@
+from datetime import datetime
 from json import load as json_load
+from os import cpu_count
 from pathlib import Path
+from re import fullmatch
 
 from .._config import CONFIG_FILE_NAME
 
@@ -35,9 +38,40 @@ class WorkflowConfig:
 
     def num_cores( self ):
         '''
-        Retrieve "num_cores" attribute from the workflow configuration.
+        Retrieve "num_cores" attribute from the workflow configuration
+        (the number of cores available on this host, if it is "auto").
         '''
-        return self.get( 'num_cores' )
+        num_cores = self.get( 'num_cores' )
+
+        if num_cores == 'auto':
+            return host_cores()
+
+        if not isinstance( num_cores, int ) or isinstance( num_cores, bool ) or num_cores < 1:
+            raise RuntimeError( 'Attribute "num_cores" in workflow configuration has to be a positive integer or "auto"!' )
+
+        return num_cores
+
+
+    def resources( self ):
+        '''
+        Retrieve "resources" attribute from the workflow configuration (empty if not available), i.e., the
+        limits of the resources used by the workflow steps (e.g., "mem_mb" for the memory in MB). A memory
+        limit "auto" is replaced by the memory available on this host (omitted if it cannot be detected).
+        '''
+        resources = {}
+
+        for name, value in self.__config.get( 'resources', {} ).items():
+            if name == 'mem_mb' and value == 'auto':
+                value = host_memory_mb()
+                if value is None:
+                    continue
+
+            if not isinstance( value, int ) or isinstance( value, bool ) or value < 0:
+                raise RuntimeError( 'Resource "{}" in workflow configuration has to be a non-negative integer!'.format( name ) )
+
+            resources[name] = value
+
+        return resources
 
 
     def credentials( self ):
@@ -59,3 +93,143 @@ class WorkflowConfig:
         Retrieve "run_id_format" attribute from the workflow configuration.
         '''
         return self.get( 'run_id_format' )
+
+
+    def partition_format( self ):
+        '''
+        Retrieve "partition_format" attribute from the workflow configuration.
+        '''
+        return self.get( 'partition_format' )
+
+
+    def run_time( self, run_id ):
+        '''
+        Retrieve the date and time of a run from its run ID (the inverse of attribute "run_id_format").
+        '''
+        # The run ID format contains a single replacement field with a datetime code (e.g., "{:%Y-%m-%d-%H-%M-%S}").
+        match = fullmatch( r'(.*?)\{[0-9]*:([^{}]*)\}(.*)', self.run_id_format() )
+        if match is not None:
+            prefix, time_format, suffix = match.groups()
+            if run_id.startswith( prefix ) and run_id.endswith( suffix ) and len( run_id ) >= len( prefix ) + len( suffix ):
+                try:
+                    return datetime.strptime( run_id[len( prefix ):len( run_id ) - len( suffix )], time_format )
+                except ValueError:
+                    pass
+
+        raise RuntimeError( 'Run ID "{}" does not match attribute "run_id_format" in workflow configuration!'.format( run_id ) )
+
+
+    def partition( self, run_id ):
+        '''
+        Retrieve the partition of the output files of a run (e.g., "2021/03/01"), derived from its run ID.
+        '''
+        return self.run_time( run_id ).strftime( self.partition_format() )
+
+
+    def run_target( self, run_id ):
+        '''
+        Retrieve the target of a run, i.e., the "target" attribute with wildcards "run_id" and "partition" replaced.
+        '''
+        target = self.target()
+
+        if '{partition}' not in target:
+            return target.format( run_id = run_id )
+
+        return target.format( run_id = run_id, partition = self.partition( run_id ) )
+
+
+    def retry( self ):
+        '''
+        Retrieve "retry" attribute from the workflow configuration (empty if not available).
+        '''
+        return self.__config.get( 'retry', {} )
+
+
+    def metrics( self ):
+        '''
+        Retrieve "metrics" attribute from the workflow configuration (empty if not available).
+        '''
+        return self.__config.get( 'metrics', {} )
+
+
+    def retention( self ):
+        '''
+        Retrieve "retention" attribute from the workflow configuration (empty if not available).
+        '''
+        return self.__config.get( 'retention', {} )
+
+
+def host_cores():
+    '''
+    Detect the number of cores available on this host (restricted by the CPU affinity
+    of this process and the CPU quota of its control group, e.g., in a container).
+    '''
+    try:
+        from os import sched_getaffinity
+        cores = len( sched_getaffinity( 0 ) )
+    except ( ImportError, OSError ):
+        cores = cpu_count() or 1
+
+    # CPU quota of the control group (cgroup v2, e.g., "200000 100000" or "max 100000").
+    quota = _read_cgroup( 'cpu.max' )
+    if quota is not None and len( quota.split() ) == 2 and quota.split()[0].isdigit():
+        limit, period = quota.split()
+        cores = min( cores, max( 1, int( limit ) // int( period ) ) )
+
+    return cores
+
+
+def host_memory_mb():
+    '''
+    Detect the memory available on this host in MB (restricted by the memory limit of the control group
+    of this process, e.g., in a container).
+
+    :return: memory in MB, None if it cannot be detected
+    '''
+    memory = None
+
+    try:
+        from os import sysconf
+        memory = sysconf( 'SC_PHYS_PAGES' ) * sysconf( 'SC_PAGE_SIZE' )
+    except ( ImportError, OSError, ValueError ):
+        # Not available on Windows.
+        memory = _windows_memory()
+
+    # Memory limit of the control group (cgroup v2, "max" for no limit).
+    limit = _read_cgroup( 'memory.max' )
+    if limit is not None and limit.isdigit():
+        memory = int( limit ) if memory is None else min( memory, int( limit ) )
+
+    return memory // ( 1024 * 1024 ) if memory is not None else None
+
+
+def _read_cgroup( name ):
+    # Read a file of the control group of this process (cgroup v2 on Linux only, None if not available).
+    try:
+        with open( '/proc/self/cgroup' ) as f:
+            path = [ l.strip()[3:] for l in f if l.startswith( '0::' ) ]
+        with open( str( Path( '/sys/fs/cgroup', *Path( path[0] ).parts[1:], name ) ) ) as f:
+            return f.read().strip()
+    except ( OSError, IndexError ):
+        return None
+
+
+def _windows_memory():
+    # Retrieve the physical memory via the Windows API (None if not available).
+    try:
+        from ctypes import byref, c_uint32, c_uint64, sizeof, Structure, windll
+    except ImportError:
+        return None
+
+    class MemoryStatusEx( Structure ):
+        _fields_ = [ ( 'dwLength', c_uint32 ), ( 'dwMemoryLoad', c_uint32 ), ( 'ullTotalPhys', c_uint64 ) ] + [
+            ( n, c_uint64 ) for n in [ 'ullAvailPhys', 'ullTotalPageFile', 'ullAvailPageFile', 'ullTotalVirtual',
+                                       'ullAvailVirtual', 'ullAvailExtendedVirtual' ]
+        ]
+
+    status = MemoryStatusEx()
+    status.dwLength = sizeof( MemoryStatusEx )
+    if not windll.kernel32.GlobalMemoryStatusEx( byref( status ) ):
+        return None
+
+    return status.ullTotalPhys
@@ -0,0 +1,182 @@
+import platform
+from os import name as os_name
+from pathlib import Path
+
+from .._config import SNAKE_FILE_NAME
+
+
+class WorkflowSession:
+    '''
+    Snakemake workflow that is parsed once and executed repeatedly (e.g., in every loop iteration).
+
+    Function run_workflow parses the Snakefile, loads the workflow configuration and imports all
+    modules used by the Snakefile (e.g., the credentials cache) for every execution. A session does
+    this only once, every execution only builds and runs the DAG of jobs for the requested target.
+
+    The parsed workflow is only valid as long as the workflow definition does not change. Hence,
+    the session is bound to the freeze digest (if a FreezeWorkflow instance is provided): whenever
+    the digest has changed (i.e., the workflow has been frozen again), the workflow is parsed again.
+    Checking that the files still match the digest is up to the caller (see FreezeWorkflow.check).
+
+    The session uses the Workflow class of Snakemake directly, with the same settings as
+    function run_workflow.
+    '''
+
+    def __init__( self, config_file, root_dir, num_cores, freeze = None, resources = None ):
+
+        # Workflow configuration file.
+        self.config_file = Path( config_file ).resolve( strict = True )
+
+        # Workflow definition.
+        self.snakefile = Path( root_dir, SNAKE_FILE_NAME ).resolve( strict = True )
+
+        # Number of cores used for executing the workflow.
+        self.num_cores = num_cores
+
+        # Resource limits for executing the workflow (e.g., see method WorkflowConfig.resources).
+        self.resources = dict( resources or {} )
+
+        # Freeze digest the parsed workflow is bound to (optional).
+        self.freeze = freeze
+
+        # Number of times the workflow has been parsed.
+        self.num_parsed = 0
+
+        self.__workflow = None
+        self.__digest_hash = None
+
+
+    def run(
+        self,
+        target,
+        forceall,
+        dryrun,
+        keepgoing = False,
+        log_handler = None,
+        num_cores = None,
+        resources = None
+    ):
+        '''
+        Execute the workflow for a target (parse the workflow first, if necessary).
+        Additional Snakemake log handlers can be specified as list (like for function run_workflow).
+        The number of cores and the resource limits of the session can be overridden for a single execution.
+
+        :return: True if the execution has been successful, False otherwise
+        '''
+        # Snakemake is only imported when the workflow is executed (see function run_workflow).
+        from snakemake.exceptions import print_exception
+        from snakemake.io import IOCache
+        from snakemake.logging import logger, setup_logger
+
+        # Set up logging (like function snakemake).
+        setup_logger(
+            handler = log_handler or [],
+            stdout = dryrun,
+            use_threads = not os_name == 'posix'
+        )
+        logger.setup_logfile()
+
+        workflow = None
+
+        try:
+            workflow = self.__parsed_workflow()
+
+            # File status must not be cached across executions.
+            workflow.iocache = IOCache()
+
+            # Number of cores and resource limits for this execution.
+            workflow.global_resources = dict(
+                self.resources if resources is None else resources,
+                _cores = self.num_cores if num_cores is None else num_cores,
+                _nodes = workflow.global_resources['_nodes']
+            )
+
+            return workflow.execute(
+                targets = [ target ],
+                forceall = forceall,
+                dryrun = dryrun,
+                keepgoing = keepgoing,
+                updated_files = [],
+                nolock = False
+            )
+
+        except BaseException as ex:
+            # Report errors like function snakemake (the scheduler also handles interrupts this way).
+            print_exception( ex, workflow.linemaps if workflow is not None else dict() )
+            return False
+
+        finally:
+            if workflow is not None and workflow.persistence:
+                workflow.persistence.unlock()
+            logger.cleanup()
+
+
+    def prepare( self ):
+        '''
+        Parse the workflow in advance (if necessary), e.g., before forking worker processes.
+
+        :return: True if the workflow has been parsed, False otherwise (errors are reported by the next execution)
+        '''
+        try:
+            self.__parsed_workflow()
+            return True
+        except Exception:
+            return False
+
+
+    def conda_env_files( self ):
+        '''
+        Retrieve the conda environment files of all rules (parse the workflow first, if necessary).
+
+        :return: list of paths (without duplicates)
+        '''
+        env_files = []
+        for rule in self.__parsed_workflow().rules:
+            # Environment files defined via wildcards are only known for specific jobs.
+            if rule.conda_env is None or '{' in str( rule.conda_env ):
+                continue
+            env_file = Path( str( rule.conda_env ) )
+            if env_file not in env_files:
+                env_files.append( env_file )
+
+        return env_files
+
+
+    def __parsed_workflow( self ):
+        '''
+        Retrieve the parsed workflow, parse it (again) if there is none or if the freeze digest has changed.
+        '''
+        digest_hash = self.freeze.digest_hash() if self.freeze is not None else None
+
+        if self.__workflow is None or not digest_hash == self.__digest_hash:
+            self.__workflow = None
+            self.__workflow = self.__parse()
+            self.__digest_hash = digest_hash
+
+        return self.__workflow
+
+
+    def __parse( self ):
+        from snakemake.io import load_configfile
+        from snakemake.workflow import Workflow
+
+        # Using individual conda environments for each snakemake rule is
+        # currently not working on Windows (see function run_workflow).
+        use_conda = False if platform.system() == 'Windows' else True
+
+        workflow = Workflow(
+            snakefile = str( self.snakefile ),
+            overwrite_config = load_configfile( str( self.config_file ) ),
+            overwrite_configfiles = [ str( self.config_file ) ],
+            use_conda = use_conda,
+            conda_frontend = 'conda',
+            cores = self.num_cores,
+            resources = dict( self.resources )
+        )
+
+        workflow.include( str( self.snakefile ), overwrite_first_rule = True )
+        workflow.check()
+
+        self.num_parsed += 1
+
+        return workflow